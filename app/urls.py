@@ -12,6 +12,7 @@ from core.admin_views import (
     member_invoice_preview,
     member_invoice_preview_default,
     send_invoice_ubl,
+    invoice_ubl_export,
     yearly_invoice_preview_logo,
     yearly_invoice_preview_preprinted,
     yearly_invoice_print_logo,
@@ -21,6 +22,7 @@ from core.admin_views import (
     yearly_invoice_batch_print_logo,
     yearly_invoice_batch_print_preprinted,
     admin_yearly_totals,
+    yearly_invoice_pdf_export,
 )
 
 urlpatterns = [
@@ -31,6 +33,8 @@ urlpatterns = [
         send_invoice_ubl,
         name="invoice-send-ubl",
     ),
+    # UBL-bulkexport (ZIP) per jaar of periode
+    path("admin/invoice/ubl-export/", invoice_ubl_export, name="invoice-ubl-export"),
     path(
         "admin/invoice/preview/<int:member_id>/<int:year>/",
         member_invoice_preview,
@@ -90,6 +94,12 @@ urlpatterns = [
         admin_yearly_totals,
         name="admin-yearly-totals",
     ),
+    # server-side PDF-export (starten via POST, downloaden via GET)
+    path(
+        "admin/invoice/year/<int:year>/pdf/<str:papier>/",
+        yearly_invoice_pdf_export,
+        name="yearly-invoice-pdf-export",
+    ),
 
     # oud yearpricing-adres doorsturen naar de nieuwe annualpricing
     path("admin/core/yearpricing/", RedirectView.as_view(url="/admin/core/annualpricing/", permanent=True)),
@@ -323,6 +323,10 @@ _Skip = {
     apps.get_model("core", "YearPricing"),   # vervangen door AnnualPricingAdmin
     apps.get_model("core", "AnnualPricing"), # krijgt eigen custom admin hieronder
     apps.get_model("core", "InvoiceLine"),   # alleen inline binnen factuur, niet als apart menu-item
+    apps.get_model("core", "YearTotalsSnapshot"),  # interne cache voor de totaalpagina
+    apps.get_model("core", "UblDocument"),  # interne cache van gefinaliseerde UBL
+    apps.get_model("core", "Outbox"),  # krijgt eigen admin bij de factuur-admin
+    apps.get_model("core", "ImportCheckpoint"),  # interne voortgang van de CSV-importen
     # laat Member/Product/Invoice staan (custom admins actief)
 }
 # Zorg dat verborgen modellen niet zichtbaar zijn als ze eerder geregistreerd werden
@@ -649,6 +653,23 @@ class _InvLineInline(_admin.TabularInline):
         js = ("core/invoice.inline.v3.js",)
         css = {"all": ("core/admin.invoice.inline.css",)}
 
+class _OutboxInline(_admin.TabularInline):
+    """Status van de UBL-doorsturing (wachtrij, zie core/outbox.py); enkel lezen."""
+    model = apps.get_model("core", "Outbox")
+    fk_name = "invoice"
+    verbose_name = "UBL-verzending"
+    verbose_name_plural = "UBL-verzendingen"
+    fields = ("recipient", "status", "attempts", "next_attempt_at", "sent_at", "last_error")
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 if MemberAsset is not None:
     class MemberAssetInline(_admin.TabularInline):
         model = MemberAsset
@@ -666,43 +687,89 @@ class _InvAdmin(_admin.ModelAdmin):
     # BELANGRIJK: dit zet jouw custom template met de print/preview knoppen terug
     change_form_template = "admin/core/invoice/change_form.html"
 
-    list_display = ("id", "number", "status", "member", "issue_date")
+    list_display = ("id", "number", "status", "member", "issue_date", "total_excl_col", "total_incl_col", "ubl_status")
     list_filter = ("issue_date",)
     date_hierarchy = "issue_date"
-    inlines = [_InvLineInline]
+    inlines = [_InvLineInline, _OutboxInline]
 
-    actions = ["finalize_selected"]
+    actions = ["finalize_selected", "download_ubl_zip", "queue_ubl_to_billit"]
 
-    def save_model(self, request, obj, form, change):
-        # Eerst normaal opslaan
-        super().save_model(request, obj, form, change)
+    def get_queryset(self, request):
+        from django.db.models import Prefetch
+        qs = super().get_queryset(request).select_related("member").with_totals()  # totalen in SQL, sorteerbaar
+        return qs.prefetch_related(
+            Prefetch("outbox", queryset=apps.get_model("core", "Outbox").objects.order_by("-created_at").only("invoice_id", "status", "created_at"))
+        )
+
+    @_admin.display(description="Totaal excl.", ordering="lines_excl_sum")
+    def total_excl_col(self, obj):
+        return f"€ {obj.total_excl:.2f}"
+
+    @_admin.display(description="Totaal incl.", ordering="lines_incl_sum")
+    def total_incl_col(self, obj):
+        return f"€ {obj.total_incl:.2f}"
+
+    @_admin.display(description="UBL")
+    def ubl_status(self, obj):
+        latest = next(iter(obj.outbox.all()), None)
+        return latest.get_status_display() if latest else "—"
 
-        # Als hij op finalized staat maar nog geen nummer heeft, genereer nummer + OGM
-        if getattr(obj, "status", "") == "finalized" and not getattr(obj, "number", None):
+    def save_model(self, request, obj, form, change):
+        # Overgang naar finalized uit de geladen status (LoadedStateMixin): het nummer
+        # alleen zegt niets meer, core/numbering.py kent het al toe tijdens save()
+        finalizing = obj.status == obj.STATUS_FINAL and obj.has_changed("status")
+        if finalizing:
+            obj._finalized_in_form = True  # lijnen worden pas in save_related bewaard
+        if finalizing and not obj.number:
+            # eerst als concept opslaan, dan finalize(): nummer, OGM en totalen samen
+            obj.status = obj.loaded_value("status", obj.STATUS_DRAFT)
+            super().save_model(request, obj, form, change)
             try:
                 obj.finalize()   # zet number, payment_reference_raw (OGM) en status
             except Exception as e:
+                obj._finalized_in_form = False
                 from django.contrib import messages
-                messages.error(request, f"Finaliseren bij opslaan mislukte: {e}")    
+                messages.error(request, f"Finaliseren bij opslaan mislukte: {e}")
+            return
+        # handmatig ingevuld nummer: valideren + OGM via core/numbering.py
+        super().save_model(request, obj, form, change)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if getattr(form.instance, "_finalized_in_form", False):
+            # totalen bevriezen op de lijnen die samen met het finaliseren bewaard werden
+            from core.invoice_totals import refresh_invoice_totals
+            refresh_invoice_totals([form.instance.pk], include_finalized=True)
 
     def finalize_selected(self, request, queryset):
-        # enkel concept-facturen finaliseren
-        to_finalize = queryset.filter(
-            Q(status="draft") | Q(number__isnull=True) | Q(number__exact="")
-        )        
-        count = 0
-        for inv in to_finalize:
-            try:
-                inv.finalize()  # gebruikt jouw bestaande methode op het model
-                count += 1
-            except Exception as e:
-                messages.error(request, f"Kon factuur {inv.pk} niet finaliseren: {e}")
-        if count:
-            messages.success(request, f"{count} factuur/facturen gefinaliseerd.")
+        # enkel concept-facturen finaliseren; één transactie, één nummerblok per jaar
+        from core.invoice_numbers import finalize_invoices
+        try:
+            done = finalize_invoices(queryset.values_list("pk", flat=True))
+        except Exception as e:
+            messages.error(request, f"Kon facturen niet finaliseren: {e}")
+            return
+        if done:
+            messages.success(request, f"{len(done)} factuur/facturen gefinaliseerd.")
         else:
             messages.warning(request, "Geen conceptfacturen om te finaliseren.")
     finalize_selected.short_description = "Finalizeer geselecteerde facturen"
 
+    def download_ubl_zip(self, request, queryset):
+        # enkel gefinaliseerde facturen komen in de ZIP (zie core.ubl_export)
+        from core.admin_views import ubl_zip_response
+        return ubl_zip_response(queryset, "ubl-selectie.zip")
+    download_ubl_zip.short_description = "Download UBL (ZIP) van geselecteerde facturen"
+
+    def queue_ubl_to_billit(self, request, queryset):
+        from core.outbox import queue_invoices_ubl
+        count = queue_invoices_ubl(queryset)
+        if count:
+            messages.success(request, f"{count} UBL-bericht(en) in de wachtrij gezet (process_outbox verstuurt ze).")
+        else:
+            messages.warning(request, "Geen gefinaliseerde facturen in de selectie.")
+    queue_ubl_to_billit.short_description = "UBL naar Billit sturen (wachtrij)"
+
     # --- 3c: Factuur read-only als status = finalized ---
     def get_readonly_fields(self, request, obj=None):
         ro = list(super().get_readonly_fields(request, obj))
@@ -727,6 +794,27 @@ except Exception:
 _admin.site.register(_Inv, _InvAdmin)
 
 
+class _OutboxAdmin(_admin.ModelAdmin):
+    list_display = ("created_at", "invoice", "recipient", "status", "attempts", "next_attempt_at", "sent_at")
+    list_filter = ("status",)
+    search_fields = ("subject", "recipient", "invoice__number")
+    readonly_fields = ("invoice", "recipient", "sender", "subject", "body", "attachment_name",
+                       "status", "attempts", "next_attempt_at", "locked_at", "last_error", "created_at", "sent_at")
+    exclude = ("attachment", "attachment_mimetype")
+    actions = ["retry_selected"]
+
+    def has_add_permission(self, request):
+        return False
+
+    def retry_selected(self, request, queryset):
+        from core.outbox import retry_failed
+        count = retry_failed(queryset)
+        messages.success(request, f"{count} bericht(en) opnieuw in de wachtrij gezet.")
+    retry_selected.short_description = "Mislukte berichten opnieuw proberen"
+
+_admin.site.register(apps.get_model("core", "Outbox"), _OutboxAdmin)
+
+
 class _ProdAdmin(_admin.ModelAdmin):
     list_display = ("name",)
     search_fields = ("name",)
@@ -1,21 +1,33 @@
-from decimal import Decimal, ROUND_HALF_UP
+import base64
+import json
+import logging
+from decimal import Decimal
 from datetime import date
 from django.apps import apps
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import admin
-from django.core.mail import EmailMessage
 from django.conf import settings
-from django.http import JsonResponse
+from django.db import DatabaseError
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.http import urlencode
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template.loader import get_template
 from django.template.response import TemplateResponse
 from django.utils import timezone
-from django.db.models import Q
 from django.urls import reverse
+from bisect import bisect_left, bisect_right
+from itertools import chain
 from types import SimpleNamespace
-import xml.etree.ElementTree as ET
 
+from .billing_engine import (
+    _account_display, _billing_owner, _build_member_preview, _member_display_name, _q,
+    preview_invoice_lines,
+)
+from .billing_snapshot import BillingSnapshot, owner_sort_key
+from .ubl_writer import ubl_bytes
+
+logger = logging.getLogger(__name__)
 
 Invoice = apps.get_model("core", "Invoice")
 InvoiceLine = apps.get_model("core", "InvoiceLine")
@@ -31,9 +43,6 @@ try:
 except LookupError:
     YearPricing = None
 
-def _q(val):
-    return Decimal(str(val or "0")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-
 def _split_amount(d):
     s = f"{_q(d):.2f}"
     i, dec = s.split(".")
@@ -70,11 +79,11 @@ def _vat_summary(lines):
         b["incl"] = _q(b["incl"] + l["line_incl"])
     return [bucket[k] for k in sorted(bucket)]
 
-def _org_and_payment():
+def _org_and_payment(profiles=None):
     # Kies het meest complete OrganizationProfile
-    qs = OrganizationProfile.objects.all()
+    qs = OrganizationProfile.objects.all() if profiles is None else profiles
     op = None
-    if qs.exists():
+    if profiles is not None or qs.exists():
         def _score(o):
             fields = [
                 "name","address_line1","address_line2","postal_code","city","country",
@@ -82,7 +91,8 @@ def _org_and_payment():
                 "phone","fax",   # <- toegevoegd
             ]
             return sum(1 for f in fields if getattr(o, f, None))
-        op = sorted(qs, key=_score, reverse=True)[0]
+        ranked = sorted(qs, key=_score, reverse=True)
+        op = ranked[0] if ranked else None
 
     # Geef ALLE velden door zodat templates zoals _footer_org.html ze kunnen gebruiken
     org = {
@@ -113,118 +123,9 @@ def _org_and_payment():
 def _ubl_text(invoice, org, lines):
     """
     Bouw een minimale UBL 2.1 factuur op basis van het dagfactuur-model.
+    (Eén-doorgangs-writer in core/ubl_writer.py; output identiek aan de vroegere ElementTree-versie.)
     """
-    NS = {
-        "cbc": "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2",
-        "cac": "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2",
-        "": "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2",
-    }
-    for pfx, uri in NS.items():
-        if pfx:
-            ET.register_namespace(pfx, uri)
-        else:
-            ET.register_namespace("", uri)
-
-    def _el(tag, text=None, ns="cbc"):
-        q = f"{{{NS[ns]}}}{tag}"
-        elem = ET.Element(q)
-        if text not in (None, ""):
-            elem.text = str(text)
-        return elem
-
-    inv = ET.Element(f"{{{NS['']}}}Invoice")
-    inv.append(_el("CustomizationID", "urn:cen.eu:en16931:2017"))
-    inv.append(_el("ProfileID", "urn:fdc:peppol.eu:2017:poacc:billing:01:1.0"))
-    inv.append(_el("ID", invoice.number or f"concept-{invoice.pk or 'temp'}"))
-    inv.append(_el("IssueDate", invoice.issue_date.isoformat()))
-    inv.append(_el("InvoiceTypeCode", "380"))
-    inv.append(_el("DocumentCurrencyCode", "EUR"))
-
-    # Leverancier (club)
-    acct_supplier = ET.SubElement(inv, f"{{{NS['cac']}}}AccountingSupplierParty")
-    party = ET.SubElement(acct_supplier, f"{{{NS['cac']}}}Party")
-    party.append(_el("EndpointID", org.get("vat_number") or "BE0000000000"))
-    party_name = ET.SubElement(party, f"{{{NS['cac']}}}PartyName")
-    party_name.append(_el("Name", org.get("name", "")))
-    postal = ET.SubElement(party, f"{{{NS['cac']}}}PostalAddress")
-    postal.append(_el("StreetName", org.get("address_line1", "")))
-    postal.append(_el("AdditionalStreetName", org.get("address_line2", "")))
-    postal.append(_el("CityName", org.get("city", "")))
-    postal.append(_el("PostalZone", org.get("postal_code", "")))
-    postal.append(_el("CountrySubentity", ""))
-    country = ET.SubElement(postal, f"{{{NS['cac']}}}Country")
-    country.append(_el("IdentificationCode", (org.get("country") or "BE")[:2].upper()))
-    tax_scheme = ET.SubElement(party, f"{{{NS['cac']}}}PartyTaxScheme")
-    tax_scheme.append(_el("CompanyID", org.get("vat_number", "")))
-    tax_scheme.append(ET.Element(f"{{{NS['cac']}}}TaxScheme"))
-    contact = ET.SubElement(party, f"{{{NS['cac']}}}Contact")
-    contact.append(_el("Telephone", org.get("phone", "")))
-    contact.append(_el("ElectronicMail", org.get("email", "")))
-
-    # Klant (account of member)
-    acct_customer = ET.SubElement(inv, f"{{{NS['cac']}}}AccountingCustomerParty")
-    cust_party = ET.SubElement(acct_customer, f"{{{NS['cac']}}}Party")
-    cust_name = ET.SubElement(cust_party, f"{{{NS['cac']}}}PartyName")
-    cust_name.append(_el("Name", getattr(invoice.account, "name", "") or str(getattr(invoice, "member", "") or "Klant")))
-    cust_addr = ET.SubElement(cust_party, f"{{{NS['cac']}}}PostalAddress")
-    cust_addr.append(_el("StreetName", getattr(invoice.account, "street", "") or getattr(invoice.member, "street", "")))
-    cust_addr.append(_el("CityName", getattr(invoice.account, "city", "") or getattr(invoice.member, "city", "")))
-    cust_addr.append(_el("PostalZone", getattr(invoice.account, "postal_code", "") or getattr(invoice.member, "postal_code", "")))
-    cust_country = ET.SubElement(cust_addr, f"{{{NS['cac']}}}Country")
-    cust_country.append(_el("IdentificationCode", (getattr(invoice.account, "country", "") or getattr(invoice.member, "country", "") or "BE")[:2].upper()))
-    cust_tax = ET.SubElement(cust_party, f"{{{NS['cac']}}}PartyTaxScheme")
-    cust_tax.append(_el("CompanyID", getattr(invoice.account, "vat_number", "") or ""))
-    cust_tax.append(ET.Element(f"{{{NS['cac']}}}TaxScheme"))
-    cust_contact = ET.SubElement(cust_party, f"{{{NS['cac']}}}Contact")
-    cust_contact.append(_el("ElectronicMail", getattr(invoice.account, "email", "") or getattr(invoice.member, "email", "")))
-
-    # Lijnen
-    total_excl = Decimal("0.00")
-    total_vat = Decimal("0.00")
-    for idx, l in enumerate(lines, start=1):
-        qty = _q(getattr(l, "quantity", 1))
-        unit = _q(getattr(l, "unit_price_excl", 0))
-        vat_rate = Decimal(str(getattr(l, "vat_rate", 0) or 0))
-        line_excl = _q(qty * unit)
-        vat_amount = _q(line_excl * vat_rate / Decimal("100"))
-        line_incl = _q(line_excl + vat_amount)
-        total_excl += line_excl
-        total_vat += vat_amount
-
-        inv_line = ET.SubElement(inv, f"{{{NS['cac']}}}InvoiceLine")
-        inv_line.append(_el("ID", idx))
-        inv_line.append(_el("InvoicedQuantity", f"{qty}", ns="cbc"))
-        inv_line.append(_el("LineExtensionAmount", f"{line_excl}", ns="cbc"))
-        inv_line.append(_el("Note", getattr(l, "description", "")))
-        pricing = ET.SubElement(inv_line, f"{{{NS['cac']}}}PricingReference")
-        alt_price = ET.SubElement(pricing, f"{{{NS['cac']}}}AlternativeConditionPrice")
-        alt_price.append(_el("PriceAmount", f"{unit}", ns="cbc"))
-        alt_price.append(_el("PriceTypeCode", "EXW"))
-        tax_total = ET.SubElement(inv_line, f"{{{NS['cac']}}}TaxTotal")
-        tax_total.append(_el("TaxAmount", f"{vat_amount}", ns="cbc"))
-        tax_sub = ET.SubElement(tax_total, f"{{{NS['cac']}}}TaxSubtotal")
-        tax_sub.append(_el("TaxableAmount", f"{line_excl}", ns="cbc"))
-        tax_sub.append(_el("TaxAmount", f"{vat_amount}", ns="cbc"))
-        category = ET.SubElement(tax_sub, f"{{{NS['cac']}}}TaxCategory")
-        category.append(_el("ID", "S"))
-        category.append(_el("Percent", f"{vat_rate}", ns="cbc"))
-        scheme = ET.SubElement(category, f"{{{NS['cac']}}}TaxScheme")
-        scheme.append(_el("ID", "VAT"))
-        item = ET.SubElement(inv_line, f"{{{NS['cac']}}}Item")
-        item.append(_el("Name", getattr(l, "description", "")))
-        price = ET.SubElement(inv_line, f"{{{NS['cac']}}}Price")
-        price.append(_el("PriceAmount", f"{unit}", ns="cbc"))
-
-    # Totaal
-    tax_total = ET.SubElement(inv, f"{{{NS['cac']}}}TaxTotal")
-    tax_total.append(_el("TaxAmount", f"{total_vat}", ns="cbc"))
-    legal_monetary = ET.SubElement(inv, f"{{{NS['cac']}}}LegalMonetaryTotal")
-    legal_monetary.append(_el("LineExtensionAmount", f"{total_excl}", ns="cbc"))
-    legal_monetary.append(_el("TaxExclusiveAmount", f"{total_excl}", ns="cbc"))
-    legal_monetary.append(_el("TaxInclusiveAmount", f"{_q(total_excl + total_vat)}", ns="cbc"))
-    legal_monetary.append(_el("PayableAmount", f"{_q(total_excl + total_vat)}", ns="cbc"))
-
-    return ET.tostring(inv, encoding="utf-8", xml_declaration=True)
+    return ubl_bytes(invoice, org, lines)
 
 def _ctx_for(invoice):
     lines = _lines_for(invoice)
@@ -310,32 +211,60 @@ def send_invoice_ubl(request, pk: int):
     if request.method != "POST":
         return redirect("daily-invoice-preview", pk=pk)
 
-    org, _payment = _org_and_payment()
-    ubl_bytes = _ubl_text(invoice, org, InvoiceLine.objects.filter(invoice=invoice).order_by("id"))
-
-    recipient = getattr(settings, "BILLIT_FORWARD_EMAIL", None) or "spiegelvengolf-ylcpib6-nosplit@my.billit.be"
-    sender = getattr(settings, "DEFAULT_FROM_EMAIL", None) or org.get("email") or "no-reply@example.com"
-    subject = f"UBL factuur {invoice.number or 'concept'}"
-    body = "UBL factuur bijgevoegd (Peppol/Billit doorgifte)."
+    # niet meer synchroon versturen: `manage.py process_outbox` verstuurt de wachtrij
+    from .outbox import queue_invoice_ubl
 
-    email = EmailMessage(
-        subject=subject,
-        body=body,
-        from_email=sender,
-        to=[recipient],
-    )
-    filename = f"invoice-{invoice.number or invoice.pk or 'concept'}.xml"
-    email.attach(filename, ubl_bytes, "application/xml")
     try:
-        email.send(fail_silently=False)
-        messages.success(request, f"UBL verzonden naar {recipient}.")
+        message = queue_invoice_ubl(invoice)
+        messages.success(request, f"UBL in wachtrij gezet voor {message.recipient}.")
     except Exception as exc:
-        messages.error(request, f"Kon UBL niet versturen: {exc}")
+        messages.error(request, f"Kon UBL niet in de wachtrij zetten: {exc}")
 
     referer = request.META.get("HTTP_REFERER") or reverse("daily-invoice-preview", args=[pk])
     return redirect(referer)
 
 
+def ubl_zip_response(queryset, filename: str):
+    from .ubl_export import stream_ubl_zip
+
+    response = StreamingHttpResponse(stream_ubl_zip(queryset), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def _parse_date(raw):
+    try:
+        return date.fromisoformat(raw) if raw else None
+    except ValueError:
+        return None
+
+
+@staff_member_required
+def invoice_ubl_export(request):
+    """
+    UBL-bestanden van alle gefinaliseerde facturen als ZIP.
+    ?jaar=2025 of ?van=2025-01-01&tot=2025-03-31 (grenzen inbegrepen).
+    """
+    qs = Invoice.objects.all()
+    year = request.GET.get("jaar") or request.GET.get("year")
+    start = _parse_date(request.GET.get("van"))
+    end = _parse_date(request.GET.get("tot"))
+    if year:
+        try:
+            qs = qs.filter(issue_date__year=int(year))
+        except ValueError:
+            messages.error(request, "Ongeldig jaar voor UBL-export.")
+            return redirect(reverse("admin:core_invoice_changelist"))
+        label = str(int(year))
+    else:
+        if start:
+            qs = qs.filter(issue_date__gte=start)
+        if end:
+            qs = qs.filter(issue_date__lte=end)
+        label = f"{start or 'begin'}_{end or 'einde'}"
+    return ubl_zip_response(qs, f"ubl-{label}.zip")
+
+
 class _YearInvoiceStub:
     """Kleine container zodat templates een factuur-object hebben."""
 
@@ -369,44 +298,24 @@ class _YearInvoiceStub:
         return "Concept"
 
 
-def _yearly_invoice_context(member, year: int):
-    preview = _build_member_preview(member, year)
-    invoice_obj = (
-        Invoice.objects.filter(member=member, issue_date__year=year)
-        .order_by("-issue_date")
-        .first()
-    )
+def _yearly_invoice_context(member, year: int, snapshot=None, preview=None):
+    if preview is None:
+        preview = _build_member_preview(member, year, snapshot=snapshot)
+    if snapshot is not None:
+        invoice_obj = snapshot.invoice_for(member)
+    else:
+        invoice_obj = (
+            Invoice.objects.filter(member=member, issue_date__year=year)
+            .order_by("-issue_date")
+            .first()
+        )
     if invoice_obj is None:
         invoice_obj = _YearInvoiceStub(member, year)
 
-    lines = []
-    for section in preview["sections"]:
-        person = section.get("member")
-        display_name = section.get("display_name") or _member_display_name(person)
-        for raw_line in section.get("lines", []):
-            desc = raw_line.get("desc") or ""
-            if display_name and display_name.lower() not in desc.lower():
-                description = f"{display_name}: {desc}"
-            else:
-                description = desc
-            qty = _q(raw_line.get("qty") or Decimal("1"))
-            unit = _q(raw_line.get("unit") or Decimal("0"))
-            vat_rate = Decimal(str(raw_line.get("vat_rate") or "0"))
-            line_excl = _q(raw_line.get("total") or qty * unit)
-            vat_amount = _q(raw_line.get("total_vat") or (line_excl * vat_rate / Decimal("100")))
-            line_incl = _q(raw_line.get("total_incl") or (line_excl + vat_amount))
-            lines.append({
-                "description": description,
-                "quantity": qty,
-                "unit_price_excl": unit,
-                "vat_rate": vat_rate,
-                "line_excl": line_excl,
-                "vat_amount": vat_amount,
-                "line_incl": line_incl,
-            })
+    lines = preview_invoice_lines(preview)
 
     vat_summary = _vat_summary(lines) if lines else []
-    org, payment = _org_and_payment()
+    org, payment = _org_and_payment(snapshot.org_profiles if snapshot is not None else None)
 
     ogm = ""
     payment_ref = getattr(invoice_obj, "payment_reference_display", None)
@@ -435,46 +344,142 @@ def _yearly_invoice_context(member, year: int):
     }
 
 
-def _iter_yearly_invoice_contexts(year: int):
-    active_members = Member.objects.filter(active=True)
-    owner_map = {}
-    for person in active_members:
-        owner = _billing_owner(person)
-        owner_pk = getattr(owner, "pk", None)
-        if owner_pk is None:
+def _stream_yearly_invoice_contexts(year: int, snapshot=None):
+    """Generator-variant: één context per huishouden met lijnen, zonder de hele lijst bij te houden."""
+    if snapshot is None:
+        snapshot = BillingSnapshot(year)
+    for owner in snapshot.owners():
+        ctx = _yearly_invoice_context(owner, year, snapshot=snapshot)
+        if ctx["lines"]:
+            yield ctx
+
+
+BATCH_PAGE_MAX = 500
+
+
+def _encode_sort_key(key):
+    # JSON in url-veilige base64: namen mogen elk teken bevatten (ook '|' of '&')
+    last, first, pk = key
+    raw = json.dumps([last, first, pk], ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_sort_key(raw):
+    """Cursor van _encode_sort_key → sorteersleutel, of None als de waarde ongeldig is."""
+    if not raw:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(raw + "=" * (-len(raw) % 4)).decode("utf-8"))
+        last, first, pk = data
+    except (ValueError, TypeError):  # ook binascii.Error en UnicodeDecodeError
+        return None
+    if not (isinstance(last, str) and isinstance(first, str) and isinstance(pk, int)):
+        return None
+    return (last.casefold(), first.casefold(), pk)
+
+
+def _yearly_batch_page(year: int, limit: int, after=None, before=None, snapshot=None):
+    """
+    Keyset-paginering over de factuurhouders in dezelfde volgorde als de batch
+    (familienaam, voornaam, pk). Enkel huishoudens met lijnen tellen mee.
+    Retourneert (contexts, vorige_sleutel, volgende_sleutel).
+    """
+    if snapshot is None:
+        snapshot = BillingSnapshot(year)
+    owners = snapshot.owners()
+    keys = [owner_sort_key(o) for o in owners]
+
+    def _has_lines(owner):
+        preview = _build_member_preview(owner, year, snapshot=snapshot)
+        return any(section["lines"] for section in preview["sections"])
+
+    if before is not None:
+        end = bisect_left(keys, before)
+        indexes = range(end - 1, -1, -1)
+    else:
+        start = bisect_right(keys, after) if after is not None else 0
+        indexes = range(start, len(owners))
+
+    picked = []
+    more = False
+    for i in indexes:
+        ctx = _yearly_invoice_context(owners[i], year, snapshot=snapshot)
+        if not ctx["lines"]:
             continue
-        owner_map.setdefault(owner_pk, owner)
-
-    owners = sorted(
-        owner_map.values(),
-        key=lambda m: (
-            (getattr(m, "last_name", "") or "").casefold(),
-            (getattr(m, "first_name", "") or "").casefold(),
-            getattr(m, "pk", 0),
-        ),
+        if len(picked) == limit:
+            more = True
+            break
+        picked.append((i, ctx))
+    if before is not None:
+        picked.reverse()
+    if not picked:
+        return [], None, None
+
+    first_i, last_i = picked[0][0], picked[-1][0]
+    if before is not None:
+        has_prev = more
+        has_next = any(_has_lines(o) for o in owners[last_i + 1:])
+    else:
+        has_prev = any(_has_lines(o) for o in reversed(owners[:first_i]))
+        has_next = more
+    return (
+        [ctx for _i, ctx in picked],
+        keys[first_i] if has_prev else None,
+        keys[last_i] if has_next else None,
     )
 
-    contexts = []
-    for owner in owners:
-        ctx = _yearly_invoice_context(owner, year)
-        if ctx["lines"]:
-            contexts.append(ctx)
-    return contexts
+
+def _batch_page_params(request):
+    try:
+        limit = int(request.GET.get("limit") or 0)
+    except (TypeError, ValueError):
+        limit = 0
+    if limit <= 0:
+        return None
+    return {
+        "limit": min(limit, BATCH_PAGE_MAX),
+        "after": _decode_sort_key(request.GET.get("after")),
+        "before": _decode_sort_key(request.GET.get("before")),
+    }
 
 
 def _yearly_batch_response(request, year: int, papier: str, view_mode: str):
-    contexts = _iter_yearly_invoice_contexts(year)
-    if not contexts:
+    page_info = None
+    params = _batch_page_params(request)
+    if params is None:
+        contexts = _stream_yearly_invoice_contexts(year)
+    else:
+        page, prev_key, next_key = _yearly_batch_page(
+            year, params["limit"], after=params["after"], before=params["before"],
+        )
+        contexts = iter(page)
+        page_info = {
+            "limit": params["limit"],
+            "count": len(page),
+            "prev_url": f"{request.path}?{urlencode({'before': _encode_sort_key(prev_key), 'limit': params['limit']})}" if prev_key else None,
+            "next_url": f"{request.path}?{urlencode({'after': _encode_sort_key(next_key), 'limit': params['limit']})}" if next_key else None,
+        }
+    first = next(contexts, None)
+    if first is None:
         messages.info(request, f"Geen jaarfacturen met lijnen gevonden voor {year}.")
         url = f"{reverse('admin-yearly-totals')}?jaar={year}"
         return redirect(url)
-    template = "invoices/preview_batch.html" if view_mode == "preview" else "invoices/print_batch.html"
-    return render(request, template, {
-        "year": year,
-        "papier": papier,
-        "invoices": contexts,
-        "mode": view_mode,
-    })
+
+    # Kop, één stuk per factuur en staart apart renderen: de browser krijgt meteen
+    # de eerste factuur en de worker houdt nooit de volledige HTML in het geheugen.
+    name = "preview_batch" if view_mode == "preview" else "print_batch"
+    head = get_template(f"invoices/_{name}_head.html")
+    page = get_template(f"invoices/_{name}_page.html")
+    tail = get_template(f"invoices/_{name}_tail.html")
+    base = {"year": year, "papier": papier, "mode": view_mode, "page": page_info}
+
+    def _chunks():
+        yield head.render({**base, "invoices": [first]}, request)
+        for ctx in chain([first], contexts):
+            yield page.render({**base, "inv_ctx": ctx})
+        yield tail.render(base)
+
+    return StreamingHttpResponse(_chunks(), content_type="text/html; charset=utf-8")
 
 
 @staff_member_required
@@ -575,439 +580,6 @@ def products_catalog_json(request):
 
 # ---------- Lidfactuur-preview (volgend jaar) ----------
 
-def _member_age_on(year: int, dob):
-    if not dob:
-        return None
-    ref = date(year, 1, 1)
-    try:
-        return max(0, ref.year - dob.year - ((ref.month, ref.day) < (dob.month, dob.day)))
-    except Exception:
-        return None
-
-def _member_role_tag(member):
-    val = (getattr(member, "household_role", "") or "").strip().lower()
-    if val in {"prt", "partner", "partner_role", "husband", "wife"}:
-        return "PRT"
-    if val in {"kid", "child"}:
-        return "KID"
-    return "IND"
-
-def _member_display_name(member):
-    first = (getattr(member, "first_name", "") or "").strip()
-    last = (getattr(member, "last_name", "") or "").strip()
-    name = " ".join(part for part in (first, last) if part)
-    if name:
-        return name
-    fallback = getattr(member, "last_name", None) or getattr(member, "first_name", None)
-    if fallback:
-        return str(fallback)
-    return str(member)
-
-def _member_role_display(member):
-    display_method = getattr(member, "get_household_role_display", None)
-    if callable(display_method):
-        label = display_method() or ""
-        return label.strip()
-    raw = getattr(member, "household_role", "") or ""
-    return raw.strip()
-
-def _billing_owner(member, _seen=None):
-    pk = getattr(member, "pk", None)
-    if _seen is None:
-        _seen = set()
-    if pk and pk in _seen:
-        return member
-    if pk:
-        _seen.add(pk)
-    if getattr(member, "billing_account_id", None):
-        return member
-    via = getattr(member, "factureren_via", None)
-    via_pk = getattr(via, "pk", None)
-    if via and via_pk and via_pk != pk:
-        return _billing_owner(via, _seen)
-    head = getattr(member, "household_head", None)
-    head_pk = getattr(head, "pk", None)
-    if head and head_pk and head_pk != pk:
-        return _billing_owner(head, _seen)
-    return member
-
-def _account_display(account):
-    if not account:
-        return ""
-    parts = []
-    name = (getattr(account, "name", "") or "").strip()
-    if name:
-        parts.append(name)
-    email = (getattr(account, "email", "") or "").strip()
-    if email:
-        parts.append(email)
-    address_parts = [
-        (getattr(account, "street", "") or "").strip(),
-        " ".join(filter(None, [
-            (getattr(account, "postal_code", "") or "").strip(),
-            (getattr(account, "city", "") or "").strip(),
-        ])).strip(),
-    ]
-    address = " ".join(part for part in address_parts if part).strip()
-    if address:
-        parts.append(address)
-    return " — ".join(parts) if parts else str(account)
-
-def _household_dependents(head):
-    if Member is None:
-        return []
-    qs = Member.objects.filter(active=True).exclude(pk=head.pk)
-    qs = qs.filter(Q(factureren_via=head) | Q(household_head=head)).distinct()
-    return list(qs)
-
-def _federation_enabled(member):
-    exclusions = set(getattr(member, "billing_code_exclusions", []) or [])
-    if "FEDERATIE" in exclusions:
-        return False
-    val = getattr(member, "federale_bijdrage_via_spiegelven", None)
-    if val is None:
-        val = getattr(member, "federation_via_club", False)
-    return bool(val)
-
-def _membership_codes(member, year: int):
-    course = (getattr(member, "course", "") or "").strip().upper()
-    age = _member_age_on(year, getattr(member, "date_of_birth", None) or getattr(member, "birth_date", None))
-    role = _member_role_tag(member)
-
-    lid = None
-    fed = None
-
-    if course == "CC":
-        include_fed = _federation_enabled(member)
-        if age is None:
-            lid = f"LID_CC_{role}"
-            if include_fed:
-                fed = f"FED_CC_{role if role in {'IND', 'PRT'} else 'IND'}"
-        elif age <= 15:
-            lid = "LID_CC_KID_0_15"
-            if include_fed:
-                fed = "FED_CC_KID"
-        elif 16 <= age <= 21:
-            lid = "LID_CC_KID_16_21"
-            if include_fed:
-                fed = "FED_CC_KID"
-        elif 22 <= age <= 26:
-            lid = "LID_CC_YA_22_26"
-            if include_fed:
-                fed = f"FED_CC_{role}"
-        elif 27 <= age <= 29:
-            lid = "LID_CC_YA_27_29"
-            if include_fed:
-                fed = f"FED_CC_{role}"
-        elif 30 <= age <= 35:
-            lid = "LID_CC_YA_30_35"
-            if include_fed:
-                fed = f"FED_CC_{role}"
-        else:
-            lid = f"LID_CC_{role}"
-            if include_fed:
-                fed = f"FED_CC_{role}"
-    elif course == "P3":
-        base = role if role in {"IND", "PRT"} else "IND"
-        if age is None:
-            lid = f"P3_{base}"
-        elif age <= 21:
-            lid = "P3_KID"
-        else:
-            lid = f"P3_{base}"
-        fed = None
-
-    return [c for c in (lid, fed) if c]
-
-def _investment_codes(member, year: int):
-    codes = []
-    plan = getattr(member, "investment_plan", "") or ""
-    role = _member_role_tag(member)
-    if plan == getattr(Member, "INVESTMENT_PLAN_DIRECT", "direct"):
-        if getattr(member, "investment_direct_bill_next", False):
-            codes.append(f"INV_{role}")
-    if plan == getattr(Member, "INVESTMENT_PLAN_FLEX", "flex"):
-        if getattr(member, "flex_years_remaining", 0):
-            codes.append(f"INV_FLEX_{role}")
-    return codes
-
-def _asset_codes(member):
-    if MemberAsset is None:
-        return []
-    qs = MemberAsset.objects.filter(member=member)
-    try:
-        qs = qs.filter(active=True)
-    except Exception:
-        pass
-    return [c for c in qs.values_list("asset_type", flat=True) if c]
-
-def _unique_keep_order(seq):
-    seen = set()
-    out = []
-    for item in seq:
-        if item and item not in seen:
-            seen.add(item)
-            out.append(item)
-    return out
-
-def _apply_proration(lines, member):
-    for line in lines:
-        code = (line.get("code") or "").upper()
-        desc = (line.get("desc") or "").lower()
-        qty = Decimal(str(line.get("qty", "1")))
-        total = Decimal(str(line.get("total", "0") or 0))
-
-        if qty <= 0:
-            qty = Decimal("1")
-
-        plan = getattr(member, "investment_plan", "") or ""
-        if code in ("INV_IND", "INV_PRT") or ("invest" in desc and not code.startswith("INV_FLEX")):
-            if plan == getattr(Member, "INVESTMENT_PLAN_DIRECT", "direct") and getattr(member, "investment_direct_bill_next", False):
-                amount = getattr(member, "investment_direct_amount", None)
-                if amount is not None:
-                    try:
-                        new_total = Decimal(str(amount)).quantize(Decimal("0.01"))
-                    except Exception:
-                        new_total = Decimal("0.00")
-                    if new_total > 0:
-                        line["total"] = new_total
-                        line["unit"] = (new_total / qty).quantize(Decimal("0.01"))
-                        if not line.get("desc"):
-                            line["desc"] = "Investering (eenmalig)"
-                        continue
-            line["total"] = Decimal("0.00")
-            line["unit"] = Decimal("0.00")
-            continue
-
-        if code.startswith("INV_FLEX") or "flex" in desc:
-            if plan == getattr(Member, "INVESTMENT_PLAN_FLEX", "flex") and getattr(member, "flex_years_remaining", 0) > 0:
-                amount = getattr(member, "invest_flex_locked_amount", None)
-                if amount is not None:
-                    try:
-                        new_total = Decimal(str(amount)).quantize(Decimal("0.01"))
-                    except Exception:
-                        new_total = Decimal("0.00")
-                    if new_total > 0:
-                        line["total"] = new_total
-                        line["unit"] = (new_total / qty).quantize(Decimal("0.01"))
-                        if not line.get("desc"):
-                            line["desc"] = "Investering (flex)"
-                        continue
-            line["total"] = Decimal("0.00")
-            line["unit"] = Decimal("0.00")
-
-DESCRIPTIONS = {
-    "LID_CC_IND": "Lidgeld CC (individueel)",
-    "LID_CC_PRT": "Lidgeld CC (partner)",
-    "LID_CC_KID_0_15": "Lidgeld CC (kind 0–15)",
-    "LID_CC_KID_16_21": "Lidgeld CC (kind 16–21)",
-    "LID_CC_YA_22_26": "Lidgeld CC (jongvolw. 22–26)",
-    "LID_CC_YA_27_29": "Lidgeld CC (jongvolw. 27–29)",
-    "LID_CC_YA_30_35": "Lidgeld CC (jongvolw. 30–35)",
-    "FED_CC_IND": "Federatie CC (individueel)",
-    "FED_CC_PRT": "Federatie CC (partner)",
-    "FED_CC_KID": "Federatie CC (kind)",
-    "P3_IND": "Lidgeld P3 (individueel)",
-    "P3_PRT": "Lidgeld P3 (partner)",
-    "P3_KID": "Lidgeld P3 (kind)",
-    "INV_IND": "Investering (individueel)",
-    "INV_PRT": "Investering (partner)",
-    "INV_FLEX_IND": "Investering flex (individueel)",
-    "INV_FLEX_PRT": "Investering flex (partner)",
-    "VST_KAST": "Kast",
-    "KAR_KLN": "Kar-kast",
-    "KAR_ELEC": "E-kar-kast",
-}
-
-
-def _build_member_preview(member, year: int):
-    preview_members = [member]
-    member_pk = getattr(member, "pk", None)
-    member_head_id = getattr(member, "household_head_id", None)
-    # Neem ook afhankelijken mee als dit lid het gezinshoofd is (None of zichzelf).
-    if member_head_id is None or member_head_id == member_pk:
-        dependents = _household_dependents(member)
-        partners, children, others = [], [], []
-        partner_code = (getattr(Member, "ROLE_PARTNER", "partner") or "partner").lower()
-        child_code = (getattr(Member, "ROLE_CHILD", "child") or "child").lower()
-
-        def _sort_key(m):
-            return (
-                (getattr(m, "last_name", "") or "").lower(),
-                (getattr(m, "first_name", "") or "").lower(),
-                getattr(m, "pk", 0),
-            )
-
-        for dep in dependents:
-            role = (getattr(dep, "household_role", "") or "").strip().lower()
-            if role == partner_code:
-                partners.append(dep)
-            elif role == child_code:
-                children.append(dep)
-            else:
-                others.append(dep)
-
-        for group in (partners, children, others):
-            group.sort(key=_sort_key)
-
-        preview_members = [member, *partners, *children, *others]
-
-    member_codes = []
-    codes_seen = set()
-    for person in preview_members:
-        codes = _unique_keep_order(
-            _membership_codes(person, year)
-            + _investment_codes(person, year)
-            + _asset_codes(person)
-        )
-        exclusions = set(getattr(person, "billing_code_exclusions", []) or [])
-        if "LIDMAATSCHAP" in exclusions:
-            exclusions = (exclusions - {"LIDMAATSCHAP"}) | {
-                "LID_CC_IND",
-                "LID_CC_KID_0_15",
-                "LID_CC_KID_16_21",
-                "LID_CC_PRT",
-                "LID_CC_YA_22_26",
-                "LID_CC_YA_27_29",
-                "LID_CC_YA_30_35",
-                "P3_IND",
-                "P3_KID",
-                "P3_PRT",
-            }
-        if exclusions:
-            codes = [c for c in codes if c not in exclusions]
-        member_codes.append((person, codes))
-        codes_seen.update(codes)
-
-    price_map = {}
-    if YearPricing is not None and codes_seen:
-        # Eerst proberen het gevraagde jaar; als er niets is, neem het meest recente jaar met prijzen.
-        target_year = year
-        qs = YearPricing.objects.filter(year=target_year, code__in=codes_seen)
-        if not qs.exists():
-            fallback_year = (
-                YearPricing.objects.order_by("-year")
-                .values_list("year", flat=True)
-                .first()
-            )
-            if fallback_year:
-                target_year = fallback_year
-                qs = YearPricing.objects.filter(year=target_year, code__in=codes_seen)
-        for yp in qs:
-            try:
-                amount = Decimal(str(yp.amount or "0")).quantize(Decimal("0.01"))
-            except Exception:
-                amount = Decimal("0.00")
-            try:
-                vat_rate = Decimal(str(getattr(yp, "vat_rate", "0") or "0"))
-            except Exception:
-                vat_rate = Decimal("0")
-            price_map[yp.code] = {
-                "amount": amount,
-                "vat_rate": vat_rate,
-            }
-
-    sections = []
-    notes = []
-    for person, codes in member_codes:
-        billing_owner = _billing_owner(person)
-        member_pk = getattr(member, "pk", None)
-        owner_pk = getattr(billing_owner, "pk", None)
-        if member_pk is not None and owner_pk is not None and owner_pk != member_pk:
-            continue
-        if (member_pk is None or owner_pk is None) and billing_owner is not member:
-            continue
-
-        person_lines = []
-        for code in codes:
-            price_info = price_map.get(code)
-            if price_info is None:
-                notes.append(f"Geen prijs gevonden voor code {code} ({year}) voor {_member_display_name(person)}.")
-                amount = Decimal("0.00")
-                vat_rate = Decimal("0.00")
-            else:
-                amount = price_info.get("amount", Decimal("0.00"))
-                vat_rate = Decimal(str(price_info.get("vat_rate", "0") or 0))
-            qty = Decimal("1")
-            vat_rate_decimal = (vat_rate / Decimal("100"))
-            line_total = (amount * qty).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            line_vat = (line_total * vat_rate_decimal).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            person_lines.append({
-                "code": code,
-                "desc": DESCRIPTIONS.get(code, code),
-                "qty": qty,
-                "unit": amount,
-                "total": line_total,
-                "vat_rate": vat_rate,
-                "total_vat": line_vat,
-                "total_incl": (line_total + line_vat).quantize(Decimal("0.01")),
-            })
-
-        _apply_proration(person_lines, person)
-
-        for line in person_lines:
-            qty = Decimal(str(line.get("qty", "1") or 1))
-            unit = Decimal(str(line.get("unit", "0") or 0))
-            if qty <= 0:
-                qty = Decimal("1")
-            line_total = (unit * qty).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            rate_percent = Decimal(str(line.get("vat_rate", "0") or 0))
-            rate_decimal = rate_percent / Decimal("100")
-            vat_amount = (line_total * rate_decimal).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
-            line["total"] = line_total
-            line["total_vat"] = vat_amount
-            line["total_incl"] = (line_total + vat_amount).quantize(Decimal("0.01"))
-
-        subtotal_excl = sum(
-            (Decimal(str(line.get("total", "0") or 0)) for line in person_lines),
-            Decimal("0.00"),
-        ).quantize(Decimal("0.01"))
-        subtotal_vat = sum(
-            (Decimal(str(line.get("total_vat", "0") or 0)) for line in person_lines),
-            Decimal("0.00"),
-        ).quantize(Decimal("0.01"))
-        subtotal_incl = (subtotal_excl + subtotal_vat).quantize(Decimal("0.01"))
-
-        billing_account = getattr(billing_owner, "billing_account", None)
-        billing_account_display = _account_display(billing_account) or None
-        age = _member_age_on(
-            year,
-            getattr(person, "date_of_birth", None) or getattr(person, "birth_date", None),
-        )
-        sections.append({
-            "member": person,
-            "display_name": _member_display_name(person),
-            "role": _member_role_display(person),
-            "age": age,
-            "lines": person_lines,
-            "subtotal_excl": subtotal_excl,
-            "subtotal_vat": subtotal_vat,
-            "subtotal_incl": subtotal_incl,
-            "billing_owner": billing_owner,
-            "billing_owner_display": _member_display_name(billing_owner),
-            "billing_account": billing_account,
-            "billing_account_display": billing_account_display,
-        })
-
-    total_excl = sum((section["subtotal_excl"] for section in sections), Decimal("0.00")).quantize(Decimal("0.01"))
-    total_vat = sum((section["subtotal_vat"] for section in sections), Decimal("0.00")).quantize(Decimal("0.01"))
-    total_incl = (total_excl + total_vat).quantize(Decimal("0.01"))
-
-    primary_billing_owner = _billing_owner(member)
-    primary_account = getattr(primary_billing_owner, "billing_account", None)
-    primary_account_display = _account_display(primary_account) or None
-    primary_owner_display = _member_display_name(primary_billing_owner)
-
-    return {
-        "sections": sections,
-        "notes": notes,
-        "total_excl": total_excl,
-        "total_vat": total_vat,
-        "total_incl": total_incl,
-        "primary_account_display": primary_account_display,
-        "primary_owner_display": primary_owner_display,
-    }
-
 @staff_member_required
 def member_invoice_preview(request, member_id: int, year: int):
     member = get_object_or_404(Member, pk=member_id)
@@ -1036,134 +608,75 @@ def member_invoice_preview(request, member_id: int, year: int):
     }
     return render(request, "admin/invoice_preview.html", ctx)
 
-def compute_yearly_totals(year: int):
-    active_members = Member.objects.filter(active=True)
-    owner_map = {}
-    for person in active_members:
-        owner = _billing_owner(person)
-        owner_pk = getattr(owner, "pk", None)
-        if owner_pk is None:
-            continue
-        owner_map.setdefault(owner_pk, owner)
-
-    owners = sorted(
-        owner_map.values(),
-        key=lambda m: (
-            (getattr(m, "last_name", "") or "").casefold(),
-            (getattr(m, "first_name", "") or "").casefold(),
-            getattr(m, "pk", 0),
-        ),
-    )
+def _add_preview_to_components(component_totals, preview):
+    for section in preview["sections"]:
+        for line in section["lines"]:
+            key = line["code"]
+            entry = component_totals.setdefault(
+                key,
+                {
+                    "code": key,
+                    "description": line["desc"],
+                    "total_excl": Decimal("0.00"),
+                    "total_vat": Decimal("0.00"),
+                    "total_incl": Decimal("0.00"),
+                    "members_map": {},
+                },
+            )
+            entry["total_excl"] = (entry["total_excl"] + line["total"]).quantize(Decimal("0.01"))
+            entry["total_vat"] = (entry["total_vat"] + line["total_vat"]).quantize(Decimal("0.01"))
+            entry["total_incl"] = (entry["total_incl"] + line["total_incl"]).quantize(Decimal("0.01"))
+
+            members_map = entry["members_map"]
+            member_obj = section.get("member")
+            billing_owner = section.get("billing_owner")
+
+            member_last = (getattr(member_obj, "last_name", "") or "").strip()
+            member_first = (getattr(member_obj, "first_name", "") or "").strip()
+            member_display = (
+                section.get("display_name")
+                or " ".join(part for part in (member_first, member_last) if part).strip()
+                or str(member_obj)
+            )
+            member_pk = getattr(member_obj, "pk", None)
+            member_key = member_pk if member_pk is not None else (member_last.lower(), member_first.lower(), member_display.lower())
+
+            owner_last = (getattr(billing_owner, "last_name", "") or "").strip()
+            owner_first = (getattr(billing_owner, "first_name", "") or "").strip()
+            owner_display = (
+                section.get("billing_owner_display")
+                or " ".join(part for part in (owner_first, owner_last) if part).strip()
+            )
+            if not owner_display:
+                owner_display = "—"
 
-    component_totals = {}
-    notes = []
-    total_excl = Decimal("0.00")
-    total_vat = Decimal("0.00")
-    total_incl = Decimal("0.00")
-
-    for owner in owners:
-        preview = _build_member_preview(owner, year)
-        total_excl += preview["total_excl"]
-        total_vat += preview["total_vat"]
-        total_incl += preview["total_incl"]
-        notes.extend(preview["notes"])
-
-        for section in preview["sections"]:
-            for line in section["lines"]:
-                key = line["code"]
-                entry = component_totals.setdefault(
-                    key,
-                    {
-                        "code": key,
-                        "description": line["desc"],
-                        "total_excl": Decimal("0.00"),
-                        "total_vat": Decimal("0.00"),
-                        "total_incl": Decimal("0.00"),
-                        "members_map": {},
-                    },
-                )
-                entry["total_excl"] = (entry["total_excl"] + line["total"]).quantize(Decimal("0.01"))
-                entry["total_vat"] = (entry["total_vat"] + line["total_vat"]).quantize(Decimal("0.01"))
-                entry["total_incl"] = (entry["total_incl"] + line["total_incl"]).quantize(Decimal("0.01"))
-
-                members_map = entry["members_map"]
-                member_obj = section.get("member")
-                billing_owner = section.get("billing_owner")
-
-                member_last = (getattr(member_obj, "last_name", "") or "").strip()
-                member_first = (getattr(member_obj, "first_name", "") or "").strip()
-                member_display = (
-                    section.get("display_name")
-                    or " ".join(part for part in (member_first, member_last) if part).strip()
-                    or str(member_obj)
-                )
-                member_pk = getattr(member_obj, "pk", None)
-                member_key = member_pk if member_pk is not None else (member_last.lower(), member_first.lower(), member_display.lower())
-
-                owner_last = (getattr(billing_owner, "last_name", "") or "").strip()
-                owner_first = (getattr(billing_owner, "first_name", "") or "").strip()
-                owner_display = (
-                    section.get("billing_owner_display")
-                    or " ".join(part for part in (owner_first, owner_last) if part).strip()
+            owner_pk = getattr(billing_owner, "pk", None)
+            if member_pk is not None and owner_pk is not None:
+                same_person = member_pk == owner_pk
+            else:
+                same_person = (
+                    (member_last or "").casefold(),
+                    (member_first or "").casefold(),
+                ) == (
+                    (owner_last or "").casefold(),
+                    (owner_first or "").casefold(),
                 )
-                if not owner_display:
-                    owner_display = "—"
-
-                owner_pk = getattr(billing_owner, "pk", None)
-                if member_pk is not None and owner_pk is not None:
-                    same_person = member_pk == owner_pk
-                else:
-                    same_person = (
-                        (member_last or "").casefold(),
-                        (member_first or "").casefold(),
-                    ) == (
-                        (owner_last or "").casefold(),
-                        (owner_first or "").casefold(),
-                    )
-
-                member_entry = members_map.get(member_key)
-                if not member_entry:
-                    member_entry = {
-                        "member_name": member_display,
-                        "member_first_name": member_first,
-                        "member_last_name": member_last,
-                        "billing_owner_name": owner_display,
-                        "billing_owner_first_name": owner_first,
-                        "billing_owner_last_name": owner_last,
-                        "billing_owner_same": same_person,
-                    }
-                    members_map[member_key] = member_entry
-                else:
-                    member_entry["billing_owner_same"] = member_entry.get("billing_owner_same", True) and same_person
-
-    components = []
-    for item in component_totals.values():
-        members_map = item.pop("members_map", {})
-        members = list(members_map.values())
-        for entry in members:
-            entry.setdefault("billing_owner_same", True)
-        members.sort(
-            key=lambda m: (
-                (m["member_last_name"] or "").casefold(),
-                (m["member_first_name"] or "").casefold(),
-                (m["member_name"] or "").casefold(),
-            )
-        )
-        item["members"] = members
-        item["member_count"] = len(members)
-        components.append(item)
 
-    components.sort(key=lambda item: item["code"])
+            member_entry = members_map.get(member_key)
+            if not member_entry:
+                member_entry = {
+                    "member_name": member_display,
+                    "member_first_name": member_first,
+                    "member_last_name": member_last,
+                    "billing_owner_name": owner_display,
+                    "billing_owner_first_name": owner_first,
+                    "billing_owner_last_name": owner_last,
+                    "billing_owner_same": same_person,
+                }
+                members_map[member_key] = member_entry
+            else:
+                member_entry["billing_owner_same"] = member_entry.get("billing_owner_same", True) and same_person
 
-    return {
-        "year": year,
-        "components": components,
-        "total_excl": total_excl.quantize(Decimal("0.01")),
-        "total_vat": total_vat.quantize(Decimal("0.01")),
-        "total_incl": total_incl.quantize(Decimal("0.01")),
-        "notes": notes,
-        "households": len(owners),
-    }
 
 @staff_member_required
 def admin_yearly_totals(request):
@@ -1181,8 +694,30 @@ def admin_yearly_totals(request):
     year_candidates.extend([selected, default_year])
     years = sorted(set(year_candidates), reverse=True)
 
-    totals = compute_yearly_totals(selected)
-    batch_contexts = _iter_yearly_invoice_contexts(selected)
+    from .year_totals import rebuild_households, read_year_totals, refresh_stale_households
+
+    page_url = f"{reverse('admin-yearly-totals')}?jaar={selected}"
+    # onvolledige data (prijzen, regels) of een databasefout: pagina toont de opgeslagen totalen
+    refresh_errors = (DatabaseError, ValueError, TypeError, ArithmeticError)
+    if request.method == "POST":
+        # volledig herberekenen schrijft het hele jaar opnieuw: enkel via het formulier (CSRF)
+        try:
+            count = rebuild_households(selected)
+        except refresh_errors as exc:
+            logger.exception("Herberekenen jaartotalen %s mislukt", selected)
+            messages.error(request, f"Herberekenen mislukt: {exc}")
+        else:
+            messages.success(request, f"Jaartotalen {selected} herberekend ({count} huishoudens).")
+        return redirect(page_url)
+
+    refresh_error = None
+    try:
+        refreshed = refresh_stale_households(selected)
+    except refresh_errors as exc:
+        logger.exception("Bijwerken jaartotalen %s mislukt", selected)
+        refreshed = 0
+        refresh_error = str(exc)
+    totals = read_year_totals(selected)
 
     context = admin.site.each_context(request)
     context.update({
@@ -1195,7 +730,16 @@ def admin_yearly_totals(request):
         "total_incl": totals["total_incl"],
         "notes": totals["notes"],
         "households": totals["households"],
-        "batch_invoice_count": len(batch_contexts),
+        "batch_invoice_count": totals["invoice_count"],
+        "totals_computed_at": totals["computed_at"],
+        "totals_refreshed": refreshed,
+        "totals_need_rebuild": refreshed is None,
+        "totals_stale_count": totals["stale_count"],
+        "totals_refresh_error": refresh_error,
+        "rebuild_url": page_url,
+        "batch_page_size": 50,
+        "pdf_exports": _pdf_export_status(selected),
+        "ubl_export_url": f"{reverse('invoice-ubl-export')}?jaar={selected}",
         "batch_urls": {
             "preview_logo": reverse("yearly-invoice-batch-preview-logo", args=[selected]),
             "preview_preprinted": reverse("yearly-invoice-batch-preview-preprinted", args=[selected]),
@@ -1205,6 +749,79 @@ def admin_yearly_totals(request):
     })
     return TemplateResponse(request, "admin/core/year_totals_page.html", context)
 
+
+# ---------- PDF-export van de jaarfacturen (render_yearly_pdfs) ----------
+
+def _pdf_export_status(year: int):
+    from .invoice_pdf import PAPIER_TEMPLATES, default_output_dir, pdf_available, read_progress, running_pid
+
+    rows = []
+    for papier in sorted(PAPIER_TEMPLATES):
+        out_dir = default_output_dir(year, papier)
+        progress = read_progress(out_dir) or {}
+        rows.append({
+            "papier": papier,
+            "progress": progress,
+            "running": running_pid(out_dir) is not None,
+            "url": reverse("yearly-invoice-pdf-export", args=[year, papier]),
+            "available": pdf_available(),
+        })
+    return rows
+
+
+@staff_member_required
+def yearly_invoice_pdf_export(request, year: int, papier: str):
+    """
+    POST: start `render_yearly_pdfs` op de achtergrond. Een onderbroken run wordt hervat,
+    anders wordt alles opnieuw gerenderd (--restart: prijzen of leden kunnen gewijzigd zijn).
+    Weigert zolang er een run loopt.
+    GET: download de bundel zodra de run klaar is.
+    """
+    import subprocess
+    import sys
+    from django.http import FileResponse, Http404
+    from .invoice_pdf import PAPIER_TEMPLATES, default_output_dir, pdf_available, read_progress, running_pid
+
+    if papier not in PAPIER_TEMPLATES:
+        raise Http404("Onbekende papiersoort")
+    out_dir = default_output_dir(year, papier)
+    back = f"{reverse('admin-yearly-totals')}?jaar={year}"
+
+    if request.method == "POST":
+        if not pdf_available():
+            messages.error(request, "PDF-export niet beschikbaar: WeasyPrint is niet geïnstalleerd.")
+            return redirect(back)
+        if running_pid(out_dir) is not None:
+            messages.warning(request, f"PDF-export {year} ({papier}) loopt al.")
+            return redirect(back)
+        fmt = "pdf" if request.POST.get("format") == "pdf" else "zip"
+        args = [
+            sys.executable, str(settings.BASE_DIR / "manage.py"), "render_yearly_pdfs",
+            "--year", str(year), "--papier", papier, "--format", fmt,
+        ]
+        progress = read_progress(out_dir)
+        if not progress or progress.get("finished"):
+            args.append("--restart")
+        subprocess.Popen(
+            args,
+            cwd=str(settings.BASE_DIR),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        messages.success(request, f"PDF-export {year} ({papier}) gestart.")
+        return redirect(back)
+
+    progress = read_progress(out_dir) or {}
+    if not progress.get("finished") or not progress.get("bundle"):
+        messages.warning(request, f"PDF-export {year} ({papier}) is nog niet klaar.")
+        return redirect(back)
+    bundle = out_dir / progress["bundle"]
+    if not bundle.exists():
+        raise Http404("Bundel niet gevonden")
+    return FileResponse(open(bundle, "rb"), as_attachment=True, filename=bundle.name)
+
+
 @staff_member_required
 def member_invoice_preview_default(request, member_id: int):
     year = timezone.now().year + 1
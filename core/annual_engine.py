@@ -3,7 +3,9 @@ import datetime
 from decimal import Decimal
 from typing import Dict, List, Tuple
 from django.db import transaction
-from .models import Member, MemberAsset, Invoice, InvoiceLine, YearPricing, YearRule, InvoiceAccount
+from .models import Member, MemberAsset, Invoice, InvoiceLine
+from .billing_engine import compile_year
+from .invoice_totals import deferred, refresh_invoice_totals
 
 ALIASES = {'KAE_KLN': 'KAR_KLN'}  # oude -> nieuwe code
 
@@ -16,101 +18,107 @@ def _find_household_head(member: Member) -> Member | None:
         return member.household_head
     return member
 
-def _preferred_account(member: Member) -> InvoiceAccount | None:
-    return member.billing_account
-
-def _ensure_draft_invoice(year: int, target_member: Member) -> Invoice:
-    inv = Invoice.objects.filter(
-        member=target_member, issue_date__year=year, status=Invoice.STATUS_DRAFT
-    ).first()
-    if inv:
-        return inv
-    inv = Invoice(
-        member=target_member,
-        account=_preferred_account(target_member),
-        issue_date=datetime.date(year, 1, 1),
-        status=Invoice.STATUS_DRAFT,
-    )
-    inv.save()
-    return inv
+def _draft_invoices(year: int, targets, create: bool = True) -> Tuple[Dict[int, Invoice], int]:
+    """
+    Conceptfactuur per doellid: de oudste bestaande concept van dit jaar, anders een
+    nieuwe (één SELECT en één bulk_create). Retourneert ({member_pk: factuur}, aantal nieuwe).
+    """
+    drafts: Dict[int, Invoice] = {}
+    for inv in Invoice.objects.filter(
+        member__in=list(targets), issue_date__year=year, status=Invoice.STATUS_DRAFT
+    ).order_by("pk"):
+        drafts.setdefault(inv.member_id, inv)
+    new = [
+        Invoice(
+            member=target,
+            account_id=target.billing_account_id,
+            issue_date=datetime.date(year, 1, 1),
+            status=Invoice.STATUS_DRAFT,
+        )
+        for pk, target in targets.items() if pk not in drafts
+    ]
+    if create:
+        Invoice.objects.bulk_create(new)
+    for inv in new:
+        drafts[inv.member_id] = inv
+    return drafts, len(new)
 
 def _line_desc(template: str, asset: MemberAsset) -> str:
     # 5) nummer in omschrijving
     ident = (asset.identifier or "").strip()
     return (template or "").replace("{asset_identifier}", ident).strip()
 
-def _add_line(year: int, invoice: Invoice, code: str, description: str, quantity: Decimal = Decimal("1")) -> InvoiceLine:
-    code = _price_code(code)  # alias toepassen
-    pricing = YearPricing.objects.filter(year=year, code=code, active=True).first()
-    if not pricing:
-        raise ValueError(f"Geen YearPricing voor {year}/{code}")
-    return InvoiceLine.objects.create(
-        invoice=invoice,
-        product=None,
-        description=description,
-        quantity=quantity,
-        unit_price_excl=pricing.amount,              # 3) leeftijd speelt geen rol
-        vat_rate=Decimal(str(pricing.vat_rate)),
-    )
-
-def build_asset_rule_index(year: int) -> Dict[str, dict]:
-    """
-    Lees YearRule.data en bouw index per asset_type.
-    data per regel verwacht:
-    {
-      "asset_type": "locker" | "trolley_locker" | "e_trolley_locker",
-      "price_code": "VST_KAST" | "KAR_KLN" | "KAR_ELEC",
-      "description": "Vestiaire kast {asset_identifier}",
-      "bill_to": "head" | "self",
-      "quantity": 1
-    }
-    """
-    idx: Dict[str, dict] = {}
-    for r in YearRule.objects.filter(year=year, active=True):
-        data = r.data or {}
-        at = data.get("asset_type")
-        pc = data.get("price_code") or r.code
-        if not at or not pc:
-            continue
-        idx[at] = {
-            "price_code": pc,
-            "description": data.get("description") or r.code,
-            "bill_to": (data.get("bill_to") or "head"),
-            "quantity": Decimal(str(data.get("quantity", 1))),
-        }
-    return idx
-
 def iter_member_assets_for_year(year: int):
     # 4) aanrekenen als asset bestaat voor dit jaar en actief is
     return MemberAsset.objects.select_related("member", "member__household_head").filter(
         active=True, year=year
     )
 
-def simulate_assets(year: int) -> List[Tuple[str, str, str, str]]:
-    """ Voorbeeldresultaten zonder te schrijven """
-    idx = build_asset_rule_index(year)
-    rows: List[Tuple[str, str, str, str]] = []
+def plan_assets(year: int, engine=None) -> List[dict]:
+    """
+    Aan te rekenen lijnen voor de assets van dit jaar, zonder te schrijven. Gedeeld door
+    simulate_assets en apply_assets: asset, doellid (target), prijscode (alias toegepast),
+    YearPricing (None als die ontbreekt), omschrijving en aantal.
+    """
+    engine = engine or compile_year(year)
+    plan: List[dict] = []
     for asset in iter_member_assets_for_year(year):
-        rule = idx.get(asset.asset_type)
+        rule = engine.asset_rule(asset.asset_type)
         if not rule:
             continue
-        target = _find_household_head(asset.member) if rule["bill_to"] == "head" else asset.member
-        desc = _line_desc(rule["description"], asset)
-        rows.append((f"{asset.member}", asset.asset_type, rule["price_code"], f"{desc} → factuur: {target}"))
-    return rows
+        code = _price_code(rule["price_code"])
+        plan.append({
+            "asset": asset,
+            "target": _find_household_head(asset.member) if rule["bill_to"] == "head" else asset.member,
+            "code": code,
+            "pricing": engine.asset_price(code),
+            "description": _line_desc(rule["description"], asset),
+            "quantity": rule["quantity"],
+        })
+    return plan
+
+def simulate_assets(year: int, plan: List[dict] | None = None) -> List[Tuple[str, str, str, str]]:
+    """ Voorbeeldresultaten zonder te schrijven """
+    if plan is None:
+        plan = plan_assets(year)
+    return [
+        (f"{p['asset'].member}", p["asset"].asset_type, p["code"], f"{p['description']} → factuur: {p['target']}")
+        for p in plan
+    ]
 
 @transaction.atomic
-def apply_assets(year: int) -> int:
-    """ Schrijf factuurlijnen weg (conceptfacturen). Retourneert aantal regels. """
-    idx = build_asset_rule_index(year)
-    count = 0
-    for asset in iter_member_assets_for_year(year):
-        rule = idx.get(asset.asset_type)
-        if not rule:
-            continue
-        target = _find_household_head(asset.member) if rule["bill_to"] == "head" else asset.member
-        inv = _ensure_draft_invoice(year, target)
-        desc = _line_desc(rule["description"], asset)
-        _add_line(year, inv, rule["price_code"], desc, rule["quantity"])
-        count += 1
-    return count
+def apply_assets(year: int, dry_run: bool = False, plan: List[dict] | None = None) -> Tuple[int, int]:
+    """
+    Schrijf factuurlijnen weg (conceptfacturen). Retourneert (aantal regels, aantal nieuwe
+    conceptfacturen). Het aantal queries hangt niet af van het aantal assets: prijzen en
+    regels zitten in de rekenkern, conceptfacturen en lijnen gaan in bulk.
+    Met dry_run wordt dezelfde planning gemaakt en gecontroleerd, maar niets geschreven.
+    """
+    if plan is None:
+        plan = plan_assets(year)
+    for p in plan:
+        if not p["pricing"]:
+            raise ValueError(f"Geen YearPricing voor {year}/{p['code']}")
+    if not plan:
+        return 0, 0
+
+    targets = {p["target"].pk: p["target"] for p in plan}
+    drafts, created = _draft_invoices(year, targets, create=not dry_run)
+    if dry_run:
+        return len(plan), created
+
+    lines = [
+        InvoiceLine(
+            invoice=drafts[p["target"].pk],
+            product=None,
+            description=p["description"],
+            quantity=p["quantity"],
+            unit_price_excl=p["pricing"].amount,              # 3) leeftijd speelt geen rol
+            vat_rate=Decimal(str(p["pricing"].vat_rate)),
+        )
+        for p in plan
+    ]
+    with deferred():
+        InvoiceLine.objects.bulk_create(lines, batch_size=1000)
+    refresh_invoice_totals({inv.pk for inv in drafts.values()})
+    return len(lines), created
@@ -15,3 +15,11 @@ class CoreConfig(AppConfig):
             from . import admin_cleanup_patch  # kan ontbreken
         except Exception:
             pass
+        # signalen die de opgeslagen jaartotalen als 'stale' markeren
+        from . import year_totals  # noqa: F401
+        # opgeslagen UBL opruimen bij een gewijzigd organisatieprofiel
+        from . import ubl_cache  # noqa: F401
+        # opgeslagen factuurtotalen bijwerken bij gewijzigde lijnen
+        from . import invoice_totals  # noqa: F401
+        # factuurnummer, OGM en bevroren totalen bij finaliseren via save()
+        from . import numbering  # noqa: F401
@@ -0,0 +1,606 @@
+"""
+Rekenkern van de jaarfacturatie: één plaats die bepaalt wat een huishouden betaalt.
+
+`compile_year(year)` laadt de gegevens van een jaar één keer (BillingSnapshot: leden,
+assets, prijstabel met fallback; plus de asset-regels uit YearRule) en geeft een
+`YearEngine` terug die daarna huishoudens in het geheugen evalueert. Alle ingangen
+gebruiken deze module:
+
+- de admin-preview, jaartotalen en jaar-PDF's (`_build_member_preview`);
+- `manage.py generate_yearly_invoices` (`YearEngine.invoice_lines`): de aangemaakte
+  facturen hebben dezelfde lijnen als de preview en de jaar-PDF;
+- `annual_engine.apply_assets` (`YearEngine.asset_rule` / `asset_price`).
+
+`manage.py bench_billing_engine` meet het aantal huishoudens per seconde.
+"""
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from functools import cached_property
+
+from django.apps import apps
+from django.db.models import Q
+
+from .billing_snapshot import BillingSnapshot
+
+Member = apps.get_model("core", "Member")
+try:
+    MemberAsset = apps.get_model("core", "MemberAsset")
+except LookupError:
+    MemberAsset = None
+try:
+    YearPricing = apps.get_model("core", "YearPricing")
+except LookupError:
+    YearPricing = None
+try:
+    YearRule = apps.get_model("core", "YearRule")
+except LookupError:
+    YearRule = None
+
+
+def _q(val):
+    return Decimal(str(val or "0")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+# ---------- evaluatie van één huishouden (preview) ----------
+
+def _member_age_on(year: int, dob):
+    if not dob:
+        return None
+    ref = date(year, 1, 1)
+    try:
+        return max(0, ref.year - dob.year - ((ref.month, ref.day) < (dob.month, dob.day)))
+    except Exception:
+        return None
+
+def _member_role_tag(member):
+    val = (getattr(member, "household_role", "") or "").strip().lower()
+    if val in {"prt", "partner", "partner_role", "husband", "wife"}:
+        return "PRT"
+    if val in {"kid", "child"}:
+        return "KID"
+    return "IND"
+
+def _member_display_name(member):
+    first = (getattr(member, "first_name", "") or "").strip()
+    last = (getattr(member, "last_name", "") or "").strip()
+    name = " ".join(part for part in (first, last) if part)
+    if name:
+        return name
+    fallback = getattr(member, "last_name", None) or getattr(member, "first_name", None)
+    if fallback:
+        return str(fallback)
+    return str(member)
+
+def _member_role_display(member):
+    display_method = getattr(member, "get_household_role_display", None)
+    if callable(display_method):
+        label = display_method() or ""
+        return label.strip()
+    raw = getattr(member, "household_role", "") or ""
+    return raw.strip()
+
+def _billing_owner(member, _seen=None):
+    pk = getattr(member, "pk", None)
+    if _seen is None:
+        _seen = set()
+    if pk and pk in _seen:
+        return member
+    if pk:
+        _seen.add(pk)
+    if getattr(member, "billing_account_id", None):
+        return member
+    via = getattr(member, "factureren_via", None)
+    via_pk = getattr(via, "pk", None)
+    if via and via_pk and via_pk != pk:
+        return _billing_owner(via, _seen)
+    head = getattr(member, "household_head", None)
+    head_pk = getattr(head, "pk", None)
+    if head and head_pk and head_pk != pk:
+        return _billing_owner(head, _seen)
+    return member
+
+def _account_display(account):
+    if not account:
+        return ""
+    parts = []
+    name = (getattr(account, "name", "") or "").strip()
+    if name:
+        parts.append(name)
+    email = (getattr(account, "email", "") or "").strip()
+    if email:
+        parts.append(email)
+    address_parts = [
+        (getattr(account, "street", "") or "").strip(),
+        " ".join(filter(None, [
+            (getattr(account, "postal_code", "") or "").strip(),
+            (getattr(account, "city", "") or "").strip(),
+        ])).strip(),
+    ]
+    address = " ".join(part for part in address_parts if part).strip()
+    if address:
+        parts.append(address)
+    return " — ".join(parts) if parts else str(account)
+
+def _household_dependents(head):
+    if Member is None:
+        return []
+    qs = Member.objects.filter(active=True).exclude(pk=head.pk)
+    qs = qs.filter(Q(factureren_via=head) | Q(household_head=head)).distinct()
+    return list(qs)
+
+def _federation_enabled(member):
+    exclusions = set(getattr(member, "billing_code_exclusions", []) or [])
+    if "FEDERATIE" in exclusions:
+        return False
+    val = getattr(member, "federale_bijdrage_via_spiegelven", None)
+    if val is None:
+        val = getattr(member, "federation_via_club", False)
+    return bool(val)
+
+def _membership_codes(member, year: int):
+    course = (getattr(member, "course", "") or "").strip().upper()
+    age = _member_age_on(year, getattr(member, "date_of_birth", None) or getattr(member, "birth_date", None))
+    role = _member_role_tag(member)
+
+    lid = None
+    fed = None
+
+    if course == "CC":
+        include_fed = _federation_enabled(member)
+        if age is None:
+            lid = f"LID_CC_{role}"
+            if include_fed:
+                fed = f"FED_CC_{role if role in {'IND', 'PRT'} else 'IND'}"
+        elif age <= 15:
+            lid = "LID_CC_KID_0_15"
+            if include_fed:
+                fed = "FED_CC_KID"
+        elif 16 <= age <= 21:
+            lid = "LID_CC_KID_16_21"
+            if include_fed:
+                fed = "FED_CC_KID"
+        elif 22 <= age <= 26:
+            lid = "LID_CC_YA_22_26"
+            if include_fed:
+                fed = f"FED_CC_{role}"
+        elif 27 <= age <= 29:
+            lid = "LID_CC_YA_27_29"
+            if include_fed:
+                fed = f"FED_CC_{role}"
+        elif 30 <= age <= 35:
+            lid = "LID_CC_YA_30_35"
+            if include_fed:
+                fed = f"FED_CC_{role}"
+        else:
+            lid = f"LID_CC_{role}"
+            if include_fed:
+                fed = f"FED_CC_{role}"
+    elif course == "P3":
+        base = role if role in {"IND", "PRT"} else "IND"
+        if age is None:
+            lid = f"P3_{base}"
+        elif age <= 21:
+            lid = "P3_KID"
+        else:
+            lid = f"P3_{base}"
+        fed = None
+
+    return [c for c in (lid, fed) if c]
+
+def _investment_codes(member, year: int):
+    codes = []
+    plan = getattr(member, "investment_plan", "") or ""
+    role = _member_role_tag(member)
+    if plan == getattr(Member, "INVESTMENT_PLAN_DIRECT", "direct"):
+        if getattr(member, "investment_direct_bill_next", False):
+            codes.append(f"INV_{role}")
+    if plan == getattr(Member, "INVESTMENT_PLAN_FLEX", "flex"):
+        if getattr(member, "flex_years_remaining", 0):
+            codes.append(f"INV_FLEX_{role}")
+    return codes
+
+def _asset_codes(member):
+    if MemberAsset is None:
+        return []
+    qs = MemberAsset.objects.filter(member=member)
+    try:
+        qs = qs.filter(active=True)
+    except Exception:
+        pass
+    return [c for c in qs.values_list("asset_type", flat=True) if c]
+
+def _unique_keep_order(seq):
+    seen = set()
+    out = []
+    for item in seq:
+        if item and item not in seen:
+            seen.add(item)
+            out.append(item)
+    return out
+
+def _apply_proration(lines, member):
+    for line in lines:
+        code = (line.get("code") or "").upper()
+        desc = (line.get("desc") or "").lower()
+        qty = Decimal(str(line.get("qty", "1")))
+        total = Decimal(str(line.get("total", "0") or 0))
+
+        if qty <= 0:
+            qty = Decimal("1")
+
+        plan = getattr(member, "investment_plan", "") or ""
+        if code in ("INV_IND", "INV_PRT") or ("invest" in desc and not code.startswith("INV_FLEX")):
+            if plan == getattr(Member, "INVESTMENT_PLAN_DIRECT", "direct") and getattr(member, "investment_direct_bill_next", False):
+                amount = getattr(member, "investment_direct_amount", None)
+                if amount is not None:
+                    try:
+                        new_total = Decimal(str(amount)).quantize(Decimal("0.01"))
+                    except Exception:
+                        new_total = Decimal("0.00")
+                    if new_total > 0:
+                        line["total"] = new_total
+                        line["unit"] = (new_total / qty).quantize(Decimal("0.01"))
+                        if not line.get("desc"):
+                            line["desc"] = "Investering (eenmalig)"
+                        continue
+            line["total"] = Decimal("0.00")
+            line["unit"] = Decimal("0.00")
+            continue
+
+        if code.startswith("INV_FLEX") or "flex" in desc:
+            if plan == getattr(Member, "INVESTMENT_PLAN_FLEX", "flex") and getattr(member, "flex_years_remaining", 0) > 0:
+                amount = getattr(member, "invest_flex_locked_amount", None)
+                if amount is not None:
+                    try:
+                        new_total = Decimal(str(amount)).quantize(Decimal("0.01"))
+                    except Exception:
+                        new_total = Decimal("0.00")
+                    if new_total > 0:
+                        line["total"] = new_total
+                        line["unit"] = (new_total / qty).quantize(Decimal("0.01"))
+                        if not line.get("desc"):
+                            line["desc"] = "Investering (flex)"
+                        continue
+            line["total"] = Decimal("0.00")
+            line["unit"] = Decimal("0.00")
+
+DESCRIPTIONS = {
+    "LID_CC_IND": "Lidgeld CC (individueel)",
+    "LID_CC_PRT": "Lidgeld CC (partner)",
+    "LID_CC_KID_0_15": "Lidgeld CC (kind 0–15)",
+    "LID_CC_KID_16_21": "Lidgeld CC (kind 16–21)",
+    "LID_CC_YA_22_26": "Lidgeld CC (jongvolw. 22–26)",
+    "LID_CC_YA_27_29": "Lidgeld CC (jongvolw. 27–29)",
+    "LID_CC_YA_30_35": "Lidgeld CC (jongvolw. 30–35)",
+    "FED_CC_IND": "Federatie CC (individueel)",
+    "FED_CC_PRT": "Federatie CC (partner)",
+    "FED_CC_KID": "Federatie CC (kind)",
+    "P3_IND": "Lidgeld P3 (individueel)",
+    "P3_PRT": "Lidgeld P3 (partner)",
+    "P3_KID": "Lidgeld P3 (kind)",
+    "INV_IND": "Investering (individueel)",
+    "INV_PRT": "Investering (partner)",
+    "INV_FLEX_IND": "Investering flex (individueel)",
+    "INV_FLEX_PRT": "Investering flex (partner)",
+    "VST_KAST": "Kast",
+    "KAR_KLN": "Kar-kast",
+    "KAR_ELEC": "E-kar-kast",
+}
+
+
+def _build_member_preview(member, year: int, snapshot=None):
+    """
+    Preview van de jaarfactuur voor een factuurhouder en zijn gezin.
+    Met een BillingSnapshot gebeurt alles in het geheugen (geen queries per lid).
+    """
+    billing_owner_of = snapshot.billing_owner if snapshot is not None else _billing_owner
+    preview_members = [member]
+    member_pk = getattr(member, "pk", None)
+    member_head_id = getattr(member, "household_head_id", None)
+    # Neem ook afhankelijken mee als dit lid het gezinshoofd is (None of zichzelf).
+    if member_head_id is None or member_head_id == member_pk:
+        dependents = snapshot.dependents(member) if snapshot is not None else _household_dependents(member)
+        partners, children, others = [], [], []
+        partner_code = (getattr(Member, "ROLE_PARTNER", "partner") or "partner").lower()
+        child_code = (getattr(Member, "ROLE_CHILD", "child") or "child").lower()
+
+        def _sort_key(m):
+            return (
+                (getattr(m, "last_name", "") or "").lower(),
+                (getattr(m, "first_name", "") or "").lower(),
+                getattr(m, "pk", 0),
+            )
+
+        for dep in dependents:
+            role = (getattr(dep, "household_role", "") or "").strip().lower()
+            if role == partner_code:
+                partners.append(dep)
+            elif role == child_code:
+                children.append(dep)
+            else:
+                others.append(dep)
+
+        for group in (partners, children, others):
+            group.sort(key=_sort_key)
+
+        preview_members = [member, *partners, *children, *others]
+
+    member_codes = []
+    codes_seen = set()
+    for person in preview_members:
+        codes = _unique_keep_order(
+            _membership_codes(person, year)
+            + _investment_codes(person, year)
+            + (snapshot.asset_codes(person) if snapshot is not None else _asset_codes(person))
+        )
+        exclusions = set(getattr(person, "billing_code_exclusions", []) or [])
+        if "LIDMAATSCHAP" in exclusions:
+            exclusions = (exclusions - {"LIDMAATSCHAP"}) | {
+                "LID_CC_IND",
+                "LID_CC_KID_0_15",
+                "LID_CC_KID_16_21",
+                "LID_CC_PRT",
+                "LID_CC_YA_22_26",
+                "LID_CC_YA_27_29",
+                "LID_CC_YA_30_35",
+                "P3_IND",
+                "P3_KID",
+                "P3_PRT",
+            }
+        if exclusions:
+            codes = [c for c in codes if c not in exclusions]
+        member_codes.append((person, codes))
+        codes_seen.update(codes)
+
+    price_map = {}
+    if snapshot is not None:
+        price_map = snapshot.price_map(codes_seen)
+    elif YearPricing is not None and codes_seen:
+        # Eerst proberen het gevraagde jaar; als er niets is, neem het meest recente jaar met prijzen.
+        target_year = year
+        qs = YearPricing.objects.filter(year=target_year, code__in=codes_seen)
+        if not qs.exists():
+            fallback_year = (
+                YearPricing.objects.order_by("-year")
+                .values_list("year", flat=True)
+                .first()
+            )
+            if fallback_year:
+                target_year = fallback_year
+                qs = YearPricing.objects.filter(year=target_year, code__in=codes_seen)
+        for yp in qs:
+            try:
+                amount = Decimal(str(yp.amount or "0")).quantize(Decimal("0.01"))
+            except Exception:
+                amount = Decimal("0.00")
+            try:
+                vat_rate = Decimal(str(getattr(yp, "vat_rate", "0") or "0"))
+            except Exception:
+                vat_rate = Decimal("0")
+            price_map[yp.code] = {
+                "amount": amount,
+                "vat_rate": vat_rate,
+            }
+
+    sections = []
+    notes = []
+    for person, codes in member_codes:
+        billing_owner = billing_owner_of(person)
+        member_pk = getattr(member, "pk", None)
+        owner_pk = getattr(billing_owner, "pk", None)
+        if member_pk is not None and owner_pk is not None and owner_pk != member_pk:
+            continue
+        if (member_pk is None or owner_pk is None) and billing_owner is not member:
+            continue
+
+        person_lines = []
+        for code in codes:
+            price_info = price_map.get(code)
+            if price_info is None:
+                notes.append(f"Geen prijs gevonden voor code {code} ({year}) voor {_member_display_name(person)}.")
+                amount = Decimal("0.00")
+                vat_rate = Decimal("0.00")
+            else:
+                amount = price_info.get("amount", Decimal("0.00"))
+                vat_rate = Decimal(str(price_info.get("vat_rate", "0") or 0))
+            qty = Decimal("1")
+            vat_rate_decimal = (vat_rate / Decimal("100"))
+            line_total = (amount * qty).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            line_vat = (line_total * vat_rate_decimal).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            person_lines.append({
+                "code": code,
+                "desc": DESCRIPTIONS.get(code, code),
+                "qty": qty,
+                "unit": amount,
+                "total": line_total,
+                "vat_rate": vat_rate,
+                "total_vat": line_vat,
+                "total_incl": (line_total + line_vat).quantize(Decimal("0.01")),
+            })
+
+        _apply_proration(person_lines, person)
+
+        for line in person_lines:
+            qty = Decimal(str(line.get("qty", "1") or 1))
+            unit = Decimal(str(line.get("unit", "0") or 0))
+            if qty <= 0:
+                qty = Decimal("1")
+            line_total = (unit * qty).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            rate_percent = Decimal(str(line.get("vat_rate", "0") or 0))
+            rate_decimal = rate_percent / Decimal("100")
+            vat_amount = (line_total * rate_decimal).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+            line["total"] = line_total
+            line["total_vat"] = vat_amount
+            line["total_incl"] = (line_total + vat_amount).quantize(Decimal("0.01"))
+
+        subtotal_excl = sum(
+            (Decimal(str(line.get("total", "0") or 0)) for line in person_lines),
+            Decimal("0.00"),
+        ).quantize(Decimal("0.01"))
+        subtotal_vat = sum(
+            (Decimal(str(line.get("total_vat", "0") or 0)) for line in person_lines),
+            Decimal("0.00"),
+        ).quantize(Decimal("0.01"))
+        subtotal_incl = (subtotal_excl + subtotal_vat).quantize(Decimal("0.01"))
+
+        billing_account = getattr(billing_owner, "billing_account", None)
+        billing_account_display = _account_display(billing_account) or None
+        age = _member_age_on(
+            year,
+            getattr(person, "date_of_birth", None) or getattr(person, "birth_date", None),
+        )
+        sections.append({
+            "member": person,
+            "display_name": _member_display_name(person),
+            "role": _member_role_display(person),
+            "age": age,
+            "lines": person_lines,
+            "subtotal_excl": subtotal_excl,
+            "subtotal_vat": subtotal_vat,
+            "subtotal_incl": subtotal_incl,
+            "billing_owner": billing_owner,
+            "billing_owner_display": _member_display_name(billing_owner),
+            "billing_account": billing_account,
+            "billing_account_display": billing_account_display,
+        })
+
+    total_excl = sum((section["subtotal_excl"] for section in sections), Decimal("0.00")).quantize(Decimal("0.01"))
+    total_vat = sum((section["subtotal_vat"] for section in sections), Decimal("0.00")).quantize(Decimal("0.01"))
+    total_incl = (total_excl + total_vat).quantize(Decimal("0.01"))
+
+    primary_billing_owner = billing_owner_of(member)
+    primary_account = getattr(primary_billing_owner, "billing_account", None)
+    primary_account_display = _account_display(primary_account) or None
+    primary_owner_display = _member_display_name(primary_billing_owner)
+
+    return {
+        "sections": sections,
+        "notes": notes,
+        "total_excl": total_excl,
+        "total_vat": total_vat,
+        "total_incl": total_incl,
+        "primary_account_display": primary_account_display,
+        "primary_owner_display": primary_owner_display,
+    }
+
+
+def preview_invoice_lines(preview):
+    """
+    Factuurlijnen uit een preview, zoals ze op de jaarfactuur staan: omschrijving met de
+    naam van het gezinslid, aantal, eenheidsprijs, btw en de lijntotalen.
+    """
+    lines = []
+    for section in preview["sections"]:
+        person = section.get("member")
+        display_name = section.get("display_name") or _member_display_name(person)
+        for raw_line in section.get("lines", []):
+            desc = raw_line.get("desc") or ""
+            if display_name and display_name.lower() not in desc.lower():
+                description = f"{display_name}: {desc}"
+            else:
+                description = desc
+            qty = _q(raw_line.get("qty") or Decimal("1"))
+            unit = _q(raw_line.get("unit") or Decimal("0"))
+            vat_rate = Decimal(str(raw_line.get("vat_rate") or "0"))
+            line_excl = _q(raw_line.get("total") or qty * unit)
+            vat_amount = _q(raw_line.get("total_vat") or (line_excl * vat_rate / Decimal("100")))
+            line_incl = _q(raw_line.get("total_incl") or (line_excl + vat_amount))
+            lines.append({
+                "description": description,
+                "quantity": qty,
+                "unit_price_excl": unit,
+                "vat_rate": vat_rate,
+                "line_excl": line_excl,
+                "vat_amount": vat_amount,
+                "line_incl": line_incl,
+            })
+    return lines
+
+
+# ---------- gecompileerd jaar ----------
+
+def build_asset_rule_index(year: int):
+    """
+    Lees YearRule.data en bouw index per asset_type.
+    data per regel verwacht:
+    {
+      "asset_type": "locker" | "trolley_locker" | "e_trolley_locker",
+      "price_code": "VST_KAST" | "KAR_KLN" | "KAR_ELEC",
+      "description": "Vestiaire kast {asset_identifier}",
+      "bill_to": "head" | "self",
+      "quantity": 1
+    }
+    """
+    idx = {}
+    if YearRule is None:
+        return idx
+    for r in YearRule.objects.filter(year=year, active=True):
+        data = r.data or {}
+        at = data.get("asset_type")
+        pc = data.get("price_code") or r.code
+        if not at or not pc:
+            continue
+        idx[at] = {
+            "price_code": pc,
+            "description": data.get("description") or r.code,
+            "bill_to": (data.get("bill_to") or "head"),
+            "quantity": Decimal(str(data.get("quantity", 1))),
+        }
+    return idx
+
+
+class YearEngine:
+    """Eén jaar, één keer ingelezen; daarna geen queries meer per huishouden."""
+
+    # lijnvelden die op een InvoiceLine bewaard worden
+    LINE_FIELDS = ("description", "quantity", "unit_price_excl", "vat_rate")
+
+    def __init__(self, year: int, snapshot=None):
+        self.year = int(year)
+        if snapshot is not None:
+            self.snapshot = snapshot
+
+    # alles pas laden wanneer het gebruikt wordt: apply_assets heeft geen snapshot nodig
+    @cached_property
+    def snapshot(self):
+        return BillingSnapshot(self.year)
+
+    @cached_property
+    def asset_rules(self):
+        return build_asset_rule_index(self.year)
+
+    @cached_property
+    def _asset_prices(self):
+        # apply_assets rekent enkel met actieve prijzen van precies dit jaar
+        prices = {}
+        if YearPricing is not None:
+            for yp in YearPricing.objects.filter(year=self.year, active=True):
+                prices.setdefault(yp.code, yp)
+        return prices
+
+    def has_prices(self) -> bool:
+        """Heeft dit jaar een eigen prijstabel (de preview valt anders terug op het laatste jaar)?"""
+        return self.snapshot.has_year_prices()
+
+    def owners(self):
+        return self.snapshot.owners()
+
+    def evaluate(self, owner):
+        return _build_member_preview(owner, self.year, snapshot=self.snapshot)
+
+    def invoice_lines(self, owner, preview=None):
+        """(lijnen voor InvoiceLine, notities) van de jaarfactuur van deze factuurhouder."""
+        preview = preview if preview is not None else self.evaluate(owner)
+        lines = [{k: line[k] for k in self.LINE_FIELDS} for line in preview_invoice_lines(preview)]
+        return lines, preview["notes"]
+
+    def asset_rule(self, asset_type):
+        return self.asset_rules.get(asset_type)
+
+    def asset_price(self, code):
+        """Actieve YearPricing van dit jaar voor `code` (None als die ontbreekt)."""
+        return self._asset_prices.get(code)
+
+
+def compile_year(year: int, snapshot=None) -> YearEngine:
+    return YearEngine(year, snapshot=snapshot)
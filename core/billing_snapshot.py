@@ -0,0 +1,155 @@
+from decimal import Decimal
+from django.apps import apps
+
+
+Member = apps.get_model("core", "Member")
+Invoice = apps.get_model("core", "Invoice")
+OrganizationProfile = apps.get_model("core", "OrganizationProfile")
+try:
+    MemberAsset = apps.get_model("core", "MemberAsset")
+except LookupError:
+    MemberAsset = None
+try:
+    YearPricing = apps.get_model("core", "YearPricing")
+except LookupError:
+    YearPricing = None
+
+
+def owner_sort_key(member):
+    """Vaste volgorde van factuurhouders: (familienaam, voornaam, pk), hoofdletterongevoelig."""
+    return (
+        (getattr(member, "last_name", "") or "").casefold(),
+        (getattr(member, "first_name", "") or "").casefold(),
+        getattr(member, "pk", 0),
+    )
+
+
+def _price_entry(yp):
+    try:
+        amount = Decimal(str(yp.amount or "0")).quantize(Decimal("0.01"))
+    except Exception:
+        amount = Decimal("0.00")
+    try:
+        vat_rate = Decimal(str(getattr(yp, "vat_rate", "0") or "0"))
+    except Exception:
+        vat_rate = Decimal("0")
+    return {"amount": amount, "vat_rate": vat_rate}
+
+
+class BillingSnapshot:
+    """
+    Alle gegevens die de jaarfactuur-preview nodig heeft, in een vast aantal queries geladen.
+    Daarna gebeurt alles in het geheugen: het aantal queries hangt niet af van het aantal leden.
+    """
+
+    def __init__(self, year: int):
+        self.year = int(year)
+
+        # 1) alle leden (ook inactieve: 'factureren via' kan naar een inactief lid wijzen),
+        #    met hun alternatief factuuradres in dezelfde query
+        self.members = {
+            m.pk: m for m in Member.objects.select_related("billing_account").order_by("last_name", "first_name", "pk")
+        }
+        self.active_members = [m for m in self.members.values() if getattr(m, "active", True)]
+
+        # afhankelijken per gezinshoofd / 'factureren via'-lid (enkel actieve leden)
+        self._dependents = {}
+        for m in self.active_members:
+            targets = {m.household_head_id, m.factureren_via_id} - {None, m.pk}
+            for target in targets:
+                self._dependents.setdefault(target, []).append(m)
+
+        # 2) actieve assets per lid
+        self._assets = {}
+        if MemberAsset is not None:
+            rows = MemberAsset.objects.filter(active=True).order_by("pk").values_list("member_id", "asset_type")
+            for member_id, asset_type in rows:
+                if asset_type:
+                    self._assets.setdefault(member_id, []).append(asset_type)
+
+        # 3) prijstabel van het jaar + die van het meest recente jaar (fallback)
+        self._prices = {}
+        self._fallback_prices = {}
+        if YearPricing is not None:
+            fallback_year = (
+                YearPricing.objects.order_by("-year")
+                .values_list("year", flat=True)
+                .first()
+            )
+            years = {self.year}
+            if fallback_year:
+                years.add(fallback_year)
+            tables = {}
+            for yp in YearPricing.objects.filter(year__in=years):
+                tables.setdefault(yp.year, {})[yp.code] = _price_entry(yp)
+            self._prices = tables.get(self.year, {})
+            if fallback_year:
+                self._fallback_prices = tables.get(fallback_year, {})
+
+        # 4) bestaande facturen van het jaar (meest recente per lid)
+        self._invoices = {}
+        qs = (
+            Invoice.objects.filter(issue_date__year=self.year, member__isnull=False)
+            .select_related("account", "member")
+            .order_by("-issue_date")
+        )
+        for inv in qs:
+            self._invoices.setdefault(inv.member_id, inv)
+
+        # 5) organisatieprofielen (keuze gebeurt in admin_views._org_and_payment)
+        self.org_profiles = list(OrganizationProfile.objects.all())
+
+    # --- lookups ---------------------------------------------------------
+
+    def dependents(self, head):
+        return list(self._dependents.get(getattr(head, "pk", None), []))
+
+    def asset_codes(self, member):
+        return list(self._assets.get(getattr(member, "pk", None), []))
+
+    def price_map(self, codes):
+        """Zelfde keuze als de live query: het gevraagde jaar, anders het meest recente jaar met prijzen."""
+        codes = set(codes or ())
+        if not codes:
+            return {}
+        table = self._prices
+        if not any(code in table for code in codes):
+            table = self._fallback_prices
+        return {code: dict(table[code]) for code in codes if code in table}
+
+    def has_year_prices(self) -> bool:
+        return bool(self._prices)
+
+    def invoice_for(self, member):
+        return self._invoices.get(getattr(member, "pk", None))
+
+    def billing_owner(self, member, _seen=None):
+        pk = getattr(member, "pk", None)
+        if _seen is None:
+            _seen = set()
+        if pk and pk in _seen:
+            return member
+        if pk:
+            _seen.add(pk)
+        if getattr(member, "billing_account_id", None):
+            return member
+        via_pk = getattr(member, "factureren_via_id", None)
+        if via_pk and via_pk != pk:
+            via = self.members.get(via_pk) or member.factureren_via
+            return self.billing_owner(via, _seen)
+        head_pk = getattr(member, "household_head_id", None)
+        if head_pk and head_pk != pk:
+            head = self.members.get(head_pk) or member.household_head
+            return self.billing_owner(head, _seen)
+        return member
+
+    def owners(self):
+        """Unieke factuurhouders van alle actieve leden, gesorteerd op (familienaam, voornaam, pk)."""
+        owner_map = {}
+        for person in self.active_members:
+            owner = self.billing_owner(person)
+            owner_pk = getattr(owner, "pk", None)
+            if owner_pk is None:
+                continue
+            owner_map.setdefault(owner_pk, owner)
+        return sorted(owner_map.values(), key=owner_sort_key)
@@ -0,0 +1,137 @@
+"""
+Gedeelde leeskern van de CSV-importen (manage.py import_members_csv, import_member_assets_csv,
+import_member_courses_csv en import_member_phones_csv).
+
+`StreamingImport` leest het bestand rij per rij (nooit de hele lijst in het geheugen) en geeft
+blokken van `chunk_size` rijen aan de import. Elk blok draait in een eigen transactie, samen
+met het bijwerken van het checkpoint (ImportCheckpoint: import, sha256 van het bestand,
+laatst verwerkte rij, tellers). Start dezelfde import opnieuw met hetzelfde bestand na een
+onderbreking, dan worden de al gecommitte rijen overgeslagen. Een ander bestand (andere hash)
+of een afgewerkte import begint vooraan; --restart negeert een open checkpoint.
+
+Met --dry-run wordt er geen checkpoint gelezen of bewaard.
+"""
+import csv
+import hashlib
+from collections import Counter
+from itertools import islice
+
+from django.apps import apps
+from django.db import transaction
+from django.utils import timezone
+
+ImportCheckpoint = apps.get_model("core", "ImportCheckpoint")
+
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def add_arguments(parser):
+    """Opties die alle streamende importen delen."""
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rijen per transactie")
+    parser.add_argument("--restart", action="store_true", help="Open checkpoint negeren en vooraan beginnen")
+
+
+def file_hash(path, block_size=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sniff_delimiter(fh, delimiters=";,", default=","):
+    sample = fh.read(4096)
+    fh.seek(0)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=delimiters).delimiter
+    except Exception:
+        return default
+
+
+class StreamingImport:
+    """
+    Eén import van één bestand. Gebruik:
+
+        job = StreamingImport("import_members_csv", path, chunk_size=..., restart=..., dry_run=...)
+        with job:
+            ...job.fieldnames / job.delimiter controleren...
+            counts = job.run(process_chunk)
+
+    `process_chunk(rows, counts, state)` krijgt een lijst (rijnummer, rij-dict), een Counter
+    met de tellers tot nu toe en een dict met eigen status; beide worden in het checkpoint
+    bewaard en moeten dus JSON-serialiseerbaar blijven.
+    """
+
+    def __init__(self, kind, path, chunk_size=DEFAULT_CHUNK_SIZE, restart=False, dry_run=False, delimiter=None, log=None):
+        self.kind = kind
+        self.path = path
+        self.chunk_size = max(1, int(chunk_size or DEFAULT_CHUNK_SIZE))
+        self.restart = restart
+        self.dry_run = dry_run
+        self.delimiter = delimiter
+        self.log = log
+        self.checkpoint = None
+        self.resumed_from = 0
+        self._fh = None
+        self.reader = None
+
+    def __enter__(self):
+        self._fh = open(self.path, "r", encoding="utf-8-sig", newline="")
+        if self.delimiter is None:
+            self.delimiter = sniff_delimiter(self._fh)
+        self.reader = csv.DictReader(self._fh, delimiter=self.delimiter)
+        return self
+
+    def __exit__(self, *exc):
+        self._fh.close()
+        return False
+
+    @property
+    def fieldnames(self):
+        return self.reader.fieldnames or []
+
+    def _load_checkpoint(self):
+        digest = file_hash(self.path)
+        checkpoint, created = ImportCheckpoint.objects.get_or_create(
+            kind=self.kind, file_hash=digest, defaults={"path": str(self.path)},
+        )
+        if not created and (self.restart or checkpoint.finished_at is not None):
+            checkpoint.last_row = 0
+            checkpoint.state = {}
+            checkpoint.started_at = timezone.now()
+            checkpoint.finished_at = None
+        checkpoint.path = str(self.path)
+        checkpoint.save()
+        self.checkpoint = checkpoint
+        self.resumed_from = checkpoint.last_row
+        if self.resumed_from and self.log:
+            self.log(f"Hervat na rij {self.resumed_from} (checkpoint van {checkpoint.updated_at:%Y-%m-%d %H:%M})")
+
+    def run(self, process_chunk):
+        """Verwerk alle (resterende) rijen; retourneert de tellers van de volledige import."""
+        state = {}
+        counts = Counter()
+        if not self.dry_run:
+            self._load_checkpoint()
+            state = dict(self.checkpoint.state.get("state") or {})
+            counts.update(self.checkpoint.state.get("counts") or {})
+
+        # kopregel = rij 1; enumerate op de reader zelf, zodat er niets gebufferd wordt
+        rows = enumerate(self.reader, start=2)
+        if self.resumed_from:
+            rows = ((idx, row) for idx, row in rows if idx > self.resumed_from)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                process_chunk(chunk, counts, state)
+                if not self.dry_run:
+                    self.checkpoint.last_row = chunk[-1][0]
+                    self.checkpoint.state = {"counts": dict(counts), "state": state}
+                    self.checkpoint.save(update_fields=["last_row", "state", "updated_at"])
+
+        if not self.dry_run:
+            self.checkpoint.finished_at = timezone.now()
+            self.checkpoint.save(update_fields=["finished_at", "updated_at"])
+        return counts
@@ -0,0 +1,203 @@
+"""
+Aanmaak van de jaarfacturen (manage.py generate_yearly_invoices).
+
+De lijnen komen uit de rekenkern (core/billing_engine.py): een jaarfactuur bevat
+exact de lijnen van de preview en de jaar-PDF van haar factuurhouder. De bulk-modus
+werkt in twee stappen:
+
+1. `compute_entries`: per factuurhouder de lijnen berekenen (optioneel één partitie,
+   op basis van een stabiele hash van het id van de factuurhouder);
+2. `sync_entries`: facturen en lijnen per blok met bulk_create wegschrijven.
+
+Elke jaarfactuur krijgt een sleutel (jaar + factuurhouder) en een vingerafdruk van haar
+inhoud: de lijnen (afgeleid van leden, rollen, leeftijden, assets en prijzen) en het
+facturatie-account. Een nieuwe run slaat ongewijzigde huishoudens over, herschrijft
+enkel concepten met een andere vingerafdruk en laat gefinaliseerde facturen met rust.
+
+Met --jobs draaien stap 1 en (behalve op SQLite, dat maar één schrijver toelaat)
+stap 2 in een procespool. De uitkomst hangt niet af van het aantal jobs: de
+entries worden altijd in de volgorde van de factuurhouders verwerkt.
+
+Modellen worden pas in de functies geïmporteerd: de workers (spawn) laden deze
+module vóór Django opgestart is.
+"""
+import hashlib
+import json
+import os
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+
+
+def first_monday(year: int) -> date:
+    d = date(year, 1, 1)
+    delta = (7 - d.weekday()) % 7
+    return d + timedelta(days=delta)
+
+
+def partition_of(owner_pk: int, jobs: int) -> int:
+    """Stabiele partitie van een factuurhouder (onafhankelijk van PYTHONHASHSEED)."""
+    return zlib.crc32(str(owner_pk).encode()) % jobs if jobs > 1 else 0
+
+
+def generation_key(year: int, owner_pk: int) -> str:
+    return f"{year}:{owner_pk}"
+
+
+def make_entry(year: int, position: int, owner, lines):
+    from .billing_engine import _member_display_name
+
+    account_id = getattr(owner, "billing_account_id", None)
+    payload = json.dumps([account_id, lines], sort_keys=True, default=str)
+    return {
+        "position": position, "owner_pk": owner.pk, "account_id": account_id,
+        "name": _member_display_name(owner), "lines": lines,
+        "key": generation_key(year, owner.pk),
+        "fingerprint": hashlib.sha256(payload.encode()).hexdigest(),
+    }
+
+
+def compute_entries(year: int, jobs: int = 1, index: int = 0, engine=None):
+    """
+    Entries (zie make_entry) voor de factuurhouders van partitie `index` (van `jobs`), in
+    de volgorde van de factuurhouders. Retourneert (entries, overgeslagen, notities).
+    """
+    from .billing_engine import compile_year
+
+    engine = engine or compile_year(year)
+    entries, notes = [], []
+    skipped = 0
+    for position, owner in enumerate(engine.owners()):
+        if partition_of(owner.pk, jobs) != index:
+            continue
+        lines, owner_notes = engine.invoice_lines(owner)
+        notes.extend(owner_notes)
+        if not lines:
+            skipped += 1
+            continue
+        entries.append(make_entry(year, position, owner, lines))
+    return entries, skipped, notes
+
+
+def _locked(invoice) -> bool:
+    return bool(invoice.number) or invoice.status in (invoice.STATUS_FINAL, invoice.STATUS_CANCELLED)
+
+
+def sync_entries(entries, issue_dt: date, chunk_size: int = 500, dry_run: bool = False, progress=None):
+    """
+    Breng de jaarfacturen van deze entries in orde, per blok van `chunk_size` (één transactie
+    per blok, bulk_create/bulk_update). Per huishouden: geen factuur → nieuw; concept met
+    dezelfde vingerafdruk → ongewijzigd; concept met een andere → herschreven (zelfde factuur,
+    nieuwe lijnen en factuurdatum); gefinaliseerd → niet aangeraakt. Lijnsignalen worden uitgesteld: de
+    opgeslagen totalen worden in het geheugen berekend (line_totals).
+    Zet `action` in elke entry; retourneert een Counter met de aantallen per actie en
+    het aantal geschreven lijnen.
+    """
+    from django.db import transaction
+
+    from .invoice_totals import deferred, line_totals
+    from .models import Invoice, InvoiceLine
+
+    counts = Counter()
+    for start in range(0, len(entries), chunk_size):
+        chunk = entries[start:start + chunk_size]
+        existing = {}
+        for inv in (
+            Invoice.objects.filter(generation_key__in=[e["key"] for e in chunk])
+            .only("pk", "status", "number", "generation_key", "generation_fingerprint").order_by("pk")
+        ):
+            existing.setdefault(inv.generation_key, []).append(inv)
+
+        new, rewrite, duplicates, lines = [], [], [], []
+        for entry in chunk:
+            current = existing.get(entry["key"], [])
+            if any(_locked(inv) for inv in current):
+                entry["action"] = "definitief"
+            elif len(current) == 1 and current[0].generation_fingerprint == entry["fingerprint"]:
+                entry["action"] = "ongewijzigd"
+            else:
+                entry["action"] = "herschreven" if current else "nieuw"
+            counts[entry["action"]] += 1
+            if entry["action"] == "herschreven":
+                inv, extra = current[0], current[1:]
+                duplicates.extend(extra)
+                rewrite.append(inv)
+            elif entry["action"] == "nieuw":
+                inv = Invoice(issue_date=issue_dt, doc_type=Invoice.TYPE_INVOICE, status=Invoice.STATUS_DRAFT, generation_key=entry["key"])
+                new.append(inv)
+            else:
+                continue
+            inv.issue_date = issue_dt
+            inv.account_id = entry["account_id"]
+            inv.member_id = entry["owner_pk"]
+            inv.generation_fingerprint = entry["fingerprint"]
+            inv_lines = [InvoiceLine(invoice=inv, **l) for l in entry["lines"]]
+            inv.total_excl_cached, inv.total_vat_cached, inv.total_incl_cached = line_totals(inv_lines)
+            lines.extend(inv_lines)
+
+        if not dry_run:
+            with transaction.atomic(), deferred():
+                Invoice.objects.filter(pk__in=[inv.pk for inv in duplicates]).delete()
+                InvoiceLine.objects.filter(invoice__in=[inv.pk for inv in rewrite]).delete()
+                Invoice.objects.bulk_update(
+                    rewrite, ["issue_date", "account", "member", "generation_fingerprint", "total_excl_cached", "total_vat_cached", "total_incl_cached"],
+                    batch_size=500,
+                )
+                Invoice.objects.bulk_create(new)
+                InvoiceLine.objects.bulk_create(lines, batch_size=1000)
+            counts["lijnen"] += len(lines)
+        if progress:
+            progress(start + len(chunk), len(entries))
+    return counts
+
+
+def remove_obsolete(year: int, keep_keys, dry_run: bool = False) -> int:
+    """Concept-jaarfacturen van huishoudens die niet meer gefactureerd worden (ook: factuurhouder weg)."""
+    from .invoice_totals import deferred
+    from .models import Invoice
+
+    keep_keys = set(keep_keys)
+    obsolete = [
+        inv.pk
+        for inv in Invoice.objects.filter(generation_key__startswith=f"{year}:").only("pk", "status", "number", "generation_key")
+        if inv.generation_key not in keep_keys and not _locked(inv)
+    ]
+    if obsolete and not dry_run:
+        with deferred():
+            Invoice.objects.filter(pk__in=obsolete).delete()
+    return len(obsolete)
+
+
+def summary(counts, removed: int) -> str:
+    return (
+        f"nieuw={counts['nieuw']}, herschreven={counts['herschreven']}, ongewijzigd={counts['ongewijzigd']}, "
+        f"definitief (niet aangeraakt)={counts['definitief']}, vervallen concepten={removed}"
+    )
+
+
+# ---------- workers (--jobs) ----------
+
+def _worker_init():
+    """Initialiser van de procespool (spawn): Django opstarten."""
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+    django.setup()
+
+
+def compute_partition(year: int, jobs: int, index: int):
+    from django.db import connections
+
+    try:
+        return compute_entries(year, jobs, index)
+    finally:
+        connections.close_all()
+
+
+def sync_partition(entries, issue_dt: date, chunk_size: int):
+    """Schrijft één partitie over de eigen databaseverbinding van de worker."""
+    from django.db import connections
+
+    try:
+        return sync_entries(entries, issue_dt, chunk_size)
+    finally:
+        connections.close_all()
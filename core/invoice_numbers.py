@@ -0,0 +1,138 @@
+"""
+Factuurnummers (JJJJ#####) en OGM-referenties: de enige plaats waar nummers uitgedeeld worden.
+
+Alle paden (Invoice.finalize, bulk-finaliseren, core/numbering.py) gebruiken
+`reserve_numbers`. Die verhoogt YearSequence met één UPDATE ... SET last_number =
+last_number + n en leest het resultaat terug binnen dezelfde transactie. De UPDATE
+is de eerste schrijfactie en lockt de rij (PostgreSQL) of de database (SQLite) tot
+de commit, zodat gelijktijdige finalisaties elkaar netjes opvolgen: uniek en zonder gaten.
+
+`finalize_invoices` finaliseert een selectie in één transactie met één blok per jaar,
+in de volgorde van de selectie.
+"""
+from django.apps import apps
+from django.db import transaction
+from django.db.models import F, Q
+
+Invoice = apps.get_model("core", "Invoice")
+YearSequence = apps.get_model("core", "YearSequence")
+
+
+def format_number(year: int, seq: int) -> str:
+    return f"{year}{seq:05d}"
+
+
+def ogm_raw(number: str) -> str:
+    """12 cijfers van de gestructureerde mededeling (zelfde mod-97 als Invoice._ogm_from_invoice_number)."""
+    digits = "".join(ch for ch in (number or "") if ch.isdigit())
+    base = digits.zfill(10)[-10:]
+    check = int(base) % 97
+    if check == 0:
+        check = 97
+    return f"{base}{check:02d}"
+
+
+def parse_number(number: str):
+    """(jaar, volgnummer) of (None, None) als het geen JJJJ#####-nummer is."""
+    number = number or ""
+    if len(number) != 9 or not number.isdigit():
+        return None, None
+    return int(number[:4]), int(number[4:])
+
+
+def _bump(year: int, delta) -> int:
+    """UPDATE van de teller (lockt de rij tot de commit) en lees de nieuwe waarde terug."""
+    qs = YearSequence.objects.filter(year=year)
+    if not qs.update(last_number=F("last_number") + delta):
+        YearSequence.objects.get_or_create(year=year, defaults={"last_number": 0})
+        qs.update(last_number=F("last_number") + delta)
+    return qs.values_list("last_number", flat=True).get()
+
+
+def lock_sequences(years):
+    """Lock de tellers van deze jaren zonder ze te wijzigen (vóór andere reads in de transactie)."""
+    for year in sorted(set(years)):
+        _bump(year, 0)
+
+
+def reserve_numbers(year: int, count: int):
+    """
+    Reserveer `count` opeenvolgende nummers voor `year`. Gebruik de nummers in dezelfde
+    transactie als de reservatie; bij een rollback worden ze vrijgegeven.
+    """
+    if count <= 0:
+        return []
+    with transaction.atomic():
+        last = _bump(year, count)
+    first = last - count + 1
+    return [format_number(year, n) for n in range(first, first + count)]
+
+
+def next_number(year: int) -> str:
+    return reserve_numbers(year, 1)[0]
+
+
+def claim_number(number: str):
+    """Handmatig ingevuld nummer: teller meeschuiven als het nummer verder ligt dan de teller."""
+    year, seq = parse_number(number)
+    if year is None:
+        raise ValueError(number)
+    with transaction.atomic():
+        if _bump(year, 0) < seq:
+            YearSequence.objects.filter(year=year, last_number__lt=seq).update(last_number=seq)
+
+
+def needs_finalizing(invoice) -> bool:
+    return not (invoice.status == Invoice.STATUS_FINAL and invoice.number)
+
+
+def finalize_invoices(invoices):
+    """
+    Finaliseer de facturen in de gegeven volgorde (queryset of lijst).
+    Retourneert de lijst gefinaliseerde facturen; reeds gefinaliseerde worden overgeslagen.
+    """
+    order = [getattr(inv, "pk", inv) for inv in invoices]
+    if not order:
+        return []
+    years = Invoice.objects.filter(pk__in=order).dates("issue_date", "year")
+
+    with transaction.atomic():
+        # eerst de tellers locken (eerste schrijfactie), dan de rijen opnieuw lezen:
+        # een andere gebruiker kan net gefinaliseerd hebben
+        lock_sequences(d.year for d in years)
+        locked = {
+            inv.pk: inv
+            for inv in Invoice.objects.select_for_update().filter(pk__in=order)
+            .filter(Q(status=Invoice.STATUS_DRAFT) | Q(number__isnull=True) | Q(number=""))
+            .only("pk", "issue_date", "status", "number")
+        }
+        totals = {inv.pk: inv for inv in Invoice.objects.filter(pk__in=list(locked)).with_totals().only("pk")}
+
+        by_year = {}
+        for pk in order:
+            inv = locked.get(pk)
+            if inv is not None and needs_finalizing(inv):
+                by_year.setdefault(inv.issue_date.year, []).append(inv)
+
+        done = []
+        for year in sorted(by_year):
+            batch = by_year[year]
+            for inv, number in zip(batch, reserve_numbers(year, len(batch))):
+                inv.number = number
+                inv.payment_reference_raw = ogm_raw(number)
+                inv.status = Invoice.STATUS_FINAL
+                # totalen bevriezen (zie core/invoice_totals.py)
+                calc = totals[inv.pk]
+                inv.total_excl_cached = calc.total_excl
+                inv.total_vat_cached = calc.total_vat
+                inv.total_incl_cached = calc.total_incl
+                done.append(inv)
+
+        Invoice.objects.bulk_update(
+            done,
+            ["number", "payment_reference_raw", "status", "total_excl_cached", "total_vat_cached", "total_incl_cached"],
+            batch_size=500,
+        )
+    position = {pk: i for i, pk in enumerate(order)}
+    done.sort(key=lambda inv: position[inv.pk])
+    return done
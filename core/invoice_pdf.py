@@ -0,0 +1,208 @@
+"""
+Server-side PDF's van de jaarfacturen (één bestand per huishouden).
+
+Rendering gebeurt in een procespool; elke worker laadt één BillingSnapshot en
+rendert daarna enkel HTML → PDF. Bestanden worden atomair weggeschreven, zodat
+een onderbroken run gewoon verder kan met de ontbrekende huishoudens.
+
+Eén run per map tegelijk: de run houdt een lockbestand met zijn pid vast (render_lock).
+
+PDF-conversie vereist WeasyPrint (met pango) en samenvoegen tot één PDF pypdf; beide
+staan in requirements.txt en de Dockerfile. Zonder WeasyPrint is de export uitgeschakeld.
+"""
+import json
+import mimetypes
+import os
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.http import HttpRequest, QueryDict
+from django.template.loader import get_template
+from django.utils.text import slugify
+
+try:
+    from weasyprint import HTML, default_url_fetcher
+except Exception:  # niet geïnstalleerd of systeembibliotheken (pango) ontbreken
+    HTML = None
+    default_url_fetcher = None
+
+PAPIER_TEMPLATES = {
+    "digitaal": "invoices/print_logo.html",
+    "voorbedrukt": "invoices/print_preprinted.html",
+}
+PROGRESS_FILE = "progress.json"
+LOCK_FILE = "render.lock"
+
+
+def pdf_available() -> bool:
+    return HTML is not None
+
+
+def default_output_dir(year: int, papier: str) -> Path:
+    return Path(settings.BASE_DIR) / "exports" / f"jaarfacturen-{year}-{papier}"
+
+
+def pdf_filename(owner, year: int) -> str:
+    name = slugify(f"{getattr(owner, 'last_name', '')} {getattr(owner, 'first_name', '')}") or "lid"
+    return f"{year}-{owner.pk:06d}-{name}.pdf"
+
+
+# ---------- HTML ----------
+
+def _print_request(papier: str) -> HttpRequest:
+    # print.html leest de papiersoort uit request.GET
+    request = HttpRequest()
+    request.GET = QueryDict(f"papier={papier}")
+    return request
+
+
+def render_yearly_invoice_html(owner, year: int, papier: str, snapshot=None) -> str:
+    from .admin_views import _yearly_invoice_context
+
+    ctx = _yearly_invoice_context(owner, year, snapshot=snapshot)
+    ctx["papier"] = papier
+    request = _print_request(papier)
+    html = get_template(PAPIER_TEMPLATES.get(papier, "invoices/print.html")).render(ctx, request)
+    if not html.strip():
+        html = get_template("invoices/print.html").render(ctx, request)
+    return html
+
+
+def _static_url_fetcher(url, *args, **kwargs):
+    """Laat /static/... rechtstreeks uit de staticfiles-finders komen i.p.v. via HTTP."""
+    path = urlparse(url).path
+    static_prefix = "/" + settings.STATIC_URL.lstrip("/")
+    if path.startswith(static_prefix):
+        found = finders.find(path[len(static_prefix):])
+        if found:
+            return {
+                "file_obj": open(found, "rb"),
+                "mime_type": mimetypes.guess_type(found)[0] or "application/octet-stream",
+                "redirected_url": url,
+            }
+    return default_url_fetcher(url, *args, **kwargs)
+
+
+def html_to_pdf(html: str) -> bytes:
+    if HTML is None:
+        raise RuntimeError("WeasyPrint is niet beschikbaar (pip install weasyprint + pango).")
+    return HTML(string=html, base_url="file:///", url_fetcher=_static_url_fetcher).write_pdf()
+
+
+# ---------- workers ----------
+
+_worker_snapshot = None
+
+
+def _worker_init(year: int):
+    """Initialiser van de procespool (spawn): Django opstarten en één snapshot laden."""
+    global _worker_snapshot
+    import django
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+    django.setup()
+    from .billing_snapshot import BillingSnapshot
+    _worker_snapshot = BillingSnapshot(year)
+
+
+def render_owner_pdf(year: int, papier: str, owner_pk: int, out_path: str, snapshot=None) -> str:
+    snapshot = snapshot or _worker_snapshot
+    owner = snapshot.members[owner_pk]
+    pdf = html_to_pdf(render_yearly_invoice_html(owner, year, papier, snapshot=snapshot))
+    tmp = f"{out_path}.part"
+    with open(tmp, "wb") as fh:
+        fh.write(pdf)
+    os.replace(tmp, out_path)  # atomair: half geschreven bestanden bestaan nooit
+    return out_path
+
+
+# ---------- voortgang & bundelen ----------
+
+def write_progress(out_dir: Path, **data):
+    tmp = out_dir / f"{PROGRESS_FILE}.part"
+    tmp.write_text(json.dumps(data), encoding="utf-8")
+    os.replace(tmp, out_dir / PROGRESS_FILE)
+
+
+def read_progress(out_dir: Path):
+    try:
+        return json.loads((Path(out_dir) / PROGRESS_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+class RenderLocked(RuntimeError):
+    pass
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # bestaat, maar van een andere gebruiker
+        return True
+    return True
+
+
+def running_pid(out_dir: Path):
+    """Pid van de run die nu in `out_dir` rendert, anders None (ook bij een achtergelaten lock)."""
+    try:
+        pid = int((Path(out_dir) / LOCK_FILE).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+    return pid if _pid_alive(pid) else None
+
+
+@contextmanager
+def render_lock(out_dir: Path):
+    """
+    Lockbestand met de eigen pid zolang de run loopt. RenderLocked als een andere run
+    de map al heeft; de lock van een gecrashte run wordt overgenomen.
+    """
+    path = Path(out_dir) / LOCK_FILE
+    tmp = path.with_name(f"{LOCK_FILE}.{os.getpid()}")
+    tmp.write_text(str(os.getpid()), encoding="utf-8")
+    try:
+        while True:
+            try:
+                os.link(tmp, path)  # atomair en faalt als de lock al bestaat
+                break
+            except FileExistsError:
+                pid = running_pid(out_dir)
+                if pid is not None:
+                    raise RenderLocked(f"Er loopt al een PDF-export in {out_dir} (pid {pid}).")
+                path.unlink(missing_ok=True)
+    finally:
+        tmp.unlink(missing_ok=True)
+    try:
+        yield
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def bundle_zip(paths, zip_path: Path) -> Path:
+    tmp = zip_path.with_suffix(".zip.part")
+    with zipfile.ZipFile(tmp, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for p in paths:
+            zf.write(p, arcname=Path(p).name)
+    os.replace(tmp, zip_path)
+    return zip_path
+
+
+def bundle_merged_pdf(paths, pdf_path: Path) -> Path:
+    try:
+        from pypdf import PdfWriter
+    except ImportError:
+        raise RuntimeError("Samenvoegen tot één PDF vereist pypdf (pip install pypdf).")
+    writer = PdfWriter()
+    for p in paths:
+        writer.append(str(p))
+    tmp = pdf_path.with_suffix(".pdf.part")
+    with open(tmp, "wb") as fh:
+        writer.write(fh)
+    os.replace(tmp, pdf_path)
+    return pdf_path
@@ -0,0 +1,80 @@
+"""
+Opgeslagen factuurtotalen (Invoice.total_*_cached).
+
+Elke bewaarde of verwijderde InvoiceLine (ook via de inline formset in de admin)
+herberekent de totalen van haar factuur. Gefinaliseerde facturen zijn bevroren:
+hun totalen worden enkel bij `finalize()` gezet. `manage.py verify_invoice_totals`
+spoort afwijkingen op.
+"""
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+Invoice = apps.get_model("core", "Invoice")
+InvoiceLine = apps.get_model("core", "InvoiceLine")
+
+CACHED_FIELDS = ("total_excl_cached", "total_vat_cached", "total_incl_cached")
+
+_state = threading.local()
+
+
+@contextmanager
+def deferred():
+    """Lijnsignalen negeren (bulkbewerkingen die de totalen zelf zetten)."""
+    previous = getattr(_state, "deferred", False)
+    _state.deferred = True
+    try:
+        yield
+    finally:
+        _state.deferred = previous
+
+
+def computed_totals(invoice):
+    """(excl, btw, incl) uit de lijnen; gebruikt de with_totals()-annotaties als die er zijn."""
+    return invoice.total_excl, invoice.total_vat, invoice.total_incl
+
+
+def line_totals(lines):
+    """(excl, btw, incl) van lijnen in het geheugen; zelfde afronding als Invoice.total_*."""
+    excl = vat = Decimal("0.00")
+    for line in lines:
+        base = line.unit_price_excl * line.quantity
+        excl += base
+        vat += base * (line.vat_rate / Decimal("100"))
+    excl = excl.quantize(Decimal("0.01"))
+    vat = vat.quantize(Decimal("0.01"))
+    return excl, vat, (excl + vat).quantize(Decimal("0.01"))
+
+
+def stored_totals(invoice):
+    return invoice.total_excl_cached, invoice.total_vat_cached, invoice.total_incl_cached
+
+
+def refresh_invoice_totals(invoice_ids, include_finalized=False) -> int:
+    """Herbereken de opgeslagen totalen (1 SELECT + 1 UPDATE per batch). Retourneert het aantal gewijzigde facturen."""
+    ids = {pk for pk in invoice_ids if pk}
+    if not ids:
+        return 0
+    qs = Invoice.objects.filter(pk__in=ids)
+    if not include_finalized:
+        qs = qs.exclude(status=Invoice.STATUS_FINAL)
+    changed = []
+    for inv in qs.with_totals().only("pk", "status", *CACHED_FIELDS):
+        totals = computed_totals(inv)
+        if totals != stored_totals(inv):
+            inv.total_excl_cached, inv.total_vat_cached, inv.total_incl_cached = totals
+            changed.append(inv)
+    Invoice.objects.bulk_update(changed, CACHED_FIELDS, batch_size=500)
+    return len(changed)
+
+
+@receiver(post_save, sender=InvoiceLine)
+@receiver(post_delete, sender=InvoiceLine)
+def _line_changed(sender, instance, raw=False, **kwargs):
+    if raw or getattr(_state, "deferred", False):
+        return
+    refresh_invoice_totals([instance.invoice_id])
@@ -1,13 +1,22 @@
 from django.core.management.base import BaseCommand
-from core.annual_engine import apply_assets
+from core.annual_engine import apply_assets, plan_assets, simulate_assets
 
 class Command(BaseCommand):
     help = "Maak factuurlijnen voor kasten/karren (conceptfacturen)."
 
     def add_arguments(self, parser):
         parser.add_argument("--year", type=int, required=True)
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Toon de lijnen (zoals annual_simulate_assets) zonder iets weg te schrijven")
 
     def handle(self, *args, **opts):
         year = opts["year"]
-        n = apply_assets(year)
-        self.stdout.write(self.style.SUCCESS(f"Aangemaakte regels: {n}"))
+        plan = plan_assets(year)
+        if opts["dry_run"]:
+            for member, asset_type, code, text in simulate_assets(year, plan):
+                self.stdout.write(f"- {member} · {asset_type} · {code} · {text}")
+        n, created = apply_assets(year, dry_run=opts["dry_run"], plan=plan)
+        if opts["dry_run"]:
+            self.stdout.write(self.style.SUCCESS(f"[DRY-RUN] Aan te maken regels: {n}, nieuwe conceptfacturen: {created}"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Aangemaakte regels: {n}, nieuwe conceptfacturen: {created}"))
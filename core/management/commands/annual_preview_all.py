@@ -0,0 +1,109 @@
+import csv
+import json
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Member, YearPricing, YearRule
+from core.year_rules import BILL_TO_HEAD, rule_members
+
+COLUMNS = [
+    "year", "rule_order", "rule_code", "member_id", "member_name", "bill_to", "target_id", "target_name",
+    "price_code", "quantity", "unit_price_excl", "vat_rate", "amount_excl", "note",
+]
+
+
+def _name(first, last):
+    return " ".join(part for part in ((first or "").strip(), (last or "").strip()) if part)
+
+
+def _rule_price(rule, data, prices):
+    """(prijscode, eenheidsprijs, btw, notitie): prijs uit de regel zelf, anders de YearPricing van het jaar."""
+    code = data.get("price_code") or data.get("code") or rule.code
+    if data.get("unit_price_excl") not in (None, ""):
+        return code, Decimal(str(data["unit_price_excl"])), data.get("vat_rate", ""), ""
+    pricing = prices.get(code)
+    if pricing is None:
+        return code, None, "", "geen YearPricing"
+    note = "bedrag via investeringsschaal" if data.get("use_invest_scale") else ""
+    return code, pricing.amount, pricing.vat_rate, note
+
+
+class Command(BaseCommand):
+    help = (
+        "Toon voor de hele club welke jaarregels zouden gelden: één rij per (lid, regel, factuur, bedrag), "
+        "gestreamd als CSV of JSON Lines."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, default=timezone.now().year, help="Jaar (default: huidig)")
+        parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+        parser.add_argument("--output", help="Bestand (default: stdout)")
+        parser.add_argument("--include-inactive", action="store_true", help="Ook inactieve regels")
+
+    def handle(self, *args, **opts):
+        year = int(opts["year"])
+        rules = YearRule.objects.filter(year=year).order_by("order", "code")
+        if not opts["include_inactive"]:
+            rules = rules.filter(active=True)
+        rules = list(rules)
+        if not rules:
+            raise CommandError(f"Geen YearRules voor {year}.")
+        prices = {p.code: p for p in YearPricing.objects.filter(year=year, active=True)}
+
+        if opts["output"]:
+            out = open(opts["output"], "w", newline="", encoding="utf-8")
+        else:
+            out = self.stdout
+        # samenvatting naar stderr als de rijen naar stdout gaan
+        log = self.stdout if opts["output"] else self.stderr
+
+        start = time.perf_counter()
+        rows = 0
+        per_rule = []
+        try:
+            if opts["format"] == "csv":
+                writer = csv.writer(out, lineterminator="\n")
+                writer.writerow(COLUMNS)
+                write = writer.writerow
+            else:
+                def write(values):
+                    out.write(json.dumps(dict(zip(COLUMNS, values)), ensure_ascii=False, default=str) + "\n")
+
+            # zelfde leden als de jaarpreview: enkel actieve
+            for rule, members in rule_members(year, rules=rules, members=Member.objects.filter(active=True)):
+                data = rule.data or {}
+                head_bill = data.get("bill_to") in BILL_TO_HEAD
+                code, unit, vat_rate, note = _rule_price(rule, data, prices)
+                quantity = Decimal(str(data.get("quantity", 1)))
+                amount = (unit * quantity).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP) if unit is not None else ""
+                count = 0
+                for pk, first, last, head_id, head_first, head_last in members.order_by("pk").values_list(
+                    "pk", "first_name", "last_name", "household_head_id",
+                    "household_head__first_name", "household_head__last_name",
+                ).iterator(chunk_size=2000):
+                    name = _name(first, last)
+                    if head_bill and head_id and head_id != pk:
+                        bill_to, target_id, target_name = "head", head_id, _name(head_first, head_last)
+                    else:
+                        bill_to, target_id, target_name = "self", pk, name
+                    write([
+                        year, rule.order, rule.code, pk, name, bill_to, target_id, target_name,
+                        code, quantity, "" if unit is None else unit, vat_rate, amount, note,
+                    ])
+                    count += 1
+                rows += count
+                per_rule.append((rule, count))
+        finally:
+            if opts["output"]:
+                out.close()
+
+        elapsed = time.perf_counter() - start
+        for rule, count in per_rule:
+            log.write(f"  order={rule.order:02d} {rule.code}: {count} leden")
+        log.write(
+            f"Klaar: {rows} rijen voor {len(per_rule)} regels ({year}) in {elapsed:.2f}s"
+            + (f" → {opts['output']}" if opts["output"] else "")
+        )
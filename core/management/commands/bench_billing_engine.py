@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.billing_engine import compile_year
+
+
+class Command(BaseCommand):
+    help = "Benchmark van de rekenkern: inlezen van een jaar en huishoudens per seconde (preview en factuurlijnen)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, default=timezone.now().year)
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        year = opts["year"]
+        best = {}
+        for rnd in range(1, opts["rounds"] + 1):
+            start = time.perf_counter()
+            engine = compile_year(year)
+            owners = engine.owners()
+            compiled = time.perf_counter() - start
+            if not owners:
+                raise CommandError(f"Geen actieve leden om te rekenen voor {year}.")
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for owner in owners:
+                    engine.evaluate(owner)
+                evaluated = time.perf_counter() - start
+
+                start = time.perf_counter()
+                line_count = 0
+                for owner in owners:
+                    line_count += len(engine.invoice_lines(owner)[0])
+                generated = time.perf_counter() - start
+
+            rates = {"preview": len(owners) / evaluated, "factuurlijnen": len(owners) / generated}
+            for key, rate in rates.items():
+                best[key] = max(best.get(key, 0), rate)
+            self.stdout.write(
+                f"ronde {rnd}: inlezen {compiled:.3f}s, {len(owners)} factuurhouders, "
+                f"preview {rates['preview']:,.0f}/s, factuurlijnen {rates['factuurlijnen']:,.0f}/s "
+                f"({line_count} lijnen, {len(queries)} queries na het inlezen)"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Beste: preview {best['preview']:,.0f}/s, factuurlijnen {best['factuurlijnen']:,.0f}/s"
+        ))
@@ -0,0 +1,48 @@
+import time
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from core.ubl_writer import ubl_bytes
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark van de UBL-writer: hoeveel facturen per seconde geserialiseerd worden (zonder database)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=5000, help="Aantal facturen per ronde")
+        parser.add_argument("--lines", type=int, default=5, help="Lijnen per factuur")
+        parser.add_argument("--rounds", type=int, default=3)
+
+    def handle(self, *args, **opts):
+        org = {
+            "id": 1, "name": "Spiegelven Golf & Country Club", "address_line1": "Wiemesmeerstraat 109",
+            "address_line2": "", "postal_code": "3600", "city": "Genk", "country": "BE",
+            "vat_number": "BE0123456789", "email": "info@spiegelven.be", "website": "", "iban": "",
+            "bic": "", "phone": "+32 89 35 96 16", "fax": "",
+        }
+        account = SimpleNamespace(name="Peeters BV", street="Stationsstraat 1", city="Hasselt",
+                                  postal_code="3500", country="BE", vat_number="BE0999999999", email="a@b.be")
+        lines = [
+            SimpleNamespace(description=f"Lijn {i} <&>", quantity=Decimal("1.00"),
+                            unit_price_excl=Decimal("123.45") + i, vat_rate=Decimal("21.00") if i % 2 else Decimal("6.00"))
+            for i in range(opts["lines"])
+        ]
+        invoices = [
+            SimpleNamespace(pk=i, number=f"2025{i:05d}", issue_date=date(2025, 1, 1), account=account, member=None)
+            for i in range(opts["count"])
+        ]
+
+        best = None
+        for rnd in range(1, opts["rounds"] + 1):
+            start = time.perf_counter()
+            size = 0
+            for inv in invoices:
+                size += len(ubl_bytes(inv, org, lines))
+            elapsed = time.perf_counter() - start
+            rate = len(invoices) / elapsed
+            best = rate if best is None else max(best, rate)
+            self.stdout.write(f"ronde {rnd}: {len(invoices)} facturen in {elapsed:.3f}s = {rate:,.0f}/s ({size / len(invoices):.0f} bytes/factuur)")
+        self.stdout.write(self.style.SUCCESS(f"Beste: {best:,.0f} facturen/s met {opts['lines']} lijnen"))
@@ -1,145 +1,128 @@
-from datetime import date, timedelta
-from decimal import Decimal, ROUND_HALF_UP
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
+from django.db import connection
 from django.utils import timezone
-from django.db.models import Q
-from core.models import Member, Invoice, InvoiceLine, YearPlan, YearPlanItem, MemberAsset, InvoiceAccount
-
-def first_monday(year: int) -> date:
-    d = date(year, 1, 1)
-    delta = (7 - d.weekday()) % 7
-    return d + timedelta(days=delta)
-
-def age_on(dob, ref: date) -> int:
-    if not dob:
-        return 0
-    return ref.year - dob.year - ((ref.month, ref.day) < (dob.month, dob.day))
-
-def q2(x) -> Decimal:
-    return Decimal(x).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+from core.billing_engine import compile_year
+from core.invoice_generation import (
+    compute_entries, compute_partition, first_monday, make_entry, partition_of, remove_obsolete,
+    summary, sync_entries, sync_partition, _worker_init,
+)
+
+ACTION_LABELS = {
+    "nieuw": "+ Factuur aangemaakt voor",
+    "herschreven": "~ Concept herschreven voor",
+    "ongewijzigd": "= Ongewijzigd:",
+    "definitief": "# Gefinaliseerd, niet aangeraakt:",
+}
 
 class Command(BaseCommand):
-    help = "Genereer jaarfacturen per gezinshoofd/individueel voor het opgegeven jaar."
+    help = "Genereer jaarfacturen per factuurhouder voor het opgegeven jaar (zelfde lijnen als de jaarpreview)."
 
     def add_arguments(self, parser):
         parser.add_argument("--year", type=int, default=timezone.now().year)
         parser.add_argument("--commit", action="store_true")
+        parser.add_argument("--bulk", action="store_true",
+                            help="Alles vooraf inlezen en per blok wegschrijven met bulk_create")
+        parser.add_argument("--chunk-size", type=int, default=500, help="Facturen per transactie in --bulk")
+        parser.add_argument("--jobs", type=int, default=1,
+                            help="Aantal processen (impliceert --bulk); op SQLite schrijft enkel het hoofdproces")
 
     def handle(self, *args, **opts):
         year = opts["year"]
         do_commit = opts["commit"]
 
-        try:
-            plan = YearPlan.objects.get(year=year)
-        except YearPlan.DoesNotExist:
-            raise CommandError(f"Geen YearPlan voor {year}.")
-
-        items = {i.code: i for i in YearPlanItem.objects.filter(yearplan=plan)}
-        ref_date = date(year, 1, 1)
+        engine = compile_year(year)
+        if not engine.has_prices():
+            raise CommandError(f"Geen YearPricing voor {year}.")
         issue_dt = first_monday(year)
 
-        heads = Member.objects.filter(household_head__isnull=True).order_by("last_name", "first_name")
-        self.stdout.write(f"Gevonden gezinshoofden/individuelen: {heads.count()}")
-
-        created = 0
-        skipped = 0
+        if opts["bulk"] or opts["jobs"] > 1:
+            counts, removed, skipped = self._handle_bulk(year, engine, issue_dt, do_commit, max(1, opts["chunk_size"]), max(1, opts["jobs"]), opts["verbosity"])
+            self._finish(year, issue_dt, do_commit, counts, removed, skipped)
+            return
 
-        def resolve_account(head: Member) -> InvoiceAccount:
-            if getattr(head, "billing_account_id", None):
-                return head.billing_account
-            first = getattr(head, "first_name", "") or ""
-            last = getattr(head, "last_name", "") or ""
-            name = (first + " " + last).strip() or str(head)
-            email = (getattr(head, "email", "") or "").strip()
-            if email:
-                acc, _ = InvoiceAccount.objects.get_or_create(email=email, defaults={"name": name, "email": email})
-            else:
-                acc, _ = InvoiceAccount.objects.get_or_create(name=name, defaults={"name": name})
-            return acc
+        owners = engine.owners()
+        self.stdout.write(f"Gevonden factuurhouders: {len(owners)}")
 
-        for head in heads:
-            leden = Member.objects.filter(Q(pk=head.pk) | Q(household_head=head)).order_by("last_name", "first_name")
-            if not leden.exists():
+        counts = Counter()
+        skipped = 0
+        keys = []
+        prefix = "" if do_commit else "[DRY-RUN] "
+
+        for position, owner in enumerate(owners):
+            lines, notes = engine.invoice_lines(owner)
+            if opts["verbosity"] >= 2:
+                for note in notes:
+                    self.stdout.write(f"  ! {note}")
+            if not lines:
                 skipped += 1
                 continue
 
-            volwassenen = [m for m in leden if getattr(m, "household_role", "") in ("GEZINSHOOFD", "PARTNER")]
-            kinderen = [m for m in leden if m not in volwassenen]
-
-            account = resolve_account(head)
-            inv = Invoice(account=account, issue_date=issue_dt, doc_type="FACTUUR", status="CONCEPT")
-            lines_to_add = []
-
-            def add_by_code(code: str, fallback_desc: str, qty=1, override_price=None):
-                ypi = items.get(code)
-                if not ypi:
-                    self.stdout.write(f"  ! ontbrekend YearPlanItem code={code} → lijn overgeslagen")
-                    return
-                price = None
-                for attr in ("unit_price_excl", "price_excl", "unit_price", "price"):
-                    if hasattr(ypi, attr):
-                        price = getattr(ypi, attr)
-                        break
-                if price is None:
-                    self.stdout.write(f"  ! YearPlanItem code={code} mist prijs → lijn overgeslagen")
-                    return
-                vat = getattr(ypi, "vat_rate", Decimal("0.21"))
-                desc = ypi.description or fallback_desc
-                lines_to_add.append(dict(description=desc, unit_price_excl=q2(price), quantity=qty, vat_rate=vat))
-
-            if volwassenen:
-                if len(volwassenen) >= 2:
-                    is_flex = any(getattr(v, "membership_mode", "") == "FLEX" for v in volwassenen)
-                    add_by_code("MEMB_FLEX_COUPLE" if is_flex else "MEMB_NORMAL_COUPLE", "Lidgeld koppel")
-                else:
-                    volw = volwassenen[0]
-                    is_flex = getattr(volw, "membership_mode", "") == "FLEX"
-                    add_by_code("MEMB_FLEX_INDIV" if is_flex else "MEMB_NORMAL_INDIV", "Lidgeld individueel")
-
-            for k in kinderen:
-                a = age_on(getattr(k, "date_of_birth", None), ref_date)
-                if a <= 15:
-                    add_by_code("KID_0_15", f"Lidgeld kind t.e.m. 15 jaar: {k.first_name} {k.last_name}")
-                elif a <= 21:
-                    add_by_code("KID_16_21", f"Lidgeld kind t.e.m. 21 jaar: {k.first_name} {k.last_name}")
-                elif a <= 26:
-                    add_by_code("YA_22_26", f"Young Adult 22–26: {k.first_name} {k.last_name}")
-                elif a <= 29:
-                    add_by_code("YA_27_29", f"Young Adult 27–29: {k.first_name} {k.last_name}")
-                elif a <= 35:
-                    add_by_code("YA_30_35", f"Young Adult 30–35: {k.first_name} {k.last_name}")
-
-            for m in leden:
-                if getattr(m, "federation_via_club", False):
-                    a = age_on(getattr(m, "date_of_birth", None), ref_date)
-                    add_by_code("FED_14" if a <= 21 else "FED_67", f"Federatiebijdrage (GV) {m.first_name} {m.last_name}")
-
-            assets = MemberAsset.objects.filter(member__in=leden, active=True)
-            for asset in assets:
-                desc = f"{asset.get_asset_type_display()} — {(asset.identifier or '').strip()}".strip(" —")
-                price_attr = "price_excl" if hasattr(asset, "price_excl") else "unit_price_excl"
-                price_val = getattr(asset, price_attr, Decimal("0.00")) or Decimal("0.00")
-                vat_val = getattr(asset, "vat_rate", Decimal("0.21"))
-                lines_to_add.append(dict(description=desc, quantity=1, unit_price_excl=q2(price_val), vat_rate=vat_val))
-
-            if items.get("ENTRY_TRANCHE"):
-                add_by_code("ENTRY_TRANCHE", "Intredegeld (jaarlijkse schijf)")
-
-            if not lines_to_add:
-                skipped += 1
-                continue
+            entry = make_entry(year, position, owner, lines)
+            keys.append(entry["key"])
+            result = sync_entries([entry], issue_dt, dry_run=not do_commit)
+            action = next(a for a in ACTION_LABELS if result[a])
+            counts.update(result)
+            self.stdout.write(f"{prefix}{ACTION_LABELS[action]} {entry['name']} ({len(lines)} lijnen)")
 
-            if do_commit:
-                with transaction.atomic():
-                    inv.save()
-                    for l in lines_to_add:
-                        InvoiceLine.objects.create(invoice=inv, **l)
-                created += 1
-                naam = (getattr(head, "first_name", "") + " " + getattr(head, "last_name", "")).strip() or str(account)
-                self.stdout.write(f"+ Factuur aangemaakt voor {naam} ({len(lines_to_add)} lijnen)")
-            else:
-                naam = (getattr(head, "first_name", "") + " " + getattr(head, "last_name", "")).strip() or str(account)
-                self.stdout.write(f"[DRY-RUN] zou factuur maken voor {naam} met {len(lines_to_add)} lijnen.")
+        removed = remove_obsolete(year, keys, dry_run=not do_commit)
+        self._finish(year, issue_dt, do_commit, counts, removed, skipped)
 
+    def _finish(self, year, issue_dt, do_commit, counts, removed, skipped):
+        prefix = "" if do_commit else "[DRY-RUN] "
+        self.stdout.write(f"{prefix}Verschil: {summary(counts, removed)}")
+        created = counts["nieuw"] if do_commit else 0
         self.stdout.write(self.style.SUCCESS(f"Klaar: aangemaakt={created}, overgeslagen={skipped}, jaar={year}, datum={issue_dt}"))
+
+    def _handle_bulk(self, year, engine, issue_dt, do_commit, chunk_size, jobs, verbosity):
+        """
+        Zelfde facturen als de gewone modus, met een vast aantal queries per partitie
+        (zie core/invoice_generation.py). Met jobs > 1 rekent elke worker één partitie uit
+        en schrijft ze ook weg over een eigen verbinding; op SQLite schrijft het hoofdproces.
+        """
+        ctx = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=jobs, mp_context=ctx, initializer=_worker_init) if jobs > 1 else None
+        try:
+            if pool is None:
+                entries, skipped, notes = compute_entries(year, engine=engine)
+            else:
+                entries, skipped, notes = [], 0, []
+                for part_entries, part_skipped, part_notes in pool.map(compute_partition, [year] * jobs, [jobs] * jobs, range(jobs)):
+                    entries.extend(part_entries)
+                    skipped += part_skipped
+                    notes.extend(part_notes)
+                entries.sort(key=lambda e: e["position"])
+            self.stdout.write(f"Gevonden factuurhouders: {len(entries) + skipped}")
+            if verbosity >= 2:
+                for note in notes:
+                    self.stdout.write(f"  ! {note}")
+
+            def _progress(done, total):
+                self.stdout.write(f"  {done}/{total} huishoudens verwerkt")
+
+            if not do_commit or pool is None or connection.vendor == "sqlite":
+                counts = sync_entries(entries, issue_dt, chunk_size, dry_run=not do_commit, progress=_progress if do_commit else None)
+                per_job = {}
+            else:
+                parts = [[e for e in entries if partition_of(e["owner_pk"], jobs) == i] for i in range(jobs)]
+                per_job = dict(enumerate(pool.map(sync_partition, parts, [issue_dt] * jobs, [chunk_size] * jobs)))
+                counts = sum(per_job.values(), Counter())
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        removed = remove_obsolete(year, [e["key"] for e in entries], dry_run=not do_commit)
+
+        if verbosity >= 2:
+            prefix = "" if do_commit else "[DRY-RUN] "
+            for e in entries:
+                if e.get("action"):  # niet bij schrijvende workers: die werken op een kopie
+                    self.stdout.write(f"{prefix}{ACTION_LABELS[e['action']]} {e['name']} ({len(e['lines'])} lijnen)")
+        if jobs > 1:
+            computed = Counter(partition_of(e["owner_pk"], jobs) for e in entries)
+            for i in range(jobs):
+                done = per_job.get(i)
+                detail = f", nieuw={done['nieuw']}, herschreven={done['herschreven']}, lijnen={done['lijnen']}" if done else ""
+                self.stdout.write(f"  job {i + 1}/{jobs}: {computed.get(i, 0)} huishoudens berekend{detail}")
+        return counts, removed, skipped
@@ -1,22 +1,27 @@
 
 from django.core.management.base import BaseCommand
 from django.apps import apps
-from django.db import transaction
-from django.db.models import Q
 import csv, re
 from datetime import datetime, date
 
-Member = apps.get_model('core','Member')
+from core import csv_import
+from core.member_match import MATCHED, MemberMatchIndex
+from core.year_totals import mark_year_stale, snapshot_years
+
 MemberAsset = apps.get_model('core','MemberAsset')
 
 def norm(s):
     return (s or "").strip().lower().replace(" ", "_").replace("-", "_").replace(".", "_")
 
-def pick(row, *names):
-    """Case-insensitive pick met normalisatie van kolomnamen."""
-    d = {norm(k): (v or "").strip() for k,v in row.items()}
-    for n in names:
-        v = d.get(norm(n))
+def columns(fieldnames, *names):
+    """Kolommen van het bestand voor `names` (in die volgorde), case-insensitive na normalisatie."""
+    by_norm = {norm(h): h for h in fieldnames or []}
+    return list(dict.fromkeys(by_norm[norm(n)] for n in names if norm(n) in by_norm))
+
+def pick(row, cols):
+    """Eerste niet-lege waarde uit de kolommen `cols` (zie columns)."""
+    for col in cols:
+        v = (row.get(col) or "").strip()
         if v:
             return v
     return ""
@@ -67,26 +72,42 @@ def coerce_asset_type(raw):
     key = norm(s)
     return _ALIASES.get(key)
 
-def has_field(model, name):
-    try:
-        model._meta.get_field(name); return True
-    except Exception:
+class ProblemReport:
+    """
+    Rijen zonder (eenduidig) lid: als CSV naar `path` (bij een hervatte import achteraan
+    bijgeschreven), anders naar stderr. Wordt per blok geschreven en niet bijgehouden.
+    """
+
+    def __init__(self, path, stderr):
+        self.path = path
+        self.stderr = stderr
+        self.rows = 0
+        self._fh = self._writer = None
+
+    def write(self, problems, append=False):
+        self.rows += len(problems)
+        if not self.path:
+            for idx, _status, detail in problems:
+                self.stderr.write(f"Rij {idx}: {detail}.")
+            return
+        if not problems:
+            return
+        if self._fh is None:
+            self._fh = open(self.path, "a" if append else "w", newline="", encoding="utf-8")
+            self._writer = csv.writer(self._fh, delimiter=";")
+            if not append:
+                self._writer.writerow(["rij", "probleem", "detail"])
+        self._writer.writerows(problems)
+        self._fh.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._fh is not None:
+            self._fh.close()
         return False
 
-def split_name_guess(full):
-    full = (full or "").strip()
-    if not full:
-        return []
-    if "," in full:  # "Achternaam, Voornaam"
-        ln, fn = [x.strip() for x in full.split(",", 1)]
-        return [(fn, ln)]
-    parts = full.split()
-    if len(parts) < 2:
-        return []
-    fn1, ln1 = " ".join(parts[:-1]), parts[-1]
-    ln2, fn2 = parts[0], " ".join(parts[1:])
-    return [(fn1, ln1), (fn2, ln2)]
-
 class Command(BaseCommand):
     help = "Importeer MemberAsset uit CSV."
 
@@ -94,26 +115,10 @@ class Command(BaseCommand):
         parser.add_argument("csv_path")
         parser.add_argument("--update", action="store_true", help="Bestaande assets bijwerken")
         parser.add_argument("--dry-run", action="store_true")
+        parser.add_argument("--report", help="Rijen zonder (eenduidig) lid als CSV naar dit bestand")
+        csv_import.add_arguments(parser)
 
-    @transaction.atomic
     def handle(self, csv_path, update=False, dry_run=False, **opts):
-        # CSV lezen
-        with open(csv_path, "r", encoding="utf-8-sig", newline="") as fh:
-            sample = fh.read(4096); fh.seek(0)
-            try:
-                dialect = csv.Sniffer().sniff(sample, delimiters=";,")
-                delim = dialect.delimiter
-            except Exception:
-                delim = ","
-            reader = csv.DictReader(fh, delimiter=delim)
-            rows = list(reader)
-        self.stdout.write(f"CSV delimiter: {repr(delim)}")
-
-        created = updated_n = skipped = missing_member = ambiguous_member = bad_type = 0
-
-        have_ext   = has_field(Member, "external_id")
-        have_email = has_field(Member, "email")
-
         ext_keys = (
             "member_external_id","external_id",
             "Fichenummer_Totaal","fichenummer_totaal","FICHENUMMER_TOTAAL",
@@ -121,120 +126,96 @@ class Command(BaseCommand):
             "FicheNummer Totaal","Fiche Nummer Totaal",
         )
 
-        for idx, row in enumerate(rows, start=2):
-            # type
-            at_raw = pick(row, "asset_type", "type", "asset")
-            at = coerce_asset_type(at_raw)
-            if not at:
-                bad_type += 1
-                self.stderr.write(f"Rij {idx}: onbekend asset_type {repr(at_raw)}, overslaan.")
-                continue
-
-            # member keys
-            eid   = pick(row, *ext_keys)
-            email = pick(row, "email", "e-mail")
-            fn    = pick(row, "first_name", "voornaam", "given_name")
-            ln    = pick(row, "last_name",  "achternaam", "familienaam")
-            name_single = pick(row, "name","naam","full_name","volledige_naam")
-            st    = pick(row, "street", "straat")
-            pc    = pick(row, "postal_code", "postcode", "postalcode")
-
-            qs = Member.objects.all()
-            matched = None
-
-            if have_ext and eid:
-                qs = qs.filter(external_id=eid)
-                c = qs.count()
-                if c == 1:
-                    matched = qs.first()
-                elif c > 1:
-                    ambiguous_member += 1
-                    self.stderr.write(f"Rij {idx}: meerdere members voor external_id={eid}.")
-                    continue
-
-            if matched is None and have_email and email:
-                qs = Member.objects.filter(email__iexact=email)
-                c = qs.count()
-                if c == 1:
-                    matched = qs.first()
-                elif c > 1:
-                    ambiguous_member += 1
-                    self.stderr.write(f"Rij {idx}: meerdere members voor email={email}.")
-                    continue
-
-            if matched is None:
-                attempts = []
-                if fn and ln:
-                    attempts = [(fn, ln)]
-                elif name_single:
-                    attempts = split_name_guess(name_single)
-
-                tried = False
-                for a_fn, a_ln in attempts:
-                    flt = Q(first_name__iexact=a_fn) & Q(last_name__iexact=a_ln)
-                    if st and has_field(Member,"street"): flt &= Q(street__iexact=st)
-                    if pc and has_field(Member,"postal_code"): flt &= Q(postal_code__iexact=pc)
-                    qs2 = Member.objects.filter(flt)
-                    tried = True
-                    if qs2.count() == 1:
-                        matched = qs2.first()
-                        break
-                    elif qs2.count() > 1:
-                        ambiguous_member += 1
-                        self.stderr.write(f"Rij {idx}: meerdere members voor naam={a_fn} {a_ln}.")
-                        matched = None
-                        break
-
-                if matched is None and not tried:
-                    self.stderr.write(f"Rij {idx}: geen member match (external_id={eid}, email={email}, name={name_single}).")
-                    missing_member += 1
-                    continue
-
-            if matched is None:
-                missing_member += 1
-                continue
-
-            member = matched
-
-            # identifier
-            ident = pick(row, "identifier","number","no","nr","locker_number","kast","kastnr","kast_nr","nummer")
-
-            active = parse_bool(pick(row, "active"))
-            rel    = parse_date(pick(row, "released_on", "vrijgegeven_op", "released"))
-
-            qsa = MemberAsset.objects.filter(member=member, asset_type=at)
-            if ident:
-                qsa = qsa.filter(identifier=ident)
-
-            if qsa.exists():
-                asset = qsa.first()
-                changed = False
-                if asset.active != active:
-                    asset.active = active; changed = True
-                if rel is not None and asset.released_on != rel:
-                    asset.released_on = rel; changed = True
-                if changed:
-                    if dry_run:
-                        updated_n += 1
-                    else:
-                        asset.save(update_fields=["active","released_on"])
-                        updated_n += 1
-                else:
-                    skipped += 1
-            else:
-                if dry_run:
-                    created += 1
-                else:
-                    MemberAsset.objects.create(
-                        member=member,
-                        asset_type=at,
-                        identifier=ident or None,
-                        active=active,
-                        released_on=rel
+        job = csv_import.StreamingImport(
+            "import_member_assets_csv", csv_path, chunk_size=opts["chunk_size"], restart=opts["restart"],
+            dry_run=dry_run, log=self.stdout.write,
+        )
+        report = ProblemReport(opts.get("report"), self.stderr)
+        with job:
+            self.stdout.write(f"CSV delimiter: {repr(job.delimiter)}")
+
+            # kolommen één keer per bestand opzoeken, leden één keer inlezen
+            col = {
+                key: columns(job.fieldnames, *names) for key, names in {
+                    "asset_type": ("asset_type", "type", "asset"),
+                    "external_id": ext_keys,
+                    "email": ("email", "e-mail"),
+                    "first_name": ("first_name", "voornaam", "given_name"),
+                    "last_name": ("last_name", "achternaam", "familienaam"),
+                    "name": ("name","naam","full_name","volledige_naam"),
+                    "street": ("street", "straat"),
+                    "postal_code": ("postal_code", "postcode", "postalcode"),
+                    "identifier": ("identifier","number","no","nr","locker_number","kast","kastnr","kast_nr","nummer"),
+                    "active": ("active",),
+                    "released_on": ("released_on", "vrijgegeven_op", "released"),
+                }.items()
+            }
+            index = MemberMatchIndex()
+            self.stdout.write(f"Ledenindex: {len(index)} leden")
+
+            def process(chunk, counts, state):
+                problems = []
+                matched = []
+                for idx, row in chunk:
+                    at_raw = pick(row, col["asset_type"])
+                    at = coerce_asset_type(at_raw)
+                    if not at:
+                        counts["bad_type"] += 1
+                        self.stderr.write(f"Rij {idx}: onbekend asset_type {repr(at_raw)}, overslaan.")
+                        continue
+
+                    status, member_pk, detail = index.match(
+                        **{key: pick(row, col[key]) for key in ("external_id", "email", "first_name", "last_name", "name", "street", "postal_code")}
                     )
-                    created += 1
-
+                    if status != MATCHED:
+                        counts[f"{status}_member"] += 1
+                        problems.append([idx, status, detail])
+                        continue
+                    matched.append((member_pk, at, pick(row, col["identifier"]), parse_bool(pick(row, col["active"])),
+                                    parse_date(pick(row, col["released_on"]))))
+
+                # bestaande assets van de gevonden leden in één query; nieuwe komen erbij zodat
+                # een latere rij voor hetzelfde asset ze terugvindt
+                assets = {}
+                for asset in MemberAsset.objects.filter(member_id__in={m[0] for m in matched}).order_by("pk"):
+                    assets.setdefault((asset.member_id, asset.asset_type), []).append(asset)
+                new, changed = [], {}
+                for member_pk, at, ident, active, rel in matched:
+                    found = [a for a in assets.get((member_pk, at), []) if not ident or a.identifier == ident]
+                    if not found:
+                        asset = MemberAsset(member_id=member_pk, asset_type=at, identifier=ident, active=active, released_on=rel)
+                        assets.setdefault((member_pk, at), []).append(asset)
+                        new.append(asset)
+                        counts["created"] += 1
+                        continue
+                    asset = found[0]
+                    if asset.active == active and (rel is None or asset.released_on == rel):
+                        counts["skipped"] += 1
+                        continue
+                    asset.active = active
+                    if rel is not None:
+                        asset.released_on = rel
+                    if asset.pk:
+                        changed[asset.pk] = asset
+                    counts["updated"] += 1
+
+                if not dry_run:
+                    MemberAsset.objects.bulk_create(new, batch_size=500)
+                    MemberAsset.objects.bulk_update(list(changed.values()), ["active", "released_on"], batch_size=500)
+                    # bulk_create/bulk_update slaan de signalen over: in dezelfde transactie als het
+                    # blok de opgeslagen jaartotalen opnieuw laten berekenen
+                    if new or changed:
+                        for year in snapshot_years():
+                            mark_year_stale(year)
+                # rapport per blok wegschrijven: enkel de tellers gaan in het checkpoint
+                report.write(problems, append=bool(job.resumed_from))
+
+            with report:
+                counts = job.run(process)
+
+        if report.path and report.rows:
+            self.stdout.write(f"Rapport: {report.rows} rijen zonder (eenduidig) lid → {report.path}")
         self.stdout.write(
-            f"Assets import: created={created}, updated={updated_n}, skipped={skipped}, "
-            f"missing_member={missing_member}, ambiguous_member={ambiguous_member}, bad_type={bad_type}"
+            f"Assets import: created={counts['created']}, updated={counts['updated']}, skipped={counts['skipped']}, "
+            f"missing_member={counts['missing_member']}, ambiguous_member={counts['ambiguous_member']}, bad_type={counts['bad_type']}"
         )
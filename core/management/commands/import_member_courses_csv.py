@@ -1,9 +1,8 @@
 
 from django.core.management.base import BaseCommand
 from django.apps import apps
-from django.db import transaction
-import csv, re
-from datetime import datetime, date
+import re
+from core import csv_import
 
 Member = apps.get_model('core','Member')
 
@@ -31,61 +30,63 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument("csv_path")
         parser.add_argument("--dry-run", action="store_true")
+        csv_import.add_arguments(parser)
 
-    @transaction.atomic
     def handle(self, csv_path, dry_run=False, **opts):
-        # CSV lezen met delimiter-detectie
-        with open(csv_path, "r", encoding="utf-8-sig", newline="") as fh:
-            sample = fh.read(4096); fh.seek(0)
-            try:
-                dialect = csv.Sniffer().sniff(sample, delimiters=";,")
-                delim = dialect.delimiter
-            except Exception:
-                delim = ","
-            reader = csv.DictReader(fh, delimiter=delim)
-            rows = list(reader)
-        self.stdout.write(f"CSV delimiter: {repr(delim)}")
+        def process(chunk, counts, state):
+            # leden van dit blok in één query (external_id -> leden)
+            eids = {pick(row, "external_id", "member_external_id") for _idx, row in chunk}
+            by_eid = {}
+            for m in Member.objects.filter(external_id__in=eids - {""}).only("pk", "external_id", "course", "billing_account", "factureren_via", "household_head"):
+                by_eid.setdefault(m.external_id, []).append(m)
 
-        updated = skipped = missing = badval = 0
+            for idx, row in chunk:
+                eid = pick(row, "external_id", "member_external_id")
+                if not eid:
+                    counts["missing"] += 1
+                    self.stderr.write(f"Rij {idx}: geen external_id.")
+                    continue
 
-        for idx, row in enumerate(rows, start=2):
-            eid = pick(row, "external_id", "member_external_id")
-            if not eid:
-                missing += 1
-                self.stderr.write(f"Rij {idx}: geen external_id.")
-                continue
+                found = by_eid.get(eid, [])
+                if not found:
+                    counts["missing"] += 1
+                    self.stderr.write(f"Rij {idx}: geen member voor external_id={eid}.")
+                    continue
+                if len(found) > 1:
+                    counts["missing"] += 1
+                    self.stderr.write(f"Rij {idx}: meerdere members voor external_id={eid}.")
+                    continue
+                m = found[0]
 
-            try:
-                m = Member.objects.get(external_id=eid)
-            except Member.DoesNotExist:
-                missing += 1
-                self.stderr.write(f"Rij {idx}: geen member voor external_id={eid}.")
-                continue
-            except Member.MultipleObjectsReturned:
-                missing += 1
-                self.stderr.write(f"Rij {idx}: meerdere members voor external_id={eid}.")
-                continue
+                new_course = normalize_course(pick(row, "course"))
+                if new_course is None:
+                    counts["badval"] += 1
+                    self.stderr.write(f"Rij {idx}: onbekende/lege course-waarde {row.get('course')!r}, overslaan.")
+                    continue
 
-            new_course = normalize_course(pick(row, "course"))
-            if new_course is None:
-                badval += 1
-                self.stderr.write(f"Rij {idx}: onbekende/lege course-waarde {row.get('course')!r}, overslaan.")
-                continue
-
-            cur = (m.course or "")
-            if new_course != cur:
-                if dry_run:
-                    updated += 1
+                cur = (m.course or "")
+                if new_course != cur:
+                    if dry_run:
+                        counts["updated"] += 1
+                    else:
+                        m.course = new_course
+                        # leeg veld consistent als None i.p.v. lege string?
+                        if m.course == "":
+                            m.course = None
+                        m.save(update_fields=["course"])
+                        counts["updated"] += 1
                 else:
-                    m.course = new_course
-                    # leeg veld consistent als None i.p.v. lege string?
-                    if m.course == "":
-                        m.course = None
-                    m.save(update_fields=["course"])
-                    updated += 1
-            else:
-                skipped += 1
+                    counts["skipped"] += 1
+
+        job = csv_import.StreamingImport(
+            "import_member_courses_csv", csv_path, chunk_size=opts["chunk_size"], restart=opts["restart"],
+            dry_run=dry_run, log=self.stdout.write,
+        )
+        with job:
+            self.stdout.write(f"CSV delimiter: {repr(job.delimiter)}")
+            counts = job.run(process)
 
         self.stdout.write(
-            f"Courses import: updated={updated}, skipped={skipped}, missing_member={missing}, bad_value={badval}"
+            f"Courses import: updated={counts['updated']}, skipped={counts['skipped']}, "
+            f"missing_member={counts['missing']}, bad_value={counts['badval']}"
         )
@@ -1,8 +1,7 @@
-import csv
 from typing import Optional, List
 from django.core.management.base import BaseCommand, CommandError
 from django.apps import apps
-from django.db import transaction
+from core import csv_import
 
 EXTERNAL_ID_FIELDS_CANDIDATES = [
     "external_id","externalid","external_member_id","legacy_id","old_id","ext_id","member_external_id",
@@ -11,12 +10,17 @@ EXTERNAL_ID_FIELDS_CANDIDATES = [
 PHONE_HEADER_CANDIDATES  = ["telefoon privaat","telefoon_prive","telefoon prive","phone","telephone","tel","vast","telefoon"]
 MOBILE_HEADER_CANDIDATES = ["telefoon auto","gsm","mobile","mobile phone","cellphone","mobile_number","mobile telefoon","mobiel"]
 
+# Member-velden voor de twee kolommen
+PHONE_FIELD = "phone_private"
+MOBILE_FIELD = "phone_mobile"
+
 class Command(BaseCommand):
     help = "Importeer phone/mobile van CSV via external id. Voorbeeld: manage.py import_member_phones_csv /app/import/leden.csv [--dry-run]"
 
     def add_arguments(self, parser):
         parser.add_argument("csv_path", type=str, help="Pad naar CSV (bv. /app/import/leden.csv)")
         parser.add_argument("--dry-run", action="store_true", help="Toon wat er zou gebeuren, zonder te schrijven.")
+        csv_import.add_arguments(parser)
 
     def handle(self, *args, **opts):
         csv_path = opts["csv_path"]
@@ -31,11 +35,13 @@ class Command(BaseCommand):
 
         self.stdout.write(self.style.NOTICE(f"Zoek Member via external-id veld: {ext_field}"))
 
-        # CSV lezen
-        with open(csv_path, newline="", encoding="utf-8-sig") as f:
-            reader = csv.DictReader(f)
+        job = csv_import.StreamingImport(
+            "import_member_phones_csv", csv_path, chunk_size=opts["chunk_size"], restart=opts["restart"],
+            dry_run=dry, delimiter=",", log=self.stdout.write,
+        )
+        with job:
             # normaliseer headers
-            headers = [h.strip() for h in reader.fieldnames or []]
+            headers = [h.strip() for h in job.fieldnames]
             lowmap = {h.lower(): h for h in headers}
 
             def pick_header(cands: List[str]) -> Optional[str]:
@@ -69,51 +75,50 @@ class Command(BaseCommand):
             self.stdout.write(self.style.NOTICE(f"CSV mapping: external-id='{ext_header}', "
                                                 f"phone='{phone_header}', mobile='{mobile_header}'"))
 
-            updated = 0
-            missing = 0
-            notfound = 0
-            total = 0
-
-            @transaction.atomic
-            def do_row(row):
-                nonlocal updated, missing, notfound, total
-                total += 1
-                ext_val = (row.get(ext_header) or "").strip()
-                if not ext_val:
-                    missing += 1
-                    return
-
-                try:
-                    m = Member.objects.get(**{ext_field: ext_val})
-                except Member.DoesNotExist:
-                    notfound += 1
-                    return
-                except Member.MultipleObjectsReturned:
-                    self.stderr.write(self.style.WARNING(f"Meerdere Members met {ext_field}={ext_val} – skip."))
-                    return
-
-                phone_val  = (row.get(phone_header) or "").strip() if phone_header else ""
-                mobile_val = (row.get(mobile_header) or "").strip() if mobile_header else ""
-
-                changed = False
-                if phone_val and (getattr(m, "phone", None) or "") != phone_val:
-                    m.phone = phone_val
-                    changed = True
-                if mobile_val and (getattr(m, "mobile", None) or "") != mobile_val:
-                    m.mobile = mobile_val
-                    changed = True
-
-                if changed and not dry:
-                    m.save(update_fields=[f for f,v in [("phone",phone_val),("mobile",mobile_val)] if v])
-                    updated += 1
-                elif changed and dry:
-                    updated += 1  # tellen als “zou bijwerken”
-
-            # Loop over alle rijen
-            for row in reader:
-                do_row(row)
-
-            mode = "(DRY-RUN)" if dry else ""
-            self.stdout.write(self.style.SUCCESS(
-                f"Import klaar {mode}: totaal={total}, zonder ext-id={missing}, member niet gevonden={notfound}, bijgewerkt={updated}"
-            ))
+            def process(chunk, counts, state):
+                # leden van dit blok in één query
+                ext_vals = {(row.get(ext_header) or "").strip() for _idx, row in chunk}
+                by_ext = {}
+                for m in Member.objects.filter(**{f"{ext_field}__in": ext_vals - {""}}):
+                    by_ext.setdefault(getattr(m, ext_field), []).append(m)
+
+                for _idx, row in chunk:
+                    counts["total"] += 1
+                    ext_val = (row.get(ext_header) or "").strip()
+                    if not ext_val:
+                        counts["missing"] += 1
+                        continue
+
+                    found = by_ext.get(ext_val, [])
+                    if not found:
+                        counts["notfound"] += 1
+                        continue
+                    if len(found) > 1:
+                        self.stderr.write(self.style.WARNING(f"Meerdere Members met {ext_field}={ext_val} – skip."))
+                        continue
+                    m = found[0]
+
+                    phone_val  = (row.get(phone_header) or "").strip() if phone_header else ""
+                    mobile_val = (row.get(mobile_header) or "").strip() if mobile_header else ""
+
+                    fields = []
+                    if phone_val and (getattr(m, PHONE_FIELD, None) or "") != phone_val:
+                        setattr(m, PHONE_FIELD, phone_val)
+                        fields.append(PHONE_FIELD)
+                    if mobile_val and (getattr(m, MOBILE_FIELD, None) or "") != mobile_val:
+                        setattr(m, MOBILE_FIELD, mobile_val)
+                        fields.append(MOBILE_FIELD)
+
+                    if fields and not dry:
+                        m.save(update_fields=fields)
+                        counts["updated"] += 1
+                    elif fields and dry:
+                        counts["updated"] += 1  # tellen als “zou bijwerken”
+
+            counts = job.run(process)
+
+        mode = "(DRY-RUN)" if dry else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"Import klaar {mode}: totaal={counts['total']}, zonder ext-id={counts['missing']}, "
+            f"member niet gevonden={counts['notfound']}, bijgewerkt={counts['updated']}"
+        ))
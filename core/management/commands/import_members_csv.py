@@ -1,11 +1,19 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.db import transaction
 from django.apps import apps
-import csv, re
+import re, time
+from collections import Counter
 from datetime import datetime, date
+from core import csv_import
+from core.year_totals import mark_year_stale, snapshot_years
 
 Member = apps.get_model('core','Member')
 
+BATCH_SIZE = 500
+BASE_FIELDS = ['first_name', 'last_name', 'street', 'postal_code', 'city', 'country']
+# velden die enkel gezet worden als het ledenmodel ze heeft
+OPTIONAL_FIELDS = ['external_id', 'birth_date', 'email', 'phone_mobile', 'phone_private', 'phone_work',
+                   'course', 'active', 'household_role', 'household_head']
+
 def has_field(model,name):
     try:
         model._meta.get_field(name); return True
@@ -44,111 +52,183 @@ class Command(BaseCommand):
         parser.add_argument('csv_path')
         parser.add_argument('--update', action='store_true', help='Update bestaande leden (matching external_id)')
         parser.add_argument('--dry-run', action='store_true')
+        csv_import.add_arguments(parser)
 
-    @transaction.atomic
     def handle(self, csv_path, update=False, dry_run=False, **opts):
-        # --- delimiter auto-detect (comma of semicolon) ---
-        with open(csv_path, newline='', encoding='utf-8-sig') as fh:
-            sample = fh.read(4096)
-            fh.seek(0)
-            try:
-                dialect = csv.Sniffer().sniff(sample, delimiters=';,')
-                delim = dialect.delimiter
-            except Exception:
-                delim = ','
-            reader = csv.DictReader(fh, delimiter=delim)
-
+        started = time.perf_counter()
+        timings = Counter()
+
+        # veldcontroles één keer, niet per rij
+        fields = {name for name in OPTIONAL_FIELDS if has_field(Member, name)}
+        # external_id is de sleutel, household_head komt in de tweede fase
+        update_fields = BASE_FIELDS + [name for name in OPTIONAL_FIELDS if name in fields and name not in ('external_id', 'household_head')]
+
+        def process(chunk, counts, state):
+            phase_start = time.perf_counter()
+            # bestaande leden van dit blok: external_id -> huidige waarden (één query)
+            current = {}
+            if 'external_id' in fields:
+                eids = {(row.get('external_id') or '').strip() for _idx, row in chunk}
+                for values in (Member.objects.filter(external_id__in=eids).order_by()
+                               .values('pk', 'household_head_id', 'external_id', *update_fields)):
+                    current[values['external_id']] = values
+
+            objs = []
+            head_map = {}
+            members = {}  # sleutel -> (lid, waarden zoals in de database of None)
+
+            for idx, row in chunk:
+                eid = (row.get('external_id') or '').strip()
+                hh, seq = split_external(eid)
+                if not hh or not seq:
+                    self.stderr.write(f'Rij {idx}: ongeldige external_id "{eid}", overslaan.')
+                    counts['fouten'] += 1
+                    continue
+
+                # dubbele external_id in de CSV: zelfde lid, de laatste rij wint (zoals vroeger met get + save)
+                key = eid if 'external_id' in fields else idx
+                if key not in members:
+                    values = current.get(eid) if 'external_id' in fields else None
+                    members[key] = (Member(**values) if values else Member(), values)
+                m = members[key][0]
+
+                # Basisgegevens
+                if 'external_id' in fields:
+                    m.external_id = eid
+                m.first_name = (row.get('first_name') or '').strip()
+                m.last_name  = (row.get('last_name')  or '').strip()
+                m.street     = (row.get('street')     or '').strip()
+                m.postal_code= (row.get('postal_code')or '').strip()
+                m.city       = (row.get('city')       or '').strip()
+                m.country    = (row.get('country')    or '').strip() or 'BE'
+                try:
+                    bd = parse_date(row.get('birth_date'))
+                except Exception as e:
+                    bd = None
+                    self.stderr.write(f'Rij {idx}: birth_date fout "{row.get("birth_date")}": {e}')
+                if bd is not None and 'birth_date' in fields:
+                    m.birth_date = bd
+
+                if 'email' in fields:
+                    m.email = (row.get('email') or '').strip()
+                if 'phone_mobile' in fields:
+                    m.phone_mobile = (row.get('phone_mobile') or '').strip()
+                if 'phone_private' in fields:
+                    m.phone_private = (row.get('phone_private') or '').strip()
+                if 'phone_work' in fields:
+                    m.phone_work = (row.get('phone_work') or '').strip()
+
+                course = (row.get('course') or '').strip().upper()
+                if course in ('CC','P3') and 'course' in fields:
+                    m.course = course
+
+                if 'active' in fields:
+                    m.active = parse_bool(row.get('active'))
+
+                couple = ((row.get('couple_status') or '').strip().lower() == 'koppel')
+                role = 'head' if seq == 1 else ('partner' if (seq == 2 and couple) else 'member')
+                if 'household_role' in fields:
+                    m.household_role = role
+
+                if dry_run:
+                    counts['overgeslagen'] += 1
+                    continue
+
+                objs.append((hh, seq, m))
+                if seq == 1:
+                    head_map[hh] = m
+
+            new, changed = [], []
+            for m, values in members.values():
+                if values is None:
+                    new.append(m)
+                elif any(getattr(m, f) != values[f] for f in update_fields):
+                    changed.append(m)
+            counts['aangemaakt'] += len(new)
+            counts['bijgewerkt'] += len(changed)
+            counts['ongewijzigd'] += len(members) - len(new) - len(changed)
+            timings['vergelijken'] += time.perf_counter() - phase_start
+            if dry_run:
+                return
+
+            phase_start = time.perf_counter()
+            Member.objects.bulk_create(new, batch_size=BATCH_SIZE)
+            Member.objects.bulk_update(changed, update_fields, batch_size=BATCH_SIZE)
+            counts['huishoudens'] += len(head_map)
+            timings['wegschrijven'] += time.perf_counter() - phase_start
+
+            # Tweede fase: household_head koppelen (één bulk update per blok)
+            linked = counts['koppelingen']
+            if 'household_head' in fields:
+                phase_start = time.perf_counter()
+                self._link_households(objs, head_map, counts, state)
+                timings['gezinnen'] += time.perf_counter() - phase_start
+
+            # bulk_create/bulk_update slaan de signalen over: in dezelfde transactie als het blok
+            # de opgeslagen jaartotalen opnieuw laten berekenen (ook als de import later stopt)
+            if new or changed or counts['koppelingen'] != linked:
+                for year in snapshot_years():
+                    mark_year_stale(year)
+
+        job = csv_import.StreamingImport(
+            'import_members_csv', csv_path, chunk_size=opts['chunk_size'], restart=opts['restart'],
+            dry_run=dry_run, log=self.stdout.write,
+        )
+        with job:
             required = ['external_id','couple_status','first_name','last_name',
                         'street','postal_code','city','country','birth_date',
                         'course','active','email','phone_mobile','phone_private','phone_work']
-            missing = [c for c in required if c not in (reader.fieldnames or [])]
+            missing = [c for c in required if c not in job.fieldnames]
             if missing:
                 raise CommandError(f'CSV mist kolommen: {missing}')
-            rows = list(reader)
-        self.stdout.write(f'CSV delimiter gedetecteerd: {repr(delim)}')
-
-        created = updated = skipped = errors = 0
-        objs = []
-        head_map = {}
-
-        for idx, row in enumerate(rows, start=2):
-            eid = (row.get('external_id') or '').strip()
-            hh, seq = split_external(eid)
-            if not hh or not seq:
-                self.stderr.write(f'Rij {idx}: ongeldige external_id "{eid}", overslaan.')
-                errors += 1
-                continue
-
-            exists = False
-            if has_field(Member, 'external_id'):
-                try:
-                    m = Member.objects.get(external_id=eid)
-                    exists = True
-                except Member.DoesNotExist:
-                    m = Member()
-            else:
-                m = Member()
-
-            # Basisgegevens
-            if has_field(Member, 'external_id'):
-                m.external_id = eid
-            m.first_name = (row.get('first_name') or '').strip()
-            m.last_name  = (row.get('last_name')  or '').strip()
-            m.street     = (row.get('street')     or '').strip()
-            m.postal_code= (row.get('postal_code')or '').strip()
-            m.city       = (row.get('city')       or '').strip()
-            m.country    = (row.get('country')    or '').strip() or 'BE'
-            try:
-                bd = parse_date(row.get('birth_date'))
-            except Exception as e:
-                bd = None
-                self.stderr.write(f'Rij {idx}: birth_date fout "{row.get("birth_date")}": {e}')
-            if bd is not None and has_field(Member,'birth_date'):
-                m.birth_date = bd
-
-            if has_field(Member,'email'):
-                m.email = (row.get('email') or '').strip()
-            if has_field(Member,'phone_mobile'):
-                m.phone_mobile = (row.get('phone_mobile') or '').strip()
-            if has_field(Member,'phone_private'):
-                m.phone_private = (row.get('phone_private') or '').strip()
-            if has_field(Member,'phone_work'):
-                m.phone_work = (row.get('phone_work') or '').strip()
-
-            course = (row.get('course') or '').strip().upper()
-            if course in ('CC','P3') and has_field(Member,'course'):
-                m.course = course
-
-            if has_field(Member,'active'):
-                m.active = parse_bool(row.get('active'))
-
-            couple = ((row.get('couple_status') or '').strip().lower() == 'koppel')
-            role = 'head' if seq == 1 else ('partner' if (seq == 2 and couple) else 'member')
-            if has_field(Member,'household_role'):
-                m.household_role = role
-
-            if dry_run:
-                skipped += 1
-                continue
-
-            m.save()
-            objs.append((hh, seq, m))
-            if seq == 1:
-                head_map[hh] = m
-            if exists:
-                updated += 1
-            else:
-                created += 1
-
-        # Tweede fase: household_head koppelen
-        if has_field(Member,'household_head'):
-            for hh, seq, m in objs:
-                if seq != 1:
-                    head = head_map.get(hh)
-                    if head and getattr(m, 'household_head_id', None) != head.id:
-                        m.household_head = head
-                        m.save(update_fields=['household_head'])
-
+            self.stdout.write(f'CSV delimiter gedetecteerd: {repr(job.delimiter)}')
+            counts = job.run(process)
+
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(
+                f"Dry-run: niets weggeschreven. Zou aanmaken: {counts['aangemaakt']}, Zou bijwerken: {counts['bijgewerkt']}, "
+                f"Ongewijzigd: {counts['ongewijzigd']}, Dry-run overslagen: {counts['overgeslagen']}, Fouten: {counts['fouten']}"
+            ))
+            return
+
+        timings['lezen'] = time.perf_counter() - started - sum(timings.values())
+        self.stdout.write('Fasen: ' + ', '.join(
+            f'{name} {timings[name]:.3f}s' for name in ('lezen', 'vergelijken', 'wegschrijven', 'gezinnen')
+        ))
         self.stdout.write(self.style.SUCCESS(
-            f'Import klaar. Aangemaakt: {created}, Bijgewerkt: {updated}, Dry-run overslagen: {skipped}, Fouten: {errors}, Huishoudens: {len(head_map)}'
+            f"Import klaar. Aangemaakt: {counts['aangemaakt']}, Bijgewerkt: {counts['bijgewerkt']}, Ongewijzigd: {counts['ongewijzigd']}, "
+            f"Dry-run overslagen: {counts['overgeslagen']}, Fouten: {counts['fouten']}, Huishoudens: {counts['huishoudens']}, "
+            f"Gezinskoppelingen: {counts['koppelingen']}"
         ))
+
+    def _link_households(self, objs, head_map, counts, state):
+        """
+        Koppel de gezinsleden van dit blok aan hun gezinshoofd (HHHH/1): uit dit blok of al in
+        de database. Leden waarvan het hoofd nog niet bestaat, wachten in state['pending']
+        (blijft in het checkpoint bewaard) tot het hoofd in een later blok langskomt.
+        """
+        pending = state.setdefault('pending', {})
+        heads = {hh: m.pk for hh, m in head_map.items()}
+        wanted = {hh for hh, seq, m in objs if seq != 1 and hh not in heads}
+        if wanted:
+            for pk, eid in Member.objects.filter(external_id__in=[f'{hh}/1' for hh in wanted]).values_list('pk', 'external_id'):
+                heads[split_external(eid)[0]] = pk
+
+        linked = {}
+        for hh, seq, m in objs:
+            if seq == 1:
+                continue
+            head_pk = heads.get(hh)
+            if head_pk is None:
+                if m.pk not in pending.setdefault(hh, []):
+                    pending[hh].append(m.pk)
+            elif m.household_head_id != head_pk:
+                m.household_head_id = head_pk
+                linked[m.pk] = m
+        for hh in [hh for hh in pending if hh in head_map]:
+            for pk in pending.pop(hh):
+                linked.setdefault(pk, Member(pk=pk, household_head_id=heads[hh]))
+        for hh in [hh for hh, pks in pending.items() if not pks]:
+            del pending[hh]
+        Member.objects.bulk_update(list(linked.values()), ['household_head'], batch_size=BATCH_SIZE)
+        counts['koppelingen'] += len(linked)
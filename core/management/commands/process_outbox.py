@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.outbox import process_batch
+
+
+class Command(BaseCommand):
+    help = "Verstuur de e-mails uit de Outbox-wachtrij (per batch over één SMTP-verbinding, met retries)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50)
+        parser.add_argument("--loop", action="store_true", help="Blijf draaien en poll de wachtrij")
+        parser.add_argument("--interval", type=float, default=10.0, help="Seconden tussen polls (met --loop)")
+
+    def handle(self, *args, **opts):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = process_batch(opts["batch_size"])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write(f"batch: {sent} verzonden, {failed} mislukt/uitgesteld")
+            if sent + failed >= opts["batch_size"]:
+                continue  # er staat waarschijnlijk nog meer klaar
+            if not opts["loop"]:
+                break
+            time.sleep(opts["interval"])
+        self.stdout.write(self.style.SUCCESS(f"Klaar: {total_sent} verzonden, {total_failed} mislukt/uitgesteld"))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.year_totals import rebuild_households, snapshot_years
+
+
+class Command(BaseCommand):
+    help = "Herbereken de opgeslagen jaartotalen (totaalpagina) volledig."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, action="append", help="Jaar (herhaalbaar; default: alle opgeslagen jaren of volgend jaar)")
+
+    def handle(self, *args, **opts):
+        years = opts.get("year") or snapshot_years() or [timezone.now().year + 1]
+        for year in sorted(set(years)):
+            n = rebuild_households(year)
+            self.stdout.write(self.style.SUCCESS(f"Jaar {year}: {n} huishoudens herberekend."))
@@ -0,0 +1,104 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.billing_engine import compile_year
+from core.invoice_pdf import (
+    PAPIER_TEMPLATES, RenderLocked, _worker_init, bundle_merged_pdf, bundle_zip, default_output_dir,
+    pdf_available, pdf_filename, render_lock, render_owner_pdf, write_progress,
+)
+
+
+class Command(BaseCommand):
+    help = "Render alle jaarfacturen als PDF (één per huishouden, parallel) en bundel ze als ZIP of één PDF."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, default=timezone.now().year + 1)
+        parser.add_argument("--papier", choices=sorted(PAPIER_TEMPLATES), default="digitaal")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Aantal processen (1 = zonder pool)")
+        parser.add_argument("--output-dir", help="Map voor de PDF's (default: exports/jaarfacturen-<jaar>-<papier>)")
+        parser.add_argument("--format", choices=("zip", "pdf"), default="zip", help="zip = ZIP met losse PDF's, pdf = één samengevoegde PDF")
+        parser.add_argument("--restart", action="store_true", help="Bestaande PDF's negeren en alles opnieuw renderen")
+
+    def handle(self, *args, **opts):
+        if not pdf_available():
+            raise CommandError("WeasyPrint is niet beschikbaar (pip install weasyprint; vereist pango).")
+        year = opts["year"]
+        papier = opts["papier"]
+        workers = max(1, opts["workers"])
+        out_dir = Path(opts.get("output_dir") or default_output_dir(year, papier))
+        out_dir.mkdir(parents=True, exist_ok=True)
+
+        # nooit twee runs in dezelfde map (zelfde PDF's en progress.json)
+        try:
+            with render_lock(out_dir):
+                self._render(year, papier, workers, out_dir, opts)
+        except RenderLocked as exc:
+            raise CommandError(str(exc))
+
+    def _render(self, year, papier, workers, out_dir, opts):
+        engine = compile_year(year)
+        jobs = []
+        for owner in engine.owners():
+            preview = engine.evaluate(owner)
+            if any(section["lines"] for section in preview["sections"]):
+                jobs.append((owner.pk, out_dir / pdf_filename(owner, year)))
+
+        if opts["restart"]:
+            for _pk, path in jobs:
+                path.unlink(missing_ok=True)
+        todo = [(pk, path) for pk, path in jobs if not path.exists()]
+        total = len(jobs)
+        done = total - len(todo)
+        self.stdout.write(f"Jaar {year} ({papier}): {total} facturen, {done} al klaar, {len(todo)} te renderen met {workers} worker(s).")
+        write_progress(out_dir, year=year, papier=papier, total=total, done=done, failed=0, finished=False, bundle=None)
+
+        started = time.monotonic()
+        failed = []
+
+        def _progress(pk, error=None):
+            nonlocal done
+            if error is not None:
+                failed.append(pk)
+                self.stderr.write(f"  ! lid #{pk}: {error}")
+            else:
+                done += 1
+            if done % 25 == 0 or done + len(failed) == total:
+                rate = (done - (total - len(todo))) / max(time.monotonic() - started, 0.001)
+                self.stdout.write(f"  {done}/{total} ({rate:.1f}/s)")
+            write_progress(out_dir, year=year, papier=papier, total=total, done=done, failed=len(failed), finished=False, bundle=None)
+
+        if workers == 1:
+            for pk, path in todo:
+                try:
+                    render_owner_pdf(year, papier, pk, str(path), snapshot=engine.snapshot)
+                    _progress(pk)
+                except Exception as exc:
+                    _progress(pk, exc)
+        else:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_worker_init, initargs=(year,)) as pool:
+                futures = {pool.submit(render_owner_pdf, year, papier, pk, str(path)): pk for pk, path in todo}
+                for fut in as_completed(futures):
+                    try:
+                        fut.result()
+                        _progress(futures[fut])
+                    except Exception as exc:
+                        _progress(futures[fut], exc)
+
+        if failed:
+            write_progress(out_dir, year=year, papier=papier, total=total, done=done, failed=len(failed), finished=False, bundle=None)
+            raise CommandError(f"{len(failed)} facturen mislukt; start het commando opnieuw om verder te gaan.")
+
+        paths = [path for _pk, path in jobs]
+        if opts["format"] == "pdf":
+            bundle = bundle_merged_pdf(paths, out_dir / f"jaarfacturen-{year}-{papier}.pdf")
+        else:
+            bundle = bundle_zip(paths, out_dir / f"jaarfacturen-{year}-{papier}.zip")
+        write_progress(out_dir, year=year, papier=papier, total=total, done=done, failed=0, finished=True, bundle=bundle.name)
+        self.stdout.write(self.style.SUCCESS(f"Klaar in {time.monotonic() - started:.1f}s: {bundle}"))
@@ -0,0 +1,150 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, close_old_connections, connection, connections
+
+TAG = "stress_invoice_numbers"  # notes van de testfacturen
+
+
+def _with_retry(func, *args):
+    """SQLite geeft 'database is locked' als de busy-timeout verloopt; gewoon opnieuw proberen."""
+    retries = 0
+    while True:
+        try:
+            return func(*args), retries
+        except OperationalError as exc:
+            if "locked" not in str(exc) or retries >= 100:
+                raise
+            retries += 1
+            time.sleep(0.005 * retries)
+
+
+def _finalize_one(pk):
+    from core.models import Invoice
+
+    Invoice.objects.get(pk=pk).finalize()
+
+
+def _work(pks, bulk_size):
+    """Finaliseer de eigen facturen: één per keer (Invoice.finalize) of per blok (finalize_invoices)."""
+    from core.invoice_numbers import finalize_invoices
+
+    retries = 0
+    try:
+        if bulk_size > 1:
+            for i in range(0, len(pks), bulk_size):
+                _res, r = _with_retry(finalize_invoices, pks[i:i + bulk_size])
+                retries += r
+        else:
+            for pk in pks:
+                _res, r = _with_retry(_finalize_one, pk)
+                retries += r
+    finally:
+        connections.close_all()
+    return retries
+
+
+def _process_init():
+    # spawn: nieuw proces, Django moet opnieuw opgestart worden vóór de modellen geladen worden
+    import os
+
+    import django
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "app.settings")
+    django.setup()
+
+
+class Command(BaseCommand):
+    help = (
+        "Stresstest van de nummer-allocator: meerdere threads/processen finaliseren tegelijk "
+        "facturen in een testjaar; controleert uniciteit en gaten en meet de doorvoer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, default=2099,
+                            help="Testjaar zonder echte facturen (wordt vooraf en achteraf opgeruimd)")
+        parser.add_argument("--workers", type=int, default=8)
+        parser.add_argument("--per-worker", type=int, default=25)
+        parser.add_argument("--processes", action="store_true", help="Processen i.p.v. threads")
+        parser.add_argument("--bulk-size", type=int, default=1, help=">1 = finalize_invoices per blok")
+        parser.add_argument("--keep", action="store_true", help="Testfacturen niet verwijderen")
+
+    def handle(self, *args, **opts):
+        from core.invoice_numbers import format_number
+        from core.models import Invoice, YearSequence
+
+        year = opts["year"]
+        workers = max(1, opts["workers"])
+        per_worker = max(1, opts["per_worker"])
+        self._check_year(year)
+        self._cleanup(year)
+
+        drafts = Invoice.objects.bulk_create(
+            [Invoice(issue_date=date(year, 1, 1), notes=TAG) for _ in range(workers * per_worker)]
+        )
+        pks = [inv.pk for inv in drafts]
+        parts = [pks[i::workers] for i in range(workers)]
+        close_old_connections()
+        if connection.vendor == "sqlite":
+            connection.close()  # threads/processen openen hun eigen verbinding
+
+        kind = "processen" if opts["processes"] else "threads"
+        self.stdout.write(f"{len(pks)} facturen, {workers} {kind}, {connection.vendor}, blok {opts['bulk_size']}")
+        start = time.perf_counter()
+        if opts["processes"]:
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_process_init) as pool:
+                retries = sum(pool.map(_work, parts, [opts["bulk_size"]] * workers))
+        else:
+            barrier = threading.Barrier(workers)
+
+            def _thread(part):
+                barrier.wait()
+                return _work(part, opts["bulk_size"])
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                retries = sum(pool.map(_thread, parts))
+        elapsed = time.perf_counter() - start
+
+        try:
+            numbers = list(Invoice.objects.filter(pk__in=pks).values_list("number", flat=True))
+            expected = [format_number(year, n) for n in range(1, len(pks) + 1)]
+            missing = set(expected) - set(numbers)
+            duplicates = len(numbers) - len(set(numbers))
+            last = YearSequence.objects.filter(year=year).values_list("last_number", flat=True).first()
+            self.stdout.write(
+                f"{len(pks)} nummers in {elapsed:.2f}s = {len(pks) / elapsed:.0f}/s; "
+                f"{duplicates} dubbel, {len(missing)} ontbrekend, teller {last}, {retries} retries"
+            )
+            if duplicates or missing or None in numbers or last != len(pks):
+                raise CommandError("Nummering niet uniek of niet aaneengesloten.")
+            self.stdout.write(self.style.SUCCESS("OK: uniek en zonder gaten."))
+        finally:
+            if not opts["keep"]:
+                self._cleanup(year)
+
+    def _check_year(self, year):
+        """
+        Enkel een jaar waarvan de facturen én de teller van deze stresstest komen: de
+        teller van een echt jaar wissen zou nummers opnieuw uitdelen.
+        """
+        from core.models import Invoice, YearSequence
+
+        if Invoice.objects.filter(issue_date__year=year).exclude(notes=TAG).exists():
+            raise CommandError(f"Jaar {year} heeft echte facturen; kies een leeg testjaar (standaard 2099).")
+        last = YearSequence.objects.filter(year=year).values_list("last_number", flat=True).first()
+        # een vorige run met --keep laat evenveel genummerde testfacturen als de teller achter
+        left = Invoice.objects.filter(issue_date__year=year, notes=TAG).exclude(number__isnull=True).exclude(number="").count()
+        if last is not None and last != left:
+            raise CommandError(f"Jaar {year} heeft een nummerteller ({last}) die niet van deze stresstest komt.")
+
+    def _cleanup(self, year):
+        # enkel na _check_year: de testfacturen en de teller die de stresstest zelf aanmaakte
+        from core.models import Invoice, YearSequence
+
+        Invoice.objects.filter(issue_date__year=year, notes=TAG).delete()
+        YearSequence.objects.filter(year=year).delete()
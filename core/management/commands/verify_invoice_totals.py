@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.invoice_totals import computed_totals, refresh_invoice_totals, stored_totals
+from core.models import Invoice
+
+
+class Command(BaseCommand):
+    help = "Vergelijk de opgeslagen factuurtotalen (total_*_cached) met de som van de lijnen."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--year", type=int, help="Enkel facturen van dit jaar")
+        parser.add_argument("--fix", action="store_true", help="Afwijkingen van conceptfacturen herstellen")
+        parser.add_argument("--include-finalized", action="store_true",
+                            help="Met --fix ook (bevroren) gefinaliseerde facturen overschrijven")
+
+    def handle(self, *args, **opts):
+        qs = Invoice.objects.all()
+        if opts["year"]:
+            qs = qs.filter(issue_date__year=opts["year"])
+
+        checked = 0
+        drift = []
+        for inv in qs.with_totals().order_by("pk").iterator(chunk_size=1000):
+            checked += 1
+            stored = stored_totals(inv)
+            computed = computed_totals(inv)
+            if stored != computed:
+                drift.append(inv.pk)
+                self.stdout.write(
+                    f"  #{inv.pk} {inv.number or 'concept'} [{inv.status}]: "
+                    f"opgeslagen {stored[2]} (excl {stored[0]}, btw {stored[1]}) ≠ lijnen {computed[2]} (excl {computed[0]}, btw {computed[1]})"
+                )
+
+        self.stdout.write(f"{checked} facturen gecontroleerd, {len(drift)} afwijking(en).")
+        if not drift:
+            return
+        if opts["fix"]:
+            fixed = refresh_invoice_totals(drift, include_finalized=opts["include_finalized"])
+            self.stdout.write(self.style.SUCCESS(f"{fixed} factuur/facturen hersteld."))
+            if fixed == len(drift):
+                return
+        raise CommandError(f"{len(drift)} factuur/facturen met afwijkende totalen.")
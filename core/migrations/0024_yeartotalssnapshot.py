@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-17 10:12
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_annual_pricing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YearTotalsSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveIntegerField(db_index=True)),
+                ('code', models.CharField(blank=True, max_length=40)),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('total_excl', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_vat', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('total_incl', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('member_count', models.PositiveIntegerField(default=0)),
+                ('line_count', models.PositiveIntegerField(default=0)),
+                ('notes', models.JSONField(blank=True, default=list)),
+                ('stale', models.BooleanField(db_index=True, default=False)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('household', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.member')),
+            ],
+            options={
+                'verbose_name': 'Jaartotaal (cache)',
+                'verbose_name_plural': 'Jaartotalen (cache)',
+                'ordering': ['year', 'household', 'code'],
+                'unique_together': {('year', 'household', 'code')},
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_yeartotalssnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UblDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('xml', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.invoice')),
+            ],
+            options={
+                'verbose_name': 'UBL-document (cache)',
+                'verbose_name_plural': 'UBL-documenten (cache)',
+            },
+        ),
+    ]
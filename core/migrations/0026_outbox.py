@@ -0,0 +1,41 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_ubldocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipient', models.EmailField(max_length=254)),
+                ('sender', models.CharField(blank=True, max_length=255)),
+                ('subject', models.CharField(max_length=255)),
+                ('body', models.TextField(blank=True)),
+                ('attachment_name', models.CharField(blank=True, max_length=255)),
+                ('attachment', models.BinaryField(blank=True, null=True)),
+                ('attachment_mimetype', models.CharField(blank=True, default='application/xml', max_length=100)),
+                ('status', models.CharField(choices=[('pending', 'In wachtrij'), ('sending', 'Bezig'), ('sent', 'Verzonden'), ('failed', 'Mislukt')], db_index=True, default='pending', max_length=20)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='core.invoice')),
+            ],
+            options={
+                'verbose_name': 'Uitgaande e-mail',
+                'verbose_name_plural': 'Uitgaande e-mails',
+                'ordering': ['next_attempt_at', 'pk'],
+            },
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:27
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_totals(apps, schema_editor):
+    # zelfde berekening als Invoice.total_excl / total_vat / total_incl
+    Invoice = apps.get_model("core", "Invoice")
+    batch = []
+    for inv in Invoice.objects.prefetch_related("lines").iterator(chunk_size=500):
+        excl = Decimal("0.00")
+        vat = Decimal("0.00")
+        for line in inv.lines.all():
+            base = line.unit_price_excl * line.quantity
+            excl += base
+            vat += base * (line.vat_rate / Decimal("100"))
+        inv.total_excl_cached = excl.quantize(Decimal("0.01"))
+        inv.total_vat_cached = vat.quantize(Decimal("0.01"))
+        inv.total_incl_cached = (inv.total_excl_cached + inv.total_vat_cached).quantize(Decimal("0.01"))
+        batch.append(inv)
+        if len(batch) >= 500:
+            Invoice.objects.bulk_update(batch, ["total_excl_cached", "total_vat_cached", "total_incl_cached"])
+            batch = []
+    Invoice.objects.bulk_update(batch, ["total_excl_cached", "total_vat_cached", "total_incl_cached"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_outbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='total_excl_cached',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_incl_cached',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='total_vat_cached',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['issue_date', 'total_incl_cached'], name='invoice_date_total_idx'),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
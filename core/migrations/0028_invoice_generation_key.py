@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_invoice_cached_totals'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='generation_fingerprint',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='generation_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40),
+        ),
+    ]
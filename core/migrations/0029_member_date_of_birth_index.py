@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_invoice_generation_key'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='member',
+            name='date_of_birth',
+            field=models.DateField(blank=True, db_index=True, null=True),
+        ),
+    ]
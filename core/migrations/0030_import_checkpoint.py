@@ -0,0 +1,33 @@
+# Generated by Django 5.0.6 on 2026-10-17 19:54
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0029_member_date_of_birth_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50)),
+                ('file_hash', models.CharField(max_length=64)),
+                ('path', models.CharField(blank=True, max_length=500)),
+                ('last_row', models.PositiveIntegerField(default=0)),
+                ('state', models.JSONField(blank=True, default=dict)),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Importvoortgang',
+                'verbose_name_plural': 'Importvoortgang',
+                'unique_together': {('kind', 'file_hash')},
+            },
+        ),
+    ]
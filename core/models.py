@@ -1,6 +1,8 @@
 from __future__ import annotations
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
@@ -50,7 +52,54 @@ class InvoiceAccount(models.Model):
         verbose_name = "Alternatief factuurgegevens"
         verbose_name_plural = "Alternatief factuurgegevens"
 
-class Member(models.Model):
+class LoadedStateMixin:
+    """
+    Onthoudt de waarden van `tracked_fields` zoals ze uit de database kwamen (from_db) of
+    laatst bewaard werden, zodat signalen een overgang kunnen zien zonder extra SELECT.
+    Nieuwe, nog niet bewaarde objecten hebben geen geladen toestand. Foreign keys volgen
+    via hun attname (bv. "household_head_id").
+    """
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_state = {
+            name: value for name, value in zip(field_names, values) if name in cls.tracked_fields
+        }
+        return instance
+
+    def has_loaded_state(self, field) -> bool:
+        return field in getattr(self, "_loaded_state", {})
+
+    def loaded_value(self, field, default=None):
+        return getattr(self, "_loaded_state", {}).get(field, default)
+
+    def has_changed(self, field) -> bool:
+        if not self.has_loaded_state(field):
+            return True  # nieuw of onbekend: als gewijzigd beschouwen
+        return self.loaded_value(field) != getattr(self, field)
+
+    def _remember_state(self, fields=None):
+        state = getattr(self, "_loaded_state", {})
+        if fields is not None:
+            # update_fields/refresh-velden mogen namen of attnames zijn
+            fields = {self._meta.get_field(f).attname for f in fields}
+        for name in self.tracked_fields:
+            if name in self.__dict__ and (fields is None or name in fields):
+                state[name] = self.__dict__[name]
+        self._loaded_state = state
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._remember_state(fields)
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember_state(kwargs.get("update_fields"))
+
+
+class Member(LoadedStateMixin, models.Model):
 
     phone_private = models.CharField('Tel. Privé', max_length=32, blank=True, null=True)
 
@@ -102,7 +151,7 @@ class Member(models.Model):
     postal_code = models.CharField(max_length=20, blank=True)
     city = models.CharField(max_length=100, blank=True)
     country = models.CharField(max_length=100, default="Belgium", blank=True)
-    date_of_birth = models.DateField(null=True, blank=True)
+    date_of_birth = models.DateField(null=True, blank=True, db_index=True)
     membership_mode = models.CharField(max_length=20, choices=MODE_CHOICES, default=MODE_INVEST, blank=True)
     invest_flex_start_year = models.PositiveIntegerField(null=True, blank=True, help_text="Jaar waarin flex-investering startte (1/7)")
     invest_flex_locked_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Vaste jaarlijkse flex-investeringsbijdrage (berekend bij start)")
@@ -123,6 +172,9 @@ class Member(models.Model):
     @property
     def is_household_head(self):
         return self.household_head_id is None
+
+    # LoadedStateMixin: relaties die de factuurhouder bepalen (core/year_totals.py)
+    tracked_fields = ("billing_account_id", "factureren_via_id", "household_head_id")
     
     factureren_via = models.ForeignKey(
         'self',
@@ -145,7 +197,7 @@ class ImportMapping(models.Model):
         verbose_name = "Import Data"
         verbose_name_plural = "Import Data"
 
-class MemberAsset(models.Model):
+class MemberAsset(LoadedStateMixin, models.Model):
     active = models.BooleanField(default=True)
     assigned_on = models.DateField(null=True, blank=True)
     released_on = models.DateField(null=True, blank=True)
@@ -163,6 +215,7 @@ class MemberAsset(models.Model):
     year = models.PositiveIntegerField(default=timezone.now().year)
     price_excl = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal("0.00"))
     vat_rate = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal("21.00"))
+    tracked_fields = ("member_id",)  # LoadedStateMixin, voor core/year_totals.py
     def __str__(self) -> str:
         return f"{self.get_asset_type_display()} {self.identifier or ''}".strip()
 
@@ -222,7 +275,28 @@ class YearSequence(models.Model):
         verbose_name = "Volgnummer Factuur"
         verbose_name_plural = "Volgnummer Factuur"
 
-class Invoice(models.Model):
+_SUM_FIELD = models.DecimalField(max_digits=24, decimal_places=6)
+
+
+class InvoiceQuerySet(models.QuerySet):
+    def with_totals(self):
+        """
+        Lijnsommen in SQL (één query voor de hele lijst). De annotaties zijn de exacte,
+        onafgeronde sommen; de properties total_excl/total_vat/total_incl ronden ze af
+        zoals voorheen. `lines_incl_sum` dient enkel om op te sorteren.
+        """
+        base = models.ExpressionWrapper(F("lines__unit_price_excl") * F("lines__quantity"), output_field=_SUM_FIELD)
+        zero = models.Value(Decimal("0"), output_field=_SUM_FIELD)
+        excl = Coalesce(models.Sum(base), zero, output_field=_SUM_FIELD)
+        vat_x100 = Coalesce(models.Sum(base * F("lines__vat_rate"), output_field=_SUM_FIELD), zero, output_field=_SUM_FIELD)
+        return self.annotate(
+            lines_excl_sum=excl,
+            lines_vat_sum_x100=vat_x100,
+            lines_incl_sum=models.ExpressionWrapper(excl + vat_x100 / Decimal("100"), output_field=_SUM_FIELD),
+        )
+
+
+class Invoice(LoadedStateMixin, models.Model):
     TYPE_INVOICE = "INV"
     TYPE_CREDIT = "CN"
     DOC_TYPE_CHOICES = [(TYPE_INVOICE,"Factuur"),(TYPE_CREDIT,"Creditnota")]
@@ -239,16 +313,30 @@ class Invoice(models.Model):
     number = models.CharField(max_length=20, unique=True, null=True, blank=True)  # 202500001
     payment_reference_raw = models.CharField(max_length=20, blank=True)  # 12 cijfers OGM
     notes = models.TextField(blank=True)
+    # opgeslagen totalen (core/invoice_totals.py); bevroren bij finaliseren
+    total_excl_cached = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"), editable=False)
+    total_vat_cached = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"), editable=False)
+    total_incl_cached = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"), editable=False)
+    # jaarfacturen (core/invoice_generation.py): "JJJJ:<gezinshoofd-id>" + vingerafdruk van de inhoud
+    generation_key = models.CharField(max_length=40, blank=True, db_index=True, editable=False)
+    generation_fingerprint = models.CharField(max_length=64, blank=True, editable=False)
     def __str__(self) -> str:
         return self.number or f"{self.get_doc_type_display()} (concept)"
+    objects = InvoiceQuerySet.as_manager()
+    tracked_fields = ("status", "number")  # LoadedStateMixin, o.a. voor core/numbering.py
+
     @property
     def total_excl(self) -> Decimal:
+        if hasattr(self, "lines_excl_sum"):  # Invoice.objects.with_totals()
+            return Decimal(self.lines_excl_sum).quantize(Decimal("0.01"))
         total = Decimal("0.00")
         for line in self.lines.all():
             total += (line.unit_price_excl * line.quantity)
         return total.quantize(Decimal("0.01"))
     @property
     def total_vat(self) -> Decimal:
+        if hasattr(self, "lines_vat_sum_x100"):
+            return (Decimal(self.lines_vat_sum_x100) / Decimal("100")).quantize(Decimal("0.01"))
         total = Decimal("0.00")
         for line in self.lines.all():
             line_base = line.unit_price_excl * line.quantity
@@ -276,23 +364,26 @@ class Invoice(models.Model):
     def finalize(self):
         if self.status == self.STATUS_FINAL and self.number:
             return
-        year = self.issue_date.year
-        seq, _ = YearSequence.objects.get_or_create(year=year)
-        seq.last_number += 1
-        seq.save()
-        self.number = f"{year}{seq.last_number:05d}"
-        digits = "".join(ch for ch in self.number if ch.isdigit())
-        base = digits.zfill(10)[-10:]
-        check = int(base) % 97
-        if check == 0:
-            check = 97
-        self.payment_reference_raw = f"{base}{check:02d}"
-        self.status = self.STATUS_FINAL
-        self.save()
+        from .invoice_numbers import next_number, ogm_raw
+
+        with transaction.atomic():
+            # nummer via de centrale allocator (core/invoice_numbers.py): uniek en zonder gaten
+            self.number = next_number(self.issue_date.year)
+            self.payment_reference_raw = ogm_raw(self.number)
+            self.status = self.STATUS_FINAL
+            # totalen bevriezen op de lijnen van dit moment
+            self.total_excl_cached = self.total_excl
+            self.total_vat_cached = self.total_vat
+            self.total_incl_cached = self.total_incl
+            self.save()
 
     class Meta:
         verbose_name = "Dagfactuur"
         verbose_name_plural = "Dagfacturen"
+        indexes = [
+            # jaaromzet / bankafstemming: som over één kolom per periode
+            models.Index(fields=["issue_date", "total_incl_cached"], name="invoice_date_total_idx"),
+        ]
 
 class InvoiceLine(models.Model):
     invoice = models.ForeignKey(Invoice, related_name="lines", on_delete=models.CASCADE)
@@ -490,3 +581,108 @@ class AnnualPricing(models.Model):
         verbose_name = "Jaarlijkse prijzen"
         verbose_name_plural = "Jaarlijkse prijzen"
         ordering = ["-year"]
+
+
+# === Opgeslagen jaartotalen (per jaar, per code, per huishouden) ===
+class YearTotalsSnapshot(models.Model):
+    """Voorberekende totalen voor /admin/invoice/year/totals/; bijgewerkt per gewijzigd huishouden."""
+
+    HOUSEHOLD_CODE = ""  # samenvattingsrij per huishouden (totalen, notities, aantal lijnen)
+
+    year = models.PositiveIntegerField(db_index=True)
+    household = models.ForeignKey(Member, null=True, blank=True, on_delete=models.CASCADE, related_name="+")
+    code = models.CharField(max_length=40, blank=True)
+    description = models.CharField(max_length=255, blank=True)
+    total_excl = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_vat = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    total_incl = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal("0.00"))
+    member_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    notes = models.JSONField(blank=True, default=list)
+    stale = models.BooleanField(default=False, db_index=True)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (("year", "household", "code"),)
+        ordering = ["year", "household", "code"]
+        verbose_name = "Jaartotaal (cache)"
+        verbose_name_plural = "Jaartotalen (cache)"
+
+    def __str__(self) -> str:
+        return f"{self.year} · {self.household_id or '*'} · {self.code or 'totaal'}"
+
+
+class UblDocument(models.Model):
+    """Opgeslagen UBL van een gefinaliseerde factuur; sleutel = hash van hoofding, lijnen en organisatieprofiel."""
+
+    digest = models.CharField(max_length=64, unique=True)
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name="+")
+    xml = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "UBL-document (cache)"
+        verbose_name_plural = "UBL-documenten (cache)"
+
+    def __str__(self) -> str:
+        return f"{self.invoice_id} · {self.digest[:12]}"
+
+
+class Outbox(models.Model):
+    """Uitgaande e-mail (UBL-doorsturing) die `manage.py process_outbox` verstuurt."""
+
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_PENDING, "In wachtrij"),
+        (STATUS_SENDING, "Bezig"),
+        (STATUS_SENT, "Verzonden"),
+        (STATUS_FAILED, "Mislukt"),
+    ]
+
+    invoice = models.ForeignKey(Invoice, null=True, blank=True, on_delete=models.CASCADE, related_name="outbox")
+    recipient = models.EmailField()
+    sender = models.CharField(max_length=255, blank=True)
+    subject = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    attachment_name = models.CharField(max_length=255, blank=True)
+    attachment = models.BinaryField(blank=True, null=True)
+    attachment_mimetype = models.CharField(max_length=100, blank=True, default="application/xml")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["next_attempt_at", "pk"]
+        verbose_name = "Uitgaande e-mail"
+        verbose_name_plural = "Uitgaande e-mails"
+
+    def __str__(self) -> str:
+        return f"{self.subject} → {self.recipient} ({self.get_status_display()})"
+
+
+class ImportCheckpoint(models.Model):
+    """Voortgang van een CSV-import (core/csv_import.py), zodat een onderbroken import kan hervatten."""
+
+    kind = models.CharField(max_length=50)  # naam van het importcommando
+    file_hash = models.CharField(max_length=64)  # sha256 van het bestand
+    path = models.CharField(max_length=500, blank=True)
+    last_row = models.PositiveIntegerField(default=0)  # laatst gecommitte rij (kopregel = rij 1)
+    state = models.JSONField(blank=True, default=dict)  # tellers en eigen status van de import
+    started_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (("kind", "file_hash"),)
+        verbose_name = "Importvoortgang"
+        verbose_name_plural = "Importvoortgang"
+
+    def __str__(self) -> str:
+        return f"{self.kind} · {self.file_hash[:12]} · rij {self.last_row}"
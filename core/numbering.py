@@ -1,10 +1,10 @@
 import re
-from django.db import transaction
 from django.utils import timezone
-from django.db.models.signals import pre_save, post_delete
+from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
-from .models import Invoice, YearSequence
+from .models import Invoice
+from .invoice_numbers import claim_number, next_number, ogm_raw
 
 _NUM_RE = re.compile(r"^(?P<year>\d{4})(?P<seq>\d{5})$")
 
@@ -28,16 +28,9 @@ def _ensure_unique(inv: Invoice):
         raise ValidationError(f"Nummer {inv.number} is al in gebruik.")
 
 def _assign_next_number(inv: Invoice):
-    year = _current_year(inv)
-    with transaction.atomic():
-        seq, _created = YearSequence.objects.select_for_update().get_or_create(
-            year=year, defaults={"last_number": 0}
-        )
-        next_seq = (seq.last_number or 0) + 1
-        inv.number = f"{year}{next_seq:05d}"
-        _ensure_unique(inv)
-        seq.last_number = next_seq
-        seq.save(update_fields=["last_number"])
+    # via de centrale allocator (core/invoice_numbers.py)
+    inv.number = next_number(_current_year(inv))
+    _ensure_unique(inv)
 
 def _accept_manual_number_and_bump_sequence_if_needed(inv: Invoice):
     """Als gebruiker zelf 'number' invult:
@@ -53,30 +46,35 @@ def _accept_manual_number_and_bump_sequence_if_needed(inv: Invoice):
     if year != year_from_issue:
         raise ValidationError(f"De eerste 4 cijfers van het nummer ({year}) moeten overeenkomen met het factuurjaar ({year_from_issue}).")
 
-    with transaction.atomic():
-        yseq, _ = YearSequence.objects.select_for_update().get_or_create(
-            year=year, defaults={"last_number": 0}
-        )
-        if (yseq.last_number or 0) < seq:
-            # Als je bv. 202500012 invult terwijl last_number 11 is, schuiven we de teller mee op
-            yseq.last_number = seq
-            yseq.save(update_fields=["last_number"])
+    # Als je bv. 202500012 invult terwijl last_number 11 is, schuiven we de teller mee op
+    claim_number(inv.number)
+
+def _complete_finalization(inv: Invoice):
+    """OGM en bevroren totalen zoals Invoice.finalize(), voor wie enkel status + save() doet.
+    finalize() zet de OGM zelf; een lege OGM betekent dat die stap nog niet gebeurde.
+    """
+    if inv.payment_reference_raw:
+        return
+    inv.payment_reference_raw = ogm_raw(inv.number)
+    if inv.pk:  # nieuwe factuur: nog geen lijnen (admin: zie _InvAdmin.save_related)
+        inv.total_excl_cached = inv.total_excl
+        inv.total_vat_cached = inv.total_vat
+        inv.total_incl_cached = inv.total_incl
 
 @receiver(pre_save, sender=Invoice)
-def set_or_validate_number_on_finalize(sender, instance: Invoice, **kwargs):
+def set_or_validate_number_on_finalize(sender, instance: Invoice, update_fields=None, **kwargs):
     """Nummer toekennen bij overgang naar FINALIZED (of valideren als handmatig gezet).
     We wijzigen het nummer alleen bij finaliseren en alleen als het nog leeg is.
     """
-    # Haal oude status/nummer op (voor transitie-check)
+    # Oude status uit de geladen toestand (LoadedStateMixin); enkel een SELECT als die
+    # ontbreekt, bv. bij een object met pk dat niet uit de database geladen werd.
     old_status = None
-    old_number = None
     if instance.pk:
-        try:
-            prev = Invoice.objects.only("status", "number").get(pk=instance.pk)
-            old_status = (prev.status or "").upper()
-            old_number = prev.number
-        except Invoice.DoesNotExist:
-            pass
+        if instance.has_loaded_state("status"):
+            old_status = (instance.loaded_value("status") or "").upper()
+        else:
+            prev = Invoice.objects.filter(pk=instance.pk).values_list("status", flat=True).first()
+            old_status = (prev or "").upper()
 
     new_status = (instance.status or "").upper()
 
@@ -85,32 +83,20 @@ def set_or_validate_number_on_finalize(sender, instance: Invoice, **kwargs):
 
     if going_to_finalized:
         if not instance.number:
+            # een nummer dat niet mee bewaard wordt zou de teller verbruiken zonder factuur
+            if update_fields is not None and "number" not in update_fields:
+                raise ValidationError("Finaliseren zonder nummer: bewaar 'number' mee in update_fields.")
             # Geen nummer ingevuld? Automatisch toekennen (volgende in rij)
             _assign_next_number(instance)
         else:
             # Handmatig ingevuld nummer gebruiken, mits geldig/uniek.
             _accept_manual_number_and_bump_sequence_if_needed(instance)
+        if update_fields is None:
+            _complete_finalization(instance)
     else:
         # Niet naar FINALIZED? Niets doen, maar als nummer reeds gezet is en veranderd wordt,
         # hou dan minimale validatie aan (optioneel, hier niet nodig).
         pass
 
-@receiver(post_delete, sender=Invoice)
-def roll_back_sequence_on_delete(sender, instance: Invoice, **kwargs):
-    """Als de laatst genummerde factuur/creditnota verwijderd wordt,
-    draai de jaar-teller één stap terug zodat het nummer hergebruikt wordt.
-    """
-    if not instance.number:
-        return
-    year, seq = _parse_number(instance.number)
-    if year is None:
-        return
-    try:
-        with transaction.atomic():
-            yseq = YearSequence.objects.select_for_update().get(year=year)
-            if (yseq.last_number or 0) == seq:
-                yseq.last_number = max(0, seq - 1)
-                yseq.save(update_fields=["last_number"])
-    except YearSequence.DoesNotExist:
-        # Geen teller voor dit jaar? Dan niets te herstellen.
-        pass
+# Geen teller terug bij verwijderen: een nummer dat ooit uitgedeeld werd (factuur
+# verstuurd, OGM betaald) mag nooit een tweede keer toegekend worden.
@@ -0,0 +1,165 @@
+"""
+Wachtrij voor uitgaande e-mail (UBL naar Billit).
+
+De webrequest zet enkel een Outbox-rij klaar; `manage.py process_outbox` verstuurt
+per batch over één SMTP-verbinding. Mislukte berichten worden opnieuw geprobeerd met
+exponentiële backoff, tot MAX_ATTEMPTS pogingen.
+"""
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+Outbox = apps.get_model("core", "Outbox")
+
+BILLIT_DEFAULT_RECIPIENT = "spiegelvengolf-ylcpib6-nosplit@my.billit.be"
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = timedelta(minutes=1)
+BACKOFF_MAX = timedelta(hours=6)
+LOCK_TIMEOUT = timedelta(minutes=15)  # 'sending'-rijen van een gecrashte worker worden vrijgegeven
+
+
+def billit_recipient() -> str:
+    return getattr(settings, "BILLIT_FORWARD_EMAIL", None) or BILLIT_DEFAULT_RECIPIENT
+
+
+def default_sender(org) -> str:
+    return getattr(settings, "DEFAULT_FROM_EMAIL", None) or org.get("email") or "no-reply@example.com"
+
+
+def backoff_delay(attempts: int) -> timedelta:
+    return min(BACKOFF_BASE * (2 ** max(attempts - 1, 0)), BACKOFF_MAX)
+
+
+# ---------- in de wachtrij zetten ----------
+
+def ubl_message(invoice, xml: bytes, org):
+    from .ubl_export import ubl_filename
+
+    return Outbox(
+        invoice=invoice,
+        recipient=billit_recipient(),
+        sender=default_sender(org),
+        subject=f"UBL factuur {invoice.number or 'concept'}",
+        body="UBL factuur bijgevoegd (Peppol/Billit doorgifte).",
+        attachment_name=ubl_filename(invoice),
+        attachment=xml,
+        attachment_mimetype="application/xml",
+    )
+
+
+def queue_invoice_ubl(invoice):
+    """Eén factuur (ook concept) in de wachtrij; geeft de Outbox-rij terug."""
+    from .admin_views import _org_and_payment
+    from .ubl_cache import cached_ubl
+
+    org, _payment = _org_and_payment()
+    xml = cached_ubl(invoice, org, invoice.lines.order_by("id"))
+    message = ubl_message(invoice, xml, org)
+    message.save()
+    return message
+
+
+def queue_invoices_ubl(queryset) -> int:
+    """Alle gefinaliseerde facturen uit `queryset` als één job in de wachtrij (bulk insert)."""
+    from .admin_views import _org_and_payment
+    from .ubl_export import finalized_invoices, iter_invoice_ubl
+
+    org, _payment = _org_and_payment()
+    batch = []
+    count = 0
+    for invoice, xml in iter_invoice_ubl(finalized_invoices(queryset)):
+        batch.append(ubl_message(invoice, xml, org))
+        if len(batch) >= 500:
+            Outbox.objects.bulk_create(batch)
+            count += len(batch)
+            batch = []
+    Outbox.objects.bulk_create(batch)
+    return count + len(batch)
+
+
+# ---------- versturen ----------
+
+def _claim(batch_size: int):
+    now = timezone.now()
+    # vrijgeven wat een gecrashte worker liet hangen
+    Outbox.objects.filter(status=Outbox.STATUS_SENDING, locked_at__lt=now - LOCK_TIMEOUT).update(
+        status=Outbox.STATUS_PENDING, locked_at=None
+    )
+    with transaction.atomic():
+        rows = list(
+            Outbox.objects.select_for_update(skip_locked=True)
+            .filter(status=Outbox.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at", "pk")[:batch_size]
+        )
+        Outbox.objects.filter(pk__in=[m.pk for m in rows]).update(status=Outbox.STATUS_SENDING, locked_at=now)
+    return rows
+
+
+def _email_for(message, connection):
+    email = EmailMessage(
+        subject=message.subject,
+        body=message.body,
+        from_email=message.sender or None,
+        to=[message.recipient],
+        connection=connection,
+    )
+    if message.attachment is not None:
+        email.attach(message.attachment_name or "bijlage", bytes(message.attachment), message.attachment_mimetype or None)
+    return email
+
+
+def _mark_failed(message, error):
+    message.attempts += 1
+    message.last_error = str(error)[:2000]
+    message.locked_at = None
+    if message.attempts >= MAX_ATTEMPTS:
+        message.status = Outbox.STATUS_FAILED
+    else:
+        message.status = Outbox.STATUS_PENDING
+        message.next_attempt_at = timezone.now() + backoff_delay(message.attempts)
+    message.save(update_fields=["attempts", "last_error", "locked_at", "status", "next_attempt_at"])
+
+
+def process_batch(batch_size: int = 50, connection=None):
+    """Verstuur één batch over één verbinding. Retourneert (verzonden, mislukt)."""
+    rows = _claim(batch_size)
+    if not rows:
+        return 0, 0
+    connection = connection or get_connection(fail_silently=False)
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as exc:
+        for message in rows:
+            _mark_failed(message, exc)
+        return 0, len(rows)
+    try:
+        for message in rows:
+            try:
+                if not connection.send_messages([_email_for(message, connection)]):
+                    raise RuntimeError("Bericht niet aanvaard door de mailserver")
+            except Exception as exc:
+                _mark_failed(message, exc)
+                failed += 1
+                continue
+            message.attempts += 1
+            message.status = Outbox.STATUS_SENT
+            message.sent_at = timezone.now()
+            message.locked_at = None
+            message.last_error = ""
+            message.save(update_fields=["attempts", "status", "sent_at", "locked_at", "last_error"])
+            sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def retry_failed(queryset) -> int:
+    """Mislukte berichten opnieuw in de wachtrij (teller op nul)."""
+    return queryset.filter(status=Outbox.STATUS_FAILED).update(
+        status=Outbox.STATUS_PENDING, attempts=0, next_attempt_at=timezone.now(), locked_at=None
+    )
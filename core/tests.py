@@ -1,3 +1,1187 @@
-from django.test import TestCase
+import os
+import re
+import tempfile
+from datetime import date
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from types import SimpleNamespace
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.ubl_writer import ubl_bytes
+
+GOLDEN_DIR = Path(__file__).resolve().parent / "testdata" / "ubl"
+
+
+class _Member(SimpleNamespace):
+    def __str__(self):
+        return f"{self.last_name} {self.first_name}"
+
+
+FULL_ORG = {
+    "id": 1, "name": "Spiegelven Golf & Country <Club>", "address_line1": "Wiemesmeerstraat 109",
+    "address_line2": "Bus 2", "postal_code": "3600", "city": "Genk", "country": "België",
+    "vat_number": "BE0123456789", "email": "info@spiegelven.be", "website": "https://spiegelven.be",
+    "iban": "BE68539007547034", "bic": "GKCCBEBB", "phone": "+32 89 35 96 16", "fax": "",
+}
+EMPTY_ORG = {k: "" for k in FULL_ORG} | {"id": None}
+
+
+def _line(description, quantity, unit, rate):
+    return SimpleNamespace(description=description, quantity=Decimal(quantity), unit_price_excl=Decimal(unit), vat_rate=Decimal(rate))
+
+
+def ubl_fixtures():
+    """Vaste facturen voor de golden tests (geen database nodig)."""
+    account = SimpleNamespace(
+        name="Peeters-Janssens BV", street="Stationsstraat 1", city="Hasselt", postal_code="3500",
+        country="be", vat_number="BE0999999999", email="boekhouding@peeters.be",
+    )
+    member = _Member(first_name="Émile", last_name="D'Hondt", street="Kerkstraat 5 \"achter\"", city="Genk",
+                     postal_code="3600", country="Nederland", email="emile@example.com")
+    return {
+        "account_full": (
+            SimpleNamespace(pk=11, number="202500011", issue_date=date(2025, 1, 1), account=account, member=member),
+            FULL_ORG,
+            [
+                _line("Lidgeld Championship Course", "1", "1450.00", "6"),
+                _line("Federatiebijdrage <VVG> & co", "2", "42.5", "21"),
+                _line("Vestiairekast", "1.5", "33.333", "21.00"),
+            ],
+        ),
+        "member_concept": (
+            SimpleNamespace(pk=7, number=None, issue_date=date(2025, 12, 31), account=None, member=member),
+            EMPTY_ORG,
+            [_line("Kar (elektrisch)", "1", "120", "21")],
+        ),
+        "no_customer_no_lines": (
+            SimpleNamespace(pk=None, number="", issue_date=date(2026, 2, 28), account=None, member=None),
+            FULL_ORG | {"country": "nl", "phone": "", "vat_number": ""},
+            [],
+        ),
+        "credit_and_zero": (
+            SimpleNamespace(pk=3, number="202600003", issue_date=date(2026, 6, 15), account=account, member=None),
+            FULL_ORG,
+            [
+                _line("Creditering lidgeld", "-1", "725.005", "6"),
+                _line("Gratis les", "0", "55", "0"),
+                _line("", "3", "0.005", "21"),
+            ],
+        ),
+    }
+
+
+class UblWriterGoldenTests(SimpleTestCase):
+    """De UBL-writer moet byte-identiek blijven aan de vroegere ElementTree-output."""
+
+    def test_matches_golden_files(self):
+        for name, (invoice, org, lines) in ubl_fixtures().items():
+            with self.subTest(name):
+                expected = (GOLDEN_DIR / f"{name}.xml").read_bytes()
+                self.assertEqual(ubl_bytes(invoice, org, lines), expected)
+
+    def test_supplier_fragment_follows_org(self):
+        invoice, org, lines = ubl_fixtures()["account_full"]
+        first = ubl_bytes(invoice, org, lines)
+        changed = ubl_bytes(invoice, org | {"name": "Andere club"}, lines)
+        self.assertNotEqual(first, changed)
+        self.assertIn(b"<cbc:Name>Andere club</cbc:Name>", changed)
+
+
+
+def _finalized_invoices(count, year=2025):
+    """`count` gefinaliseerde facturen met elk twee lijnen, plus één concept (hoort nergens in)."""
+    from core.models import Invoice, InvoiceAccount, InvoiceLine, Member, OrganizationProfile
+
+    OrganizationProfile.objects.create(name="Golfclub Spiegelven", city="Genk", iban="BE68539007547034", vat_number="BE0123456789")
+    account = InvoiceAccount.objects.create(name="Aerts BV", street="Kerkstraat 1", postal_code="3600", city="Genk", vat_number="BE0999999999")
+    member = Member.objects.create(first_name="Dirk", last_name="Dewit", street="Dorp 2", postal_code="3500", city="Hasselt")
+    invoices = []
+    for i in range(count + 1):
+        inv = Invoice.objects.create(issue_date=date(year, 1, 10 + i), account=account if i % 2 else None, member=member)
+        InvoiceLine.objects.create(invoice=inv, description="Lidgeld", unit_price_excl=Decimal("100") + i, vat_rate=Decimal("21"))
+        InvoiceLine.objects.create(invoice=inv, description="Kast", quantity=Decimal("2"), unit_price_excl=Decimal("37.50"), vat_rate=Decimal("6"))
+        if i < count:
+            inv.finalize()
+        invoices.append(inv)
+    return invoices[:count], invoices[count]
+
+
+class UblExportTests(TestCase):
+    def setUp(self):
+        self.invoices, self.draft = _finalized_invoices(3)
+
+    def _single(self, invoice):
+        # referentie: de writer voor één factuur, zoals de vroegere export per factuur
+        from core.admin_views import _org_and_payment
+
+        org, _payment = _org_and_payment()
+        return ubl_bytes(invoice, org, list(invoice.lines.order_by("id")))
+
+    def _assert_zip(self, data):
+        import zipfile
+
+        with zipfile.ZipFile(BytesIO(data)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertEqual(sorted(zf.namelist()), [f"invoice-{inv.number}.xml" for inv in self.invoices])
+            for inv in self.invoices:
+                self.assertEqual(zf.read(f"invoice-{inv.number}.xml"), self._single(inv))
+
+    def test_admin_action_streams_a_valid_zip_of_the_finalized_invoices(self):
+        from django.contrib.auth import get_user_model
+        from django.http import StreamingHttpResponse
+        from django.urls import reverse
+        from core.models import Invoice
+
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+        response = self.client.post(reverse("admin:core_invoice_changelist"), {
+            "action": "download_ubl_zip",
+            "_selected_action": list(Invoice.objects.values_list("pk", flat=True)),
+        })
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response["Content-Type"], "application/zip")
+        self.assertIn('filename="ubl-selectie.zip"', response["Content-Disposition"])
+        self._assert_zip(b"".join(response.streaming_content))
+
+    def test_small_chunks_and_several_threads_give_the_same_documents(self):
+        from core.models import Invoice
+        from core.ubl_export import stream_ubl_zip
+
+        self._assert_zip(b"".join(stream_ubl_zip(Invoice.objects.all(), workers=3, chunk_size=2)))
+
+
+
+class UblCacheTests(TestCase):
+    def setUp(self):
+        self.invoices, _draft = _finalized_invoices(2)
+
+    def _export(self):
+        """{nummer: xml} van een bulk-export plus het aantal nieuw gemaakte documenten."""
+        from unittest import mock
+        from core import ubl_export
+        from core.models import Invoice
+
+        with mock.patch.object(ubl_export, "ubl_bytes", wraps=ubl_export.ubl_bytes) as built:
+            docs = {inv.number: xml for inv, xml in ubl_export.iter_invoice_ubl(ubl_export.finalized_invoices(Invoice.objects.all()))}
+        return docs, built.call_count
+
+    def test_second_export_comes_from_the_cache(self):
+        from unittest import mock
+        from core import ubl_cache
+        from core.admin_views import _org_and_payment
+        from core.models import UblDocument
+
+        first, built = self._export()
+        self.assertEqual((built, UblDocument.objects.count()), (2, 2))
+        second, built = self._export()
+        self.assertEqual((second, built), (first, 0))
+
+        # één factuur (wachtrij): zelfde document uit dezelfde cache
+        inv = self.invoices[0]
+        with mock.patch.object(ubl_cache, "ubl_bytes") as built_one:
+            xml = ubl_cache.cached_ubl(inv, _org_and_payment()[0], inv.lines.order_by("id"))
+        self.assertEqual((xml, built_one.call_count), (first[inv.number], 0))
+
+    def test_changed_line_is_a_miss_for_that_invoice_only(self):
+        first, _built = self._export()
+        changed = self.invoices[0]
+        changed.lines.filter(description="Lidgeld").update(unit_price_excl=Decimal("250.00"))
+
+        docs, built = self._export()
+        self.assertEqual(built, 1)
+        self.assertNotEqual(docs[changed.number], first[changed.number])
+        self.assertIn(b"250.00", docs[changed.number])
+        self.assertEqual(docs[self.invoices[1].number], first[self.invoices[1].number])
+
+    def test_profile_change_clears_the_cache(self):
+        from core.models import OrganizationProfile, UblDocument
+
+        first, _built = self._export()
+        profile = OrganizationProfile.objects.get()
+        profile.name = "Golfclub Spiegelven vzw"
+        profile.save()
+        self.assertFalse(UblDocument.objects.exists())
+
+        docs, built = self._export()
+        self.assertEqual(built, 2)
+        self.assertIn(b"Spiegelven vzw", docs[self.invoices[0].number])
+        profile.delete()
+        self.assertFalse(UblDocument.objects.exists())
+
+
+class OutboxTests(TestCase):
+    """Wachtrij voor UBL-doorsturing; de testrunner gebruikt de locmem-mailbackend."""
+
+    def setUp(self):
+        from core.models import Invoice, InvoiceLine
+        self.invoices = []
+        for i in range(3):
+            inv = Invoice.objects.create(issue_date=date(2025, 1, 1), status=Invoice.STATUS_FINAL, number=f"20250000{i}")
+            InvoiceLine.objects.create(invoice=inv, description="Lidgeld", quantity=Decimal("1"), unit_price_excl=Decimal("100"), vat_rate=Decimal("6"))
+            self.invoices.append(inv)
+
+    def test_batch_is_sent_over_one_connection(self):
+        from unittest import mock
+        from django.core import mail
+        from core import outbox
+        from core.models import Invoice, Outbox
+        from core.outbox import process_batch, queue_invoices_ubl
+
+        self.assertEqual(queue_invoices_ubl(Invoice.objects.all()), 3)
+        connection = mail.get_connection()
+        with mock.patch.object(outbox, "get_connection", return_value=connection) as get_connection, \
+                mock.patch.object(connection, "open", wraps=connection.open) as open_, \
+                mock.patch.object(connection, "send_messages", wraps=connection.send_messages) as send:
+            self.assertEqual(process_batch(), (3, 0))
+        get_connection.assert_called_once()
+        open_.assert_called_once()
+        self.assertEqual(send.call_count, 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            sorted(m.attachments[0][0] for m in mail.outbox),
+            ["invoice-202500000.xml", "invoice-202500001.xml", "invoice-202500002.xml"],
+        )
+        self.assertEqual(Outbox.objects.filter(status=Outbox.STATUS_SENT).count(), 3)
+        self.assertEqual(process_batch(), (0, 0))
+
+    def test_failures_back_off_and_give_up(self):
+        from unittest import mock
+        from django.utils import timezone
+        from core import outbox
+        from core.models import Outbox
+
+        message = outbox.queue_invoice_ubl(self.invoices[0])
+        connection = mock.Mock()
+        connection.send_messages.side_effect = OSError("SMTP hangt")
+        for attempt in range(1, outbox.MAX_ATTEMPTS + 1):
+            Outbox.objects.filter(pk=message.pk).update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.process_batch(connection=connection), (0, 1))
+            message.refresh_from_db()
+            self.assertEqual(message.attempts, attempt)
+        self.assertEqual(message.status, Outbox.STATUS_FAILED)
+        self.assertIn("SMTP hangt", message.last_error)
+        self.assertEqual(outbox.backoff_delay(3), outbox.BACKOFF_BASE * 4)
+
+
+class InvoiceTotalsTests(TestCase):
+    def test_annotated_totals_match_properties(self):
+        from core.models import Invoice, InvoiceLine
+
+        inv = Invoice.objects.create(issue_date=date(2025, 1, 1))
+        for qty, unit, rate in (("1", "0.05", "21"), ("0.5", "10.01", "6"), ("-1", "725.01", "6"), ("3", "0.33", "12.5")):
+            InvoiceLine.objects.create(invoice=inv, description="x", quantity=Decimal(qty), unit_price_excl=Decimal(unit), vat_rate=Decimal(rate))
+        Invoice.objects.create(issue_date=date(2025, 1, 2))  # zonder lijnen
+
+        for annotated in Invoice.objects.with_totals():
+            plain = Invoice.objects.get(pk=annotated.pk)
+            self.assertEqual(
+                (annotated.total_excl, annotated.total_vat, annotated.total_incl),
+                (plain.total_excl, plain.total_vat, plain.total_incl),
+            )
+        with self.assertNumQueries(1):
+            totals = [i.total_incl for i in Invoice.objects.with_totals().order_by("-lines_incl_sum")]
+        self.assertEqual(totals, [Decimal("0.00"), Decimal("-762.03")])
+
+    def test_cached_totals_follow_lines_until_finalized(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from core.models import Invoice, InvoiceLine
+
+        inv = Invoice.objects.create(issue_date=date(2025, 3, 1))
+        line = InvoiceLine.objects.create(invoice=inv, description="a", quantity=Decimal("2"), unit_price_excl=Decimal("10"), vat_rate=Decimal("21"))
+        InvoiceLine.objects.create(invoice=inv, description="b", quantity=Decimal("1"), unit_price_excl=Decimal("5"), vat_rate=Decimal("6"))
+        inv.refresh_from_db()
+        self.assertEqual((inv.total_excl_cached, inv.total_vat_cached, inv.total_incl_cached),
+                         (Decimal("25.00"), Decimal("4.50"), Decimal("29.50")))
+
+        line.delete()
+        inv.refresh_from_db()
+        self.assertEqual(inv.total_incl_cached, Decimal("5.30"))
+
+        inv.finalize()
+        InvoiceLine.objects.filter(invoice=inv).update(unit_price_excl=Decimal("50"))  # omzeilt signalen
+        InvoiceLine.objects.create(invoice=inv, description="c", quantity=Decimal("1"), unit_price_excl=Decimal("1"), vat_rate=Decimal("0"))
+        inv.refresh_from_db()
+        self.assertEqual(inv.total_incl_cached, Decimal("5.30"))  # bevroren
+        with self.assertRaises(CommandError):
+            call_command("verify_invoice_totals", stdout=StringIO())
+
+
+class BulkFinalizeTests(TestCase):
+    def test_block_per_year_in_selection_order(self):
+        from core.invoice_numbers import finalize_invoices, ogm_raw
+        from core.models import Invoice, YearSequence
+
+        YearSequence.objects.create(year=2025, last_number=7)
+        a = Invoice.objects.create(issue_date=date(2025, 5, 1))
+        b = Invoice.objects.create(issue_date=date(2026, 1, 1))
+        c = Invoice.objects.create(issue_date=date(2025, 1, 1))
+        done_before = Invoice.objects.create(issue_date=date(2025, 1, 1), status=Invoice.STATUS_FINAL, number="202500001")
+
+        done = finalize_invoices([c.pk, done_before.pk, b.pk, a.pk])
+
+        self.assertEqual([inv.pk for inv in done], [c.pk, b.pk, a.pk])
+        numbers = dict(Invoice.objects.values_list("pk", "number"))
+        self.assertEqual((numbers[c.pk], numbers[a.pk], numbers[b.pk]), ("202500008", "202500009", "202600001"))
+        self.assertEqual(numbers[done_before.pk], "202500001")
+        self.assertEqual(YearSequence.objects.get(year=2025).last_number, 9)
+        a.refresh_from_db()
+        self.assertEqual(a.payment_reference_raw, ogm_raw(a.number))
+        self.assertEqual(a.payment_reference_display(), a._ogm_from_invoice_number(a.number))
+
+    def test_claim_moves_the_sequence_forward_only(self):
+        from core.invoice_numbers import claim_number, next_number
+        from core.models import YearSequence
+
+        self.assertEqual(next_number(2027), "202700001")
+        claim_number("202700010")
+        self.assertEqual(next_number(2027), "202700011")
+        claim_number("202700005")
+        self.assertEqual(YearSequence.objects.get(year=2027).last_number, 11)
+
+
+class StressInvoiceNumbersTests(TestCase):
+    def test_refuses_a_year_with_real_invoices_or_counter(self):
+        from django.core.management import CommandError, call_command
+        from core.models import Invoice, YearSequence
+
+        real = Invoice.objects.create(issue_date=date(2025, 2, 1))
+        real.finalize()
+        with self.assertRaisesMessage(CommandError, "echte facturen"):
+            call_command("stress_invoice_numbers", year=2025, stdout=StringIO())
+        self.assertEqual(YearSequence.objects.get(year=2025).last_number, 1)
+
+        real.delete()  # teller blijft: het nummer werd uitgedeeld
+        with self.assertRaisesMessage(CommandError, "nummerteller (1)"):
+            call_command("stress_invoice_numbers", year=2025, stdout=StringIO())
+        self.assertEqual(YearSequence.objects.get(year=2025).last_number, 1)
+
+
+class LoadedStateTests(TestCase):
+    def test_transitions_without_extra_query(self):
+        from core.models import Invoice
+
+        inv = Invoice.objects.create(issue_date=date(2025, 1, 1))
+        self.assertFalse(inv.has_changed("status"))
+        inv = Invoice.objects.get(pk=inv.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(inv.loaded_value("status"), Invoice.STATUS_DRAFT)
+            inv.status = Invoice.STATUS_FINAL
+            self.assertTrue(inv.has_changed("status"))
+        inv.save(update_fields=["status", "number"])  # core/numbering.py kent het nummer toe
+        self.assertFalse(inv.has_changed("status"))
+
+        deferred = Invoice.objects.only("pk").get(pk=inv.pk)
+        self.assertFalse(deferred.has_loaded_state("status"))
+        self.assertEqual(deferred.status, Invoice.STATUS_FINAL)  # laadt het veld na
+        self.assertFalse(deferred.has_changed("status"))
+
+
+    def test_numbering_receiver_uses_the_loaded_state(self):
+        from django.core.exceptions import ValidationError
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from core.models import Invoice
+
+        inv = Invoice.objects.get(pk=Invoice.objects.create(issue_date=date(2026, 3, 1)).pk)
+        inv.status = Invoice.STATUS_FINAL
+        with CaptureQueriesContext(connection) as queries:
+            inv.save()
+        self.assertEqual(inv.number, "202600001")
+        self.assertEqual(Invoice.objects.get(pk=inv.pk).number, "202600001")
+        status_reads = [q["sql"] for q in queries if q["sql"].startswith('SELECT "core_invoice"."status"')]
+        self.assertEqual(status_reads, [])
+
+        # al gefinaliseerd: geen nieuw nummer, geen teller
+        inv.notes = "betaald"
+        with self.assertNumQueries(1):
+            inv.save()
+        self.assertEqual(inv.number, "202600001")
+
+        # object met pk maar zonder geladen toestand: één SELECT als terugval
+        blind = Invoice(pk=Invoice.objects.create(issue_date=date(2026, 3, 2)).pk, issue_date=date(2026, 3, 2), status=Invoice.STATUS_FINAL)
+        blind.save()
+        self.assertEqual(blind.number, "202600002")
+
+        draft = Invoice.objects.get(pk=Invoice.objects.create(issue_date=date(2026, 3, 3)).pk)
+        draft.status = Invoice.STATUS_FINAL
+        with self.assertRaises(ValidationError):
+            draft.save(update_fields=["status"])
+
+    def test_plain_status_save_sets_ogm_and_freezes_totals(self):
+        from core.invoice_numbers import ogm_raw
+        from core.models import Invoice, InvoiceLine
+
+        inv = Invoice.objects.create(issue_date=date(2026, 3, 1))
+        InvoiceLine.objects.create(invoice=inv, description="Lidgeld", unit_price_excl=Decimal("100.00"), vat_rate=21)
+        inv = Invoice.objects.get(pk=inv.pk)
+        inv.status = Invoice.STATUS_FINAL
+        inv.save()
+        inv.refresh_from_db()
+        self.assertEqual((inv.number, inv.payment_reference_raw), ("202600001", ogm_raw("202600001")))
+        self.assertEqual((inv.total_excl_cached, inv.total_incl_cached), (Decimal("100.00"), Decimal("121.00")))
+
+    def test_deleting_the_last_invoice_does_not_reuse_its_number(self):
+        from core.models import Invoice
+
+        first = Invoice.objects.create(issue_date=date(2026, 3, 1))
+        first.finalize()
+        first.delete()
+        second = Invoice.objects.create(issue_date=date(2026, 3, 2))
+        second.finalize()
+        self.assertEqual((first.number, second.number), ("202600001", "202600002"))
+
+
+def _admin_post_data(response):
+    """POST-data zoals de browser ze terugstuurt: hoofdformulier + alle inline formsets."""
+    data = {}
+
+    def add(form):
+        for name, field in form.fields.items():
+            if field.disabled:
+                continue
+            value = form[name].value()
+            if value is None or value is False:
+                continue
+            data[form.add_prefix(name)] = value
+
+    add(response.context["adminform"].form)
+    for inline in response.context["inline_admin_formsets"]:
+        formset = inline.formset
+        add(formset.management_form)
+        for form in formset.forms:
+            add(form)
+    return data
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class InvoiceAdminTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+
+    def test_finalizing_in_the_change_form_sets_number_ogm_and_totals(self):
+        from django.urls import reverse
+        from core.models import Invoice
+
+        inv = Invoice.objects.create(issue_date=date(2025, 5, 1))
+        url = reverse("admin:core_invoice_change", args=[inv.pk])
+        data = _admin_post_data(self.client.get(url))
+        data.update({
+            "status": Invoice.STATUS_FINAL,
+            "lines-0-description": "Lidgeld", "lines-0-quantity": "1",
+            "lines-0-unit_price_excl": "100.00", "lines-0-vat_rate": "21",
+        })
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302, getattr(response, "context", None) and response.context["adminform"].form.errors)
+
+        inv.refresh_from_db()
+        self.assertEqual(inv.status, Invoice.STATUS_FINAL)
+        self.assertEqual(inv.number, "202500001")
+        self.assertEqual(inv.payment_reference_raw, "020250000185")
+        self.assertEqual((inv.total_excl_cached, inv.total_vat_cached, inv.total_incl_cached),
+                         (Decimal("100.00"), Decimal("21.00"), Decimal("121.00")))
+
+
+class YearTotalsSignalTests(TestCase):
+    def setUp(self):
+        from core.models import Member, YearTotalsSnapshot
+        from core.year_totals import mark_year_stale
+
+        self.head = Member.objects.create(first_name="An", last_name="Aerts", household_role="head")
+        self.other = Member.objects.create(first_name="Dirk", last_name="Dewit", household_role="head")
+        self.child = Member.objects.create(first_name="Cas", last_name="Aerts", household_head=self.head)
+        mark_year_stale(2026)
+        for owner in (self.head, self.other):
+            YearTotalsSnapshot.objects.create(year=2026, household=owner, code=YearTotalsSnapshot.HOUSEHOLD_CODE, stale=False)
+
+    def _stale(self):
+        from core.models import YearTotalsSnapshot
+        return set(YearTotalsSnapshot.objects.filter(stale=True, household__isnull=False).values_list("household_id", flat=True))
+
+    def test_saves_in_one_transaction_mark_once_after_commit(self):
+        from django.db import transaction
+        from core.models import Member
+
+        head = Member.objects.get(pk=self.head.pk)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with transaction.atomic():
+                with self.assertNumQueries(4):  # snapshotjaren één keer, 3 UPDATEs, geen SELECT van de oude versie
+                    for name in ("Ann", "Anna", "Anne"):
+                        head.first_name = name
+                        head.save()
+                self.assertEqual(self._stale(), set())
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(self._stale(), {self.head.pk})
+
+    def test_moving_a_member_marks_old_and_new_household(self):
+        from core.models import Member
+
+        child = Member.objects.get(pk=self.child.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            child.household_head = self.other
+            child.save()
+        self.assertEqual(self._stale(), {self.head.pk, self.other.pk})
+
+    def test_field_only_update_skips_the_old_version(self):
+        from core.models import Member
+
+        child = Member.objects.only("pk", "course", "billing_account", "factureren_via", "household_head").get(pk=self.child.pk)
+        child.course = "P3"
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(3):  # snapshotjaren, UPDATE, gezinshoofd (factuurhouder)
+                child.save(update_fields=["course"])
+        self.assertEqual(self._stale(), {self.head.pk})
+
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class YearTotalsPageTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from django.urls import reverse
+        from core.models import Member, YearPricing
+
+        YearPricing.objects.create(year=2026, code="LID_CC_IND", description="Lidgeld", amount=Decimal("900"), vat_rate=21)
+        self.an = Member.objects.create(first_name="An", last_name="Aerts", course="CC", household_role="head")
+        self.user = get_user_model().objects.create_superuser("admin", "admin@example.com", "x")
+        self.client.force_login(self.user)
+        self.url = f"{reverse('admin-yearly-totals')}?jaar=2026"
+
+    def test_get_only_reads_and_rebuild_needs_a_csrf_post(self):
+        from django.test import Client
+        from core.models import YearTotalsSnapshot
+
+        response = self.client.get(self.url)
+        self.assertTrue(response.context["totals_need_rebuild"])
+        self.assertContains(response, 'name="csrfmiddlewaretoken"')
+        self.assertFalse(YearTotalsSnapshot.objects.exists())
+        self.client.get(self.url + "&herbereken=1")
+        self.assertFalse(YearTotalsSnapshot.objects.exists())
+
+        strict = Client(enforce_csrf_checks=True)
+        strict.force_login(self.user)
+        self.assertEqual(strict.post(self.url).status_code, 403)
+        self.assertFalse(YearTotalsSnapshot.objects.exists())
+
+        self.assertRedirects(self.client.post(self.url), self.url, fetch_redirect_response=False)
+        response = self.client.get(self.url)
+        self.assertFalse(response.context["totals_need_rebuild"])
+        self.assertEqual((response.context["households"], response.context["total_excl"]), (1, Decimal("900.00")))
+
+    def test_get_refreshes_only_stale_households(self):
+        from core.models import Member, YearTotalsSnapshot
+
+        self.client.post(self.url)
+        bo = Member.objects.create(first_name="Bo", last_name="Bos", course="CC", household_role="head")
+        YearTotalsSnapshot.objects.create(year=2026, household=bo, code=YearTotalsSnapshot.HOUSEHOLD_CODE, stale=True)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["totals_refreshed"], 1)
+        self.assertEqual((response.context["households"], response.context["total_excl"]), (2, Decimal("1800.00")))
+
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class YearlyBatchViewTests(TestCase):
+    # de vroegere print_batch.html / preview_batch.html: alles in één render
+    OLD_TEMPLATE = (
+        '{% include "invoices/_NAME_head.html" %}'
+        '{% for inv_ctx in invoices %}{% include "invoices/_NAME_page.html" %}{% endfor %}'
+        '{% include "invoices/_NAME_tail.html" %}'
+    )
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from core.models import YearPricing
+
+        YearPricing.objects.create(year=2026, code="LID_CC_IND", description="Lidgeld", amount=Decimal("900"), vat_rate=21)
+        YearPricing.objects.create(year=2026, code="locker", description="Kast", amount=Decimal("75"), vat_rate=21)
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+        self.households = 0
+
+    def _add_households(self, count):
+        from core.models import Member, MemberAsset
+
+        for _ in range(count):
+            self.households += 1
+            head = Member.objects.create(first_name=f"Lid{self.households}", last_name="Aerts", course="CC", household_role="head")
+            MemberAsset.objects.create(member=head, asset_type=MemberAsset.ASSET_LOCKER, identifier=str(self.households))
+
+    @staticmethod
+    def _normalize(html):
+        # enkel witruimte tussen de stukken verschilt; het CSRF-token is per request
+        return " ".join(re.sub(r'name="csrfmiddlewaretoken" value="[^"]*"', "", html).split())
+
+    def _get(self, name):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.urls import reverse
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(name, args=[2026]))
+            html = b"".join(response.streaming_content).decode()
+        return response, html, len(queries)
+
+    def test_streamed_batch_matches_the_single_template(self):
+        from django.http import StreamingHttpResponse
+        from django.template import engines
+        from django.test import RequestFactory
+        from core.admin_views import _stream_yearly_invoice_contexts
+
+        self._add_households(3)
+        contexts = list(_stream_yearly_invoice_contexts(2026))
+        self.assertEqual(len(contexts), 3)
+        for name, template, mode in (
+            ("yearly-invoice-batch-print-logo", "print_batch", "print"),
+            ("yearly-invoice-batch-preview-logo", "preview_batch", "preview"),
+        ):
+            response, html, _queries = self._get(name)
+            self.assertIsInstance(response, StreamingHttpResponse)
+            request = RequestFactory().get("/")
+            request.user = response.wsgi_request.user
+            expected = engines["django"].from_string(self.OLD_TEMPLATE.replace("NAME", template)).render(
+                {"year": 2026, "papier": "digitaal", "mode": mode, "page": None, "invoices": contexts}, request,
+            )
+            self.assertEqual(self._normalize(html), self._normalize(expected))
+            self.assertEqual(html.count('class="invoice-page'), 3)
+
+    def test_streamed_batch_query_count_does_not_grow_with_the_club(self):
+        self._add_households(3)
+        _response, html, small = self._get("yearly-invoice-batch-print-logo")
+        self._add_households(6)
+        _response, html, large = self._get("yearly-invoice-batch-print-logo")
+        self.assertEqual(html.count('class="invoice-page'), 9)
+        self.assertEqual(small, large)
+
+
+
+class BillingSnapshotTests(TestCase):
+    def setUp(self):
+        from core.models import YearPricing
+
+        for code, amount in (("LID_CC_IND", "900"), ("LID_CC_PRT", "700"), ("LID_CC_KID_0_15", "50"), ("locker", "75")):
+            YearPricing.objects.create(year=2026, code=code, description=code, amount=Decimal(amount), vat_rate=21)
+        YearPricing.objects.create(year=2025, code="LID_CC_IND", description="oud", amount=Decimal("850"), vat_rate=21)
+        self.households = 0
+
+    def _grow_club(self, count):
+        """`count` gezinnen van vier leden: hoofd met factuuradres, partner, kind met kast, lid 'factureren via' het hoofd."""
+        from core.models import Invoice, InvoiceAccount, Member, MemberAsset
+
+        for _ in range(count):
+            self.households += 1
+            n = self.households
+            account = InvoiceAccount.objects.create(name=f"Firma {n}") if n % 2 else None
+            head = Member.objects.create(first_name=f"Hoofd{n}", last_name=f"Gezin{n}", course="CC", household_role="head", billing_account=account)
+            Member.objects.create(first_name=f"Partner{n}", last_name=f"Gezin{n}", course="CC", household_role="partner", household_head=head)
+            kid = Member.objects.create(first_name=f"Kind{n}", last_name=f"Gezin{n}", course="CC", household_role="child",
+                                        household_head=head, date_of_birth=date(2016, 1, 1))
+            Member.objects.create(first_name=f"Via{n}", last_name=f"Ander{n}", course="CC", household_role="head", factureren_via=head)
+            MemberAsset.objects.create(member=kid, asset_type=MemberAsset.ASSET_LOCKER, identifier=str(n))
+            Invoice.objects.create(issue_date=date(2026, 1, 5), member=head, account=account)
+
+    def _preview_all(self):
+        from core.admin_views import _yearly_invoice_context
+        from core.billing_engine import compile_year
+        from core.billing_snapshot import BillingSnapshot
+
+        snapshot = BillingSnapshot(2026)
+        engine = compile_year(2026, snapshot=snapshot)
+        owners = engine.owners()
+        for owner in owners:
+            engine.invoice_lines(owner)
+            _yearly_invoice_context(owner, 2026, snapshot=snapshot)
+        return len(owners)
+
+    def test_query_count_does_not_depend_on_the_club_size(self):
+        for households in (10, 100):
+            self._grow_club(households - self.households)
+            with self.subTest(members=4 * households), self.assertNumQueries(6):
+                self.assertEqual(self._preview_all(), households)  # "factureren via" valt onder het hoofd
+
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class YearlyBatchPagingTests(TestCase):
+    # namen met '|' en '&': de cursor in de URL mag er niet op breken
+    NAMES = [("Ann", "Aerts"), ("Bo|b", "Van|Dijk"), ("Cas", "Van|Dijk"), ("Dirk & Els", "Dewit"), ("Emma", "Zed|")]
+
+    def setUp(self):
+        from django.contrib.auth import get_user_model
+        from core.models import Member, YearPricing
+
+        YearPricing.objects.create(year=2026, code="LID_CC_IND", description="Lidgeld", amount=Decimal("900"), vat_rate=21)
+        for first, last in self.NAMES:
+            Member.objects.create(first_name=first, last_name=last, course="CC", household_role="head")
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+
+    def _page(self, url, params=None):
+        from html import unescape
+
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        html = unescape(b"".join(response.streaming_content).decode())
+        links = dict((label, href) for href, label in re.findall(r'<a href="([^"]+)" class="btn">[^A-Z]*(Vorige|Volgende)', html))
+        shown = [name for name in self.NAMES if f"{name[0]} {name[1]}" in html]
+        return html, links, shown
+
+    def test_paged_print_view_links_between_pages(self):
+        from django.urls import reverse
+
+        html, links, shown = self._page(reverse("yearly-invoice-batch-print-logo", args=[2026]), {"limit": 2})
+        self.assertIn('class="batch-nav"', html)
+        self.assertEqual(set(links), {"Volgende"})
+        pages = [shown]
+        for _ in self.NAMES:  # begrensd: een kapotte cursor kan naar dezelfde pagina wijzen
+            if "Volgende" not in links:
+                break
+            _html, links, shown = self._page(links["Volgende"])
+            pages.append(shown)
+        self.assertEqual(set(links), {"Vorige"})
+        expected = sorted(self.NAMES, key=lambda n: (n[1].casefold(), n[0].casefold()))
+        self.assertEqual(pages, [expected[0:2], expected[2:4], expected[4:]])
+
+        _html, links, shown = self._page(links["Vorige"])
+        self.assertEqual(shown, expected[2:4])
+
+    def test_invalid_cursor_starts_at_the_first_page(self):
+        from django.urls import reverse
+
+        url = reverse("yearly-invoice-batch-print-logo", args=[2026])
+        for cursor in ("Van|Dijk|Bo|b|2", "%%%", "WzEsMiwzXQ"):  # oud formaat, geen base64, [1,2,3]
+            with self.subTest(cursor=cursor):
+                _html, _links, shown = self._page(url, {"limit": 2, "after": cursor})
+                self.assertEqual(len(shown), 2)
+
+
+class GenerateYearlyInvoicesTests(TestCase):
+    def setUp(self):
+        from core.models import InvoiceAccount, Member, MemberAsset, YearPricing
+
+        for code, amount in (
+            ("LID_CC_IND", "900"), ("LID_CC_PRT", "700"), ("LID_CC_KID_0_15", "50"),
+            ("FED_CC_IND", "40"), ("FED_CC_PRT", "40"), ("FED_CC_KID", "20"), ("locker", "75"),
+        ):
+            YearPricing.objects.create(year=2026, code=code, description=code, amount=Decimal(amount), vat_rate=21)
+        account = InvoiceAccount.objects.create(name="Aerts BV", email="boekhouding@aerts.be")
+        head = Member.objects.create(first_name="An", last_name="Aerts", course="CC", household_role="head", billing_account=account)
+        Member.objects.create(first_name="Bo", last_name="Aerts", course="CC", household_role="partner", household_head=head,
+                              federale_bijdrage_via_spiegelven=False)
+        Member.objects.create(first_name="Cas", last_name="Aerts", course="CC", household_role="child", household_head=head,
+                              date_of_birth=date(2018, 5, 1))
+        MemberAsset.objects.create(member=head, asset_type=MemberAsset.ASSET_LOCKER, identifier="12")
+        self.dirk = Member.objects.create(first_name="Dirk", last_name="Dewit", course="CC", household_role="head",
+                                          email="dirk@example.com", federale_bijdrage_via_spiegelven=False)
+
+    def test_bulk_matches_regular_mode(self):
+        from django.core.management import call_command
+        from core.models import Invoice, InvoiceLine
+
+        def generate(**extra):
+            call_command("generate_yearly_invoices", year=2026, commit=True, stdout=StringIO(), **extra)
+            result = [
+                (inv.member_id, inv.account_id, inv.total_incl_cached, [(l.description, l.unit_price_excl, l.vat_rate) for l in inv.lines.order_by("id")])
+                for inv in Invoice.objects.order_by("id")
+            ]
+            InvoiceLine.objects.all().delete()
+            Invoice.objects.all().delete()
+            return result
+
+        regular = generate()
+        self.assertEqual(len(regular), 2)
+        self.assertEqual(generate(bulk=True, chunk_size=1), regular)
+
+    def test_invoice_has_the_preview_lines(self):
+        from django.core.management import call_command
+        from core.admin_views import _yearly_invoice_context
+        from core.models import Invoice, Member
+
+        call_command("generate_yearly_invoices", year=2026, commit=True, stdout=StringIO())
+        head = Member.objects.get(first_name="An")
+        invoice = Invoice.objects.get(member=head)
+        self.assertEqual(invoice.account_id, head.billing_account_id)
+        self.assertEqual((invoice.doc_type, invoice.status), (Invoice.TYPE_INVOICE, Invoice.STATUS_DRAFT))
+        expected = [
+            (l["description"], l["quantity"], l["unit_price_excl"], l["vat_rate"])
+            for l in _yearly_invoice_context(head, 2026)["lines"]
+        ]
+        self.assertEqual(len(expected), 6)
+        self.assertEqual(
+            [(l.description, l.quantity, l.unit_price_excl, l.vat_rate) for l in invoice.lines.order_by("id")], expected,
+        )
+
+    def test_partitions_cover_all_households_once(self):
+        from core.invoice_generation import compute_entries
+
+        single, _skipped, _warnings = compute_entries(2026)
+        merged = []
+        for index in range(3):
+            merged.extend(compute_entries(2026, jobs=3, index=index)[0])
+        self.assertEqual(sorted(merged, key=lambda e: e["position"]), single)
+
+    def test_rerun_only_rewrites_changed_drafts(self):
+        from django.core.management import call_command
+        from core.invoice_generation import first_monday
+        from core.models import Invoice, YearPricing
+
+        def generate(*args):
+            out = StringIO()
+            call_command("generate_yearly_invoices", *args, year=2026, commit=True, stdout=out)
+            return out.getvalue()
+
+        generate("--bulk")
+        self.assertIn("ongewijzigd=2", generate())
+        self.assertEqual(Invoice.objects.count(), 2)
+
+        dirk = Invoice.objects.get(member=self.dirk)
+        Invoice.objects.filter(pk=dirk.pk).update(issue_date=date(2025, 1, 6))
+        family = Invoice.objects.exclude(pk=dirk.pk).get()
+        family.finalize()
+        YearPricing.objects.filter(code="LID_CC_IND").update(amount=Decimal("950"))
+        self.assertIn("nieuw=0, herschreven=1, ongewijzigd=0, definitief (niet aangeraakt)=1", generate("--bulk"))
+
+        rewritten = Invoice.objects.get(pk=dirk.pk)
+        self.assertEqual((rewritten.total_excl_cached, rewritten.issue_date), (Decimal("950.00"), first_monday(2026)))
+        frozen = Invoice.objects.get(pk=family.pk)
+        self.assertEqual(frozen.total_excl_cached, family.total_excl_cached)
+        self.assertEqual(frozen.lines.count(), family.lines.count())
+
+    def test_bulk_compiles_the_year_once(self):
+        from unittest import mock
+        from django.core.management import call_command
+        from core import billing_engine
+        from core.management.commands import generate_yearly_invoices
+
+        with mock.patch.object(billing_engine, "compile_year", wraps=billing_engine.compile_year) as compiled, \
+                mock.patch.object(generate_yearly_invoices, "compile_year", compiled):
+            call_command("generate_yearly_invoices", "--bulk", year=2026, stdout=StringIO())
+        self.assertEqual(compiled.call_count, 1)
+
+
+class ApplyAssetsTests(TestCase):
+    def setUp(self):
+        from core.models import Member, MemberAsset, YearPricing, YearRule
+
+        YearPricing.objects.create(year=2026, code="VST_KAST", amount=Decimal("75"), vat_rate=21)
+        YearRule.objects.create(year=2026, code="VST_KAST", data={
+            "asset_type": MemberAsset.ASSET_LOCKER, "price_code": "VST_KAST",
+            "description": "Vestiaire kast {asset_identifier}", "bill_to": "head",
+        })
+        self.households = []
+        for i in range(4):
+            head = Member.objects.create(first_name=f"H{i}", last_name="Aerts")
+            kid = Member.objects.create(first_name=f"K{i}", last_name="Aerts", household_head=head)
+            for member in (head, kid):
+                MemberAsset.objects.create(member=member, asset_type=MemberAsset.ASSET_LOCKER, identifier=member.first_name, year=2026)
+            self.households.append(head)
+
+    def test_dry_run_writes_nothing(self):
+        from core.annual_engine import apply_assets, plan_assets, simulate_assets
+        from core.models import Invoice
+
+        plan = plan_assets(2026)
+        self.assertEqual(len(simulate_assets(2026, plan)), 8)
+        self.assertEqual(apply_assets(2026, dry_run=True, plan=plan), (8, 4))
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_bulk_lines_on_household_drafts(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from core.annual_engine import apply_assets
+        from core.models import Invoice, Member, MemberAsset
+
+        existing = Invoice.objects.create(member=self.households[0], issue_date=date(2026, 3, 1))
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(apply_assets(2026), (8, 3))
+        self.assertEqual(Invoice.objects.count(), 4)
+        existing.refresh_from_db()
+        self.assertEqual(existing.total_excl_cached, Decimal("150.00"))
+        self.assertEqual(sorted(existing.lines.values_list("description", flat=True)), ["Vestiaire kast H0", "Vestiaire kast K0"])
+
+        for i in range(20):
+            member = Member.objects.create(first_name=f"X{i}", last_name="Baerts")
+            MemberAsset.objects.create(member=member, asset_type=MemberAsset.ASSET_LOCKER, identifier=str(i), year=2026)
+        with CaptureQueriesContext(connection) as large:
+            apply_assets(2026)
+        self.assertEqual(len(large), len(small))
+
+
+class YearRuleCompilerTests(TestCase):
+    def test_compiled_rules_select_the_same_members(self):
+        from itertools import product
+        from core.models import Member, MemberAsset
+        from core.year_rules import matching_members, rule_match
+
+        births = [None, date(2010, 1, 1), date(2010, 1, 2), date(2009, 12, 31), date(1990, 6, 15), date(1959, 1, 1)]
+        for i, (dob, role, mode, course) in enumerate(product(births, ["head", "child"], ["", "flex", "investment"], [None, "", "CC", "P3"])):
+            member = Member.objects.create(first_name=str(i), date_of_birth=dob, household_role=role, membership_mode=mode, course=course)
+            if i % 3 == 0:
+                MemberAsset.objects.create(member=member, asset_type=MemberAsset.ASSET_LOCKER, active=i % 2 == 0)
+
+        rules = [
+            {"age_min": 16}, {"age_max": "15"}, {"age_min": 16, "age_max": 16}, {"age_min": 67},
+            {"mode": "flex"}, {"role": "child", "age_max": 15}, {"course": "CC"},
+            {"requires_asset": MemberAsset.ASSET_LOCKER, "course": "P3"}, {},
+        ]
+        members = [(m, {a.asset_type for a in m.memberasset_set.all() if a.active}) for m in Member.objects.prefetch_related("memberasset_set")]
+        for data in rules:
+            expected = {m.pk for m, assets in members if rule_match(m, data, 2026, asset_types=assets)[0]}
+            with self.subTest(data=data), self.assertNumQueries(1):
+                self.assertEqual(set(matching_members(data, 2026).values_list("pk", flat=True)), expected)
+
+
+class AnnualPreviewAllTests(TestCase):
+    def test_streams_one_row_per_member_and_rule(self):
+        import csv
+        import json
+        from django.core.management import call_command
+        from core.models import Member, MemberAsset, YearPricing, YearRule
+
+        YearPricing.objects.create(year=2026, code="VST_KAST", amount=Decimal("75"), vat_rate=21)
+        YearRule.objects.create(year=2026, code="VST_KAST", order=1, data={"requires_asset": "locker", "bill_to": "head_or_self"})
+        YearRule.objects.create(year=2026, code="KID", order=2, data={"age_max": 15, "unit_price_excl": "40", "quantity": 2, "vat_rate": 6})
+        head = Member.objects.create(first_name="An", last_name="Aerts", date_of_birth=date(1980, 1, 1))
+        kid = Member.objects.create(first_name="Cas", last_name="Aerts", household_head=head, date_of_birth=date(2018, 5, 1))
+        Member.objects.create(first_name="Oud", last_name="Lid", date_of_birth=date(2015, 1, 1), active=False)
+        MemberAsset.objects.create(member=kid, asset_type=MemberAsset.ASSET_LOCKER, identifier="7")
+
+        out, err = StringIO(), StringIO()
+        call_command("annual_preview_all", year=2026, stdout=out, stderr=err)
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual(
+            [(r["rule_code"], r["member_name"], r["bill_to"], r["target_id"], r["amount_excl"]) for r in rows],
+            [("VST_KAST", "Cas Aerts", "head", str(head.pk), "75.00"), ("KID", "Cas Aerts", "self", str(kid.pk), "80.00")],
+        )
+        self.assertIn("2 rijen voor 2 regels", err.getvalue())
+
+        out = StringIO()
+        call_command("annual_preview_all", year=2026, format="jsonl", stdout=out, stderr=StringIO())
+        self.assertEqual([json.loads(line)["rule_code"] for line in out.getvalue().splitlines()], ["VST_KAST", "KID"])
+
+
+def _write_csv(testcase, text):
+    """Tijdelijk CSV-bestand met `text`, opgeruimd na de test; retourneert het pad."""
+    with tempfile.NamedTemporaryFile("w", suffix=".csv", encoding="utf-8", delete=False) as fh:
+        fh.write(text)
+    testcase.addCleanup(Path(fh.name).unlink)
+    return fh.name
+
+
+class ImportMembersCsvTests(TestCase):
+    HEADER = "external_id;first_name;last_name;street;postal_code;city;country;birth_date;couple_status;course;active;email;phone_mobile;phone_private;phone_work\n"
+
+    def _import(self, body, **opts):
+        from django.core.management import call_command
+
+        out = StringIO()
+        call_command("import_members_csv", _write_csv(self, self.HEADER + body), stdout=out, stderr=StringIO(), **opts)
+        return out.getvalue()
+
+    def test_reimport_updates_only_changed_members(self):
+        from core.models import Member, YearTotalsSnapshot
+
+        rows = (
+            "10/1;An;Aerts;;;;BE;;Koppel;CC;true;an@example.com;;;\n"
+            "10/2;Bo;Aerts;;;;BE;;Koppel;CC;true;;;;\n"
+            "10/3;Cas;Aerts;;;;BE;;Koppel;;true;;;;\n"
+        )
+        self.assertIn("Aangemaakt: 3, Bijgewerkt: 0", self._import(rows))
+        head = Member.objects.get(external_id="10/1")
+        self.assertEqual(
+            sorted(Member.objects.filter(household_head=head).values_list("first_name", "household_role")),
+            [("Bo", "partner"), ("Cas", "member")],
+        )
+
+        YearTotalsSnapshot.objects.create(year=2026, household=None, code=YearTotalsSnapshot.HOUSEHOLD_CODE, stale=False)
+        # checkpoint lezen + resetten, savepoint, bestaande leden, checkpoint, release, afgewerkt
+        with self.assertNumQueries(7):
+            self.assertIn("Bijgewerkt: 0, Ongewijzigd: 3", self._import(rows))
+        self.assertFalse(YearTotalsSnapshot.objects.get(household=None).stale)
+
+        self.assertIn("Bijgewerkt: 1, Ongewijzigd: 2", self._import(rows.replace("Cas;Aerts;;;;BE;;Koppel;;", "Cas;Aerts;;;;BE;;Koppel;P3;")))
+        self.assertEqual(Member.objects.get(external_id="10/3").course, "P3")
+        self.assertTrue(YearTotalsSnapshot.objects.get(household=None).stale)
+
+    def test_interrupted_import_marks_years_of_committed_chunks_stale(self):
+        from unittest import mock
+        from core.management.commands.import_members_csv import Command
+        from core.models import Member, YearTotalsSnapshot
+
+        YearTotalsSnapshot.objects.create(year=2026, household=None, code=YearTotalsSnapshot.HOUSEHOLD_CODE, stale=False)
+        rows = "10/1;An;Aerts;;;;BE;;;;true;;;;\n11/1;Dirk;Dewit;;;;BE;;;;true;;;;\n"
+        link = Command._link_households
+        calls = []
+
+        def failing(command, *args):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError("onderbroken")
+            return link(command, *args)
+
+        with mock.patch.object(Command, "_link_households", failing), self.assertRaises(RuntimeError):
+            self._import(rows, chunk_size=1)
+        self.assertEqual(list(Member.objects.values_list("external_id", flat=True)), ["10/1"])
+        self.assertTrue(YearTotalsSnapshot.objects.get(household=None).stale)
+
+
+class StreamingImportTests(TestCase):
+    def _csv(self, rows):
+        return _write_csv(self, "external_id;course\n" + "".join(f"{n}/1;CC\n" for n in range(rows)))
+
+    def _run(self, path, process, **kwargs):
+        from core.csv_import import StreamingImport
+
+        with StreamingImport("test", path, chunk_size=3, **kwargs) as job:
+            self.assertEqual(job.fieldnames, ["external_id", "course"])
+            return job.run(process)
+
+    def test_resumes_after_interruption(self):
+        from core.models import ImportCheckpoint
+
+        path = self._csv(8)
+        seen = []
+
+        def failing(chunk, counts, state):
+            if chunk[0][0] > 2:
+                raise RuntimeError("onderbroken")
+            seen.extend(idx for idx, _row in chunk)
+            counts["rijen"] += len(chunk)
+
+        with self.assertRaises(RuntimeError):
+            self._run(path, failing)
+        checkpoint = ImportCheckpoint.objects.get(kind="test")
+        self.assertEqual((checkpoint.last_row, checkpoint.finished_at), (4, None))
+
+        def process(chunk, counts, state):
+            seen.extend(idx for idx, _row in chunk)
+            counts["rijen"] += len(chunk)
+            state["laatste"] = chunk[-1][1]["external_id"]
+
+        counts = self._run(path, process)
+        self.assertEqual(seen, list(range(2, 10)))  # elke rij precies één keer
+        self.assertEqual(counts["rijen"], 8)
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.last_row, 9)
+        self.assertEqual(checkpoint.state["state"], {"laatste": "7/1"})
+        self.assertIsNotNone(checkpoint.finished_at)
+
+    def test_finished_or_restarted_import_starts_at_the_top(self):
+        from core.models import ImportCheckpoint
+
+        path = self._csv(4)
+
+        def process(chunk, counts, state):
+            counts["rijen"] += len(chunk)
+
+        self.assertEqual(self._run(path, process)["rijen"], 4)
+        self.assertEqual(self._run(path, process)["rijen"], 4)
+
+        open_checkpoint = {"last_row": 3, "finished_at": None, "state": {"counts": {"rijen": 10}}}
+        ImportCheckpoint.objects.filter(kind="test").update(**open_checkpoint)
+        self.assertEqual(self._run(path, process)["rijen"], 12)  # hervat: 10 + rijen 4 en 5
+        ImportCheckpoint.objects.filter(kind="test").update(**open_checkpoint)
+        self.assertEqual(self._run(path, process, restart=True)["rijen"], 4)
+        self.assertEqual(ImportCheckpoint.objects.count(), 1)
+
+        # dry-run: geen checkpoint
+        ImportCheckpoint.objects.all().delete()
+        self.assertEqual(self._run(path, process, dry_run=True)["rijen"], 4)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class ImportMemberAssetsCsvTests(TestCase):
+    def _import(self, body, *args):
+        from django.core.management import call_command
+
+        path = _write_csv(self, "external_id;email;naam;straat;type;nr;active\n" + body)
+        out, err = StringIO(), StringIO()
+        call_command("import_member_assets_csv", path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_matches_members_through_the_index_and_reports_the_rest(self):
+        from core.models import Member, MemberAsset
+
+        an = Member.objects.create(first_name="Ann", last_name="Aerts", external_id="1/1", email="Ann@Example.com")
+        rene = Member.objects.create(first_name="René", last_name="Peeters", street="Dorp 1")
+        Member.objects.create(first_name="René", last_name="Peeters", street="Dorp 2")
+
+        rows = (
+            "1/1;;;;locker;5;ja\n"                  # extern id
+            ";ann@example.COM;;;locker;5;nee\n"     # e-mail, zelfde kast: bijwerken
+            ";;Peeters, RENÉ;Dorp 1;locker;7;ja\n"  # naam + straat
+            ";;René Peeters;;locker;8;ja\n"         # twee leden met die naam
+            ";;Niemand Anders;;locker;9;ja\n"
+            "1/1;;;;fiets;1;ja\n"
+        )
+        # ledenindex, checkpoint (5), één blok (assets lezen, bulk_create, checkpoint, 2 savepoints),
+        # afgewerkt, jaartotalen: niets per rij
+        with self.assertNumQueries(13):
+            out, err = self._import(rows)
+        self.assertIn("created=2, updated=1, skipped=0, missing_member=1, ambiguous_member=1, bad_type=1", out)
+        self.assertEqual(
+            sorted(MemberAsset.objects.values_list("member_id", "asset_type", "identifier", "active")),
+            sorted([(an.pk, "VST_KAST", "5", False), (rene.pk, "VST_KAST", "7", True)]),
+        )
+        self.assertIn("Rij 5: meerdere members voor naam=René Peeters.", err)
+        self.assertIn("Rij 6: geen member match", err)
+
+        from core.models import ImportCheckpoint
+        self.assertEqual(ImportCheckpoint.objects.get().state["state"], {})  # enkel tellers, geen rapport
+
+        with tempfile.TemporaryDirectory() as tmp:
+            report = Path(tmp) / "rapport.csv"
+            out, _err = self._import(rows, "--report", str(report))
+            self.assertIn("Rapport: 2 rijen zonder (eenduidig) lid", out)
+            self.assertEqual(report.read_text(encoding="utf-8").splitlines()[:2], [
+                "rij;probleem;detail", "5;ambiguous;meerdere members voor naam=René Peeters",
+            ])
+        self.assertIn("created=0, updated=2, skipped=1", out)
+
+
+class PdfExportTests(TestCase):
+    def setUp(self):
+        from unittest import mock
+        from django.contrib.auth import get_user_model
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.out_dir = Path(tmp.name)
+        for target, value in (("default_output_dir", lambda year, papier: self.out_dir), ("pdf_available", lambda: True)):
+            patcher = mock.patch(f"core.invoice_pdf.{target}", value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.force_login(get_user_model().objects.create_superuser("admin", "admin@example.com", "x"))
+
+    def _start(self):
+        from unittest import mock
+        from django.urls import reverse
+
+        with mock.patch("subprocess.Popen") as popen:
+            self.client.post(reverse("yearly-invoice-pdf-export", args=[2026, "digitaal"]), {"format": "zip"})
+        return popen.call_args[0][0] if popen.called else None
+
+    def test_lock_refuses_a_second_run_and_takes_over_a_stale_one(self):
+        from core.invoice_pdf import LOCK_FILE, RenderLocked, render_lock, running_pid
+
+        with render_lock(self.out_dir):
+            self.assertEqual(running_pid(self.out_dir), os.getpid())
+            with self.assertRaises(RenderLocked):
+                with render_lock(self.out_dir):
+                    pass
+            self.assertIsNone(self._start())
+        self.assertIsNone(running_pid(self.out_dir))
+
+        (self.out_dir / LOCK_FILE).write_text("999999999")  # gecrashte run
+        with render_lock(self.out_dir):
+            self.assertEqual(running_pid(self.out_dir), os.getpid())
+
+    def test_finished_export_is_rendered_again_and_interrupted_one_resumed(self):
+        from core.invoice_pdf import write_progress
+
+        self.assertIn("--restart", self._start())
+        write_progress(self.out_dir, year=2026, papier="digitaal", total=3, done=1, failed=0, finished=False, bundle=None)
+        self.assertNotIn("--restart", self._start())
+        write_progress(self.out_dir, year=2026, papier="digitaal", total=3, done=3, failed=0, finished=True, bundle="x.zip")
+        self.assertIn("--restart", self._start())
@@ -0,0 +1,88 @@
+"""
+Opgeslagen UBL voor gefinaliseerde facturen.
+
+Gefinaliseerde facturen zijn read-only, dus hun UBL verandert niet meer. Het document
+wordt één keer gemaakt en bewaard onder een hash van alles wat in de XML terechtkomt
+(hoofding, klant, lijnen en organisatieprofiel). Een gewijzigd profiel geeft dus
+vanzelf een andere sleutel; de oude rijen worden bij elke profielwijziging opgeruimd.
+"""
+import hashlib
+import json
+
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .ubl_writer import ubl_bytes
+
+Invoice = apps.get_model("core", "Invoice")
+OrganizationProfile = apps.get_model("core", "OrganizationProfile")
+UblDocument = apps.get_model("core", "UblDocument")
+
+_PARTY_FIELDS = ("name", "street", "city", "postal_code", "country", "vat_number", "email")
+
+
+def _s(val):
+    return None if val is None else str(val)
+
+
+def ubl_digest(invoice, org, lines) -> str:
+    account = invoice.account
+    member = invoice.member
+    payload = {
+        "v": 1,  # verhogen als ubl_writer andere output geeft
+        "number": invoice.number,
+        "pk": invoice.pk,
+        "issue_date": invoice.issue_date.isoformat(),
+        "account": [_s(getattr(account, f, None)) for f in _PARTY_FIELDS] if account is not None else None,
+        "member": [_s(getattr(member, f, None)) for f in _PARTY_FIELDS[1:]] + [str(member)] if member is not None else None,
+        "lines": [
+            [_s(getattr(l, "description", "")), _s(getattr(l, "quantity", 1)),
+             _s(getattr(l, "unit_price_excl", 0)), _s(getattr(l, "vat_rate", 0))]
+            for l in lines
+        ],
+        "org": sorted((k, _s(v)) for k, v in org.items()),
+    }
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(invoice) -> bool:
+    return getattr(invoice, "pk", None) is not None and invoice.status == Invoice.STATUS_FINAL and bool(invoice.number)
+
+
+def cached_ubl(invoice, org, lines) -> bytes:
+    """UBL voor één factuur: uit de cache voor gefinaliseerde facturen, anders gewoon gegenereerd."""
+    lines = list(lines)
+    if not is_cacheable(invoice):
+        return ubl_bytes(invoice, org, lines)
+    digest = ubl_digest(invoice, org, lines)
+    stored = UblDocument.objects.filter(digest=digest).values_list("xml", flat=True).first()
+    if stored is not None:
+        return bytes(stored)
+    xml = ubl_bytes(invoice, org, lines)
+    UblDocument.objects.bulk_create([UblDocument(digest=digest, invoice=invoice, xml=xml)], ignore_conflicts=True)
+    return xml
+
+
+def lookup_many(digests):
+    """{digest: xml} voor de reeds opgeslagen documenten (één query)."""
+    rows = UblDocument.objects.filter(digest__in=list(digests)).values_list("digest", "xml")
+    return {digest: bytes(xml) for digest, xml in rows}
+
+
+def store_many(entries):
+    """entries: iterable van (invoice, digest, xml)."""
+    UblDocument.objects.bulk_create(
+        [UblDocument(digest=digest, invoice=invoice, xml=xml) for invoice, digest, xml in entries],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=OrganizationProfile)
+@receiver(post_delete, sender=OrganizationProfile)
+def _org_profile_changed(sender, raw=False, **kwargs):
+    if raw:
+        return
+    UblDocument.objects.all().delete()
@@ -0,0 +1,130 @@
+"""
+Bulk-export van UBL-facturen als gestreamde ZIP.
+
+De facturen worden per blok geladen (met lijnen en klant in een vast aantal queries),
+de XML-documenten worden in een threadpool opgebouwd en in de ZIP geschreven zodra
+ze klaar zijn. Het archief zelf wordt nooit volledig in het geheugen gehouden.
+"""
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from django.apps import apps
+from django.db.models import Prefetch
+
+from .ubl_writer import ubl_bytes
+
+Invoice = apps.get_model("core", "Invoice")
+InvoiceLine = apps.get_model("core", "InvoiceLine")
+
+CHUNK_SIZE = 200
+DEFAULT_WORKERS = 4
+
+
+def finalized_invoices(queryset=None):
+    qs = Invoice.objects.all() if queryset is None else queryset
+    return qs.filter(status=Invoice.STATUS_FINAL).exclude(number__isnull=True).exclude(number="")
+
+
+def ubl_filename(invoice) -> str:
+    # zelfde naam als de bijlage van send_invoice_ubl
+    return f"invoice-{invoice.number or invoice.pk or 'concept'}.xml"
+
+
+def _chunks(queryset, size):
+    qs = (
+        queryset.select_related("account", "member")
+        .prefetch_related(Prefetch("lines", queryset=InvoiceLine.objects.order_by("id")))
+        .order_by("number", "pk")
+    )
+    chunk = []
+    for invoice in qs.iterator(chunk_size=size):
+        chunk.append(invoice)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _build(invoice, org, lines, digest):
+    return invoice, digest, ubl_bytes(invoice, org, lines)
+
+
+def iter_invoice_ubl(queryset, workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE):
+    """
+    Yield (factuur, xml-bytes) per blok van `chunk_size` facturen. Opgeslagen documenten
+    (core.ubl_cache) komen eerst; de ontbrekende worden in de threadpool gemaakt en bewaard.
+    """
+    from .admin_views import _org_and_payment
+    from .ubl_cache import is_cacheable, lookup_many, store_many, ubl_digest
+
+    org, _payment = _org_and_payment()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for chunk in _chunks(queryset, chunk_size):
+            prepared = []
+            for invoice in chunk:
+                lines = list(invoice.lines.all())
+                prepared.append((invoice, lines, ubl_digest(invoice, org, lines)))
+            stored = lookup_many(digest for _inv, _lines, digest in prepared)
+
+            futures = [
+                pool.submit(_build, invoice, org, lines, digest)
+                for invoice, lines, digest in prepared
+                if digest not in stored
+            ]
+            for invoice, _lines, digest in prepared:
+                if digest in stored:
+                    yield invoice, stored[digest]
+            fresh = []
+            for fut in as_completed(futures):
+                invoice, digest, xml = fut.result()
+                if is_cacheable(invoice):
+                    fresh.append((invoice, digest, xml))
+                yield invoice, xml
+            store_many(fresh)
+
+
+def iter_ubl_documents(queryset, workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE):
+    """Yield (bestandsnaam, xml-bytes) in volgorde van afwerking."""
+    for invoice, xml in iter_invoice_ubl(queryset, workers, chunk_size):
+        yield ubl_filename(invoice), xml
+
+
+class _ChunkSink:
+    """Niet-seekbare schrijfbuffer voor zipfile; de view leegt hem na elk bestand."""
+
+    def __init__(self):
+        self._parts = []
+        self._pos = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_ubl_zip(queryset, workers=DEFAULT_WORKERS, chunk_size=CHUNK_SIZE):
+    """Generator met de bytes van een ZIP-archief (één XML per gefinaliseerde factuur)."""
+    sink = _ChunkSink()
+    stamp = datetime.now().timetuple()[:6]
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in iter_ubl_documents(finalized_invoices(queryset), workers, chunk_size):
+            info = zipfile.ZipInfo(name, date_time=stamp)
+            info.compress_type = zipfile.ZIP_DEFLATED
+            zf.writestr(info, xml)
+            data = sink.drain()
+            if data:
+                yield data
+    yield sink.drain()  # centrale directory
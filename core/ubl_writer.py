@@ -0,0 +1,144 @@
+"""
+UBL 2.1-writer voor dagfacturen.
+
+Schrijft het document in één doorgang als tekst (zonder ElementTree-boom). Het
+leveranciersblok hangt enkel af van het OrganizationProfile en wordt gecachet.
+De output is byte-identiek aan de vroegere ElementTree-versie (zie core/tests.py).
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+
+NS_INVOICE = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+NS_CAC = "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+NS_CBC = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+
+_HEADER = (
+    "<?xml version='1.0' encoding='utf-8'?>\n"
+    f'<Invoice xmlns="{NS_INVOICE}" xmlns:cac="{NS_CAC}" xmlns:cbc="{NS_CBC}">'
+    "<cbc:CustomizationID>urn:cen.eu:en16931:2017</cbc:CustomizationID>"
+    "<cbc:ProfileID>urn:fdc:peppol.eu:2017:poacc:billing:01:1.0</cbc:ProfileID>"
+)
+_HUNDRED = Decimal("100")
+_ZERO = Decimal("0.00")
+
+
+def _q(val):
+    return Decimal(str(val or "0")).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+
+
+def _esc(text: str) -> str:
+    # zelfde escaping als ElementTree voor tekstinhoud
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def _cbc(tag: str, text=None) -> str:
+    if text in (None, ""):
+        return f"<cbc:{tag} />"
+    return f"<cbc:{tag}>{_esc(str(text))}</cbc:{tag}>"
+
+
+def _supplier_xml(org) -> str:
+    return (
+        "<cac:AccountingSupplierParty><cac:Party>"
+        + _cbc("EndpointID", org.get("vat_number") or "BE0000000000")
+        + "<cac:PartyName>" + _cbc("Name", org.get("name", "")) + "</cac:PartyName>"
+        + "<cac:PostalAddress>"
+        + _cbc("StreetName", org.get("address_line1", ""))
+        + _cbc("AdditionalStreetName", org.get("address_line2", ""))
+        + _cbc("CityName", org.get("city", ""))
+        + _cbc("PostalZone", org.get("postal_code", ""))
+        + _cbc("CountrySubentity", "")
+        + "<cac:Country>" + _cbc("IdentificationCode", (org.get("country") or "BE")[:2].upper()) + "</cac:Country>"
+        + "</cac:PostalAddress>"
+        + "<cac:PartyTaxScheme>" + _cbc("CompanyID", org.get("vat_number", "")) + "<cac:TaxScheme /></cac:PartyTaxScheme>"
+        + "<cac:Contact>" + _cbc("Telephone", org.get("phone", "")) + _cbc("ElectronicMail", org.get("email", "")) + "</cac:Contact>"
+        + "</cac:Party></cac:AccountingSupplierParty>"
+    )
+
+
+@lru_cache(maxsize=16)
+def _supplier_cached(org_items) -> str:
+    return _supplier_xml(dict(org_items))
+
+
+def supplier_fragment(org) -> str:
+    """Leveranciersblok; gecachet op de inhoud van het profiel (een gewijzigd profiel geeft een nieuwe sleutel)."""
+    try:
+        return _supplier_cached(tuple(sorted(org.items())))
+    except TypeError:  # niet-hashbare waarden
+        return _supplier_xml(org)
+
+
+def _customer_xml(invoice) -> str:
+    account = invoice.account
+    member = invoice.member
+    return (
+        "<cac:AccountingCustomerParty><cac:Party>"
+        + "<cac:PartyName>" + _cbc("Name", getattr(account, "name", "") or str(getattr(invoice, "member", "") or "Klant")) + "</cac:PartyName>"
+        + "<cac:PostalAddress>"
+        + _cbc("StreetName", getattr(account, "street", "") or getattr(member, "street", ""))
+        + _cbc("CityName", getattr(account, "city", "") or getattr(member, "city", ""))
+        + _cbc("PostalZone", getattr(account, "postal_code", "") or getattr(member, "postal_code", ""))
+        + "<cac:Country>"
+        + _cbc("IdentificationCode", (getattr(account, "country", "") or getattr(member, "country", "") or "BE")[:2].upper())
+        + "</cac:Country>"
+        + "</cac:PostalAddress>"
+        + "<cac:PartyTaxScheme>" + _cbc("CompanyID", getattr(account, "vat_number", "") or "") + "<cac:TaxScheme /></cac:PartyTaxScheme>"
+        + "<cac:Contact>" + _cbc("ElectronicMail", getattr(account, "email", "") or getattr(member, "email", "")) + "</cac:Contact>"
+        + "</cac:Party></cac:AccountingCustomerParty>"
+    )
+
+
+def ubl_bytes(invoice, org, lines) -> bytes:
+    """Minimale UBL 2.1-factuur (utf-8) voor een dagfactuur met haar lijnen."""
+    parts = [
+        _HEADER,
+        _cbc("ID", invoice.number or f"concept-{invoice.pk or 'temp'}"),
+        _cbc("IssueDate", invoice.issue_date.isoformat()),
+        "<cbc:InvoiceTypeCode>380</cbc:InvoiceTypeCode><cbc:DocumentCurrencyCode>EUR</cbc:DocumentCurrencyCode>",
+        supplier_fragment(org),
+        _customer_xml(invoice),
+    ]
+
+    total_excl = _ZERO
+    total_vat = _ZERO
+    append = parts.append
+    for idx, l in enumerate(lines, start=1):
+        qty = _q(getattr(l, "quantity", 1))
+        unit = _q(getattr(l, "unit_price_excl", 0))
+        vat_rate = Decimal(str(getattr(l, "vat_rate", 0) or 0))
+        line_excl = _q(qty * unit)
+        vat_amount = _q(line_excl * vat_rate / _HUNDRED)
+        total_excl += line_excl
+        total_vat += vat_amount
+        description = getattr(l, "description", "")
+        append(
+            f"<cac:InvoiceLine><cbc:ID>{idx}</cbc:ID>"
+            f"<cbc:InvoicedQuantity>{qty}</cbc:InvoicedQuantity>"
+            f"<cbc:LineExtensionAmount>{line_excl}</cbc:LineExtensionAmount>"
+            + _cbc("Note", description)
+            + f"<cac:PricingReference><cac:AlternativeConditionPrice><cbc:PriceAmount>{unit}</cbc:PriceAmount>"
+            "<cbc:PriceTypeCode>EXW</cbc:PriceTypeCode></cac:AlternativeConditionPrice></cac:PricingReference>"
+            f"<cac:TaxTotal><cbc:TaxAmount>{vat_amount}</cbc:TaxAmount>"
+            f"<cac:TaxSubtotal><cbc:TaxableAmount>{line_excl}</cbc:TaxableAmount><cbc:TaxAmount>{vat_amount}</cbc:TaxAmount>"
+            f"<cac:TaxCategory><cbc:ID>S</cbc:ID><cbc:Percent>{vat_rate}</cbc:Percent>"
+            "<cac:TaxScheme><cbc:ID>VAT</cbc:ID></cac:TaxScheme></cac:TaxCategory></cac:TaxSubtotal></cac:TaxTotal>"
+            "<cac:Item>" + _cbc("Name", description) + "</cac:Item>"
+            f"<cac:Price><cbc:PriceAmount>{unit}</cbc:PriceAmount></cac:Price></cac:InvoiceLine>"
+        )
+
+    total_incl = _q(total_excl + total_vat)
+    append(
+        f"<cac:TaxTotal><cbc:TaxAmount>{total_vat}</cbc:TaxAmount></cac:TaxTotal>"
+        f"<cac:LegalMonetaryTotal><cbc:LineExtensionAmount>{total_excl}</cbc:LineExtensionAmount>"
+        f"<cbc:TaxExclusiveAmount>{total_excl}</cbc:TaxExclusiveAmount>"
+        f"<cbc:TaxInclusiveAmount>{total_incl}</cbc:TaxInclusiveAmount>"
+        f"<cbc:PayableAmount>{total_incl}</cbc:PayableAmount></cac:LegalMonetaryTotal></Invoice>"
+    )
+    return "".join(parts).encode("utf-8")
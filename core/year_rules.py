@@ -0,0 +1,144 @@
+"""
+Voorwaarden van YearRule.data: age_min, age_max, mode, role, course, requires_asset.
+
+`rule_match` evalueert één lid in Python en legt uit waarom een regel (niet) past
+(manage.py annual_preview_member). `compile_rule` zet dezelfde voorwaarden om in een
+Q-expressie op Member: leeftijdsgrenzen worden geboortedatumgrenzen voor het jaar,
+requires_asset een Exists-subquery. `rule_members` geeft zo met één query per regel
+alle leden die eraan voldoen, in plaats van leden × regels evaluaties.
+
+Beide volgen dezelfde zachte logica: een onbekende leeftijd, mode of course sluit een
+lid niet uit (enkel een notitie bij rule_match).
+"""
+from datetime import date
+
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Member, MemberAsset, YearRule
+
+# bill_to-waarden die op de factuur van het gezinshoofd komen ("household": annual_seed_rules)
+BILL_TO_HEAD = ("head", "head_or_self", "household")
+
+
+def age_on_year(dob, year):
+    if not dob:
+        return None
+    # Leeftijd op 1 januari van het jaar
+    ref = date(year, 1, 1)
+    a = ref.year - dob.year - ((ref.month, ref.day) < (dob.month, dob.day))
+    return a
+
+
+def resolve_bill_to(member, bill_to):
+    if bill_to in (None, "", "self"):
+        return ("self", member)
+    # household_head: FK naar hoofd; als None => dit lid is het hoofd
+    head = member if member.household_head_id is None else member.household_head
+    if bill_to in BILL_TO_HEAD:
+        return ("head" if head and head.id != member.id else "self", head or member)
+    return ("self", member)
+
+
+def active_assets(member=None):
+    qs = MemberAsset.objects.filter(active=True, released_on__isnull=True)
+    return qs.filter(member=member) if member is not None else qs
+
+
+def rule_match(member, data, year, asset_types=None):
+    """
+    Zachte evaluatie van voorwaarden → (match_bool, notes[]).
+    `asset_types`: actieve asset-types van het lid, als die al ingelezen zijn (anders één query).
+    """
+    notes = []
+    match = True
+
+    # leeftijdsvoorwaarden
+    a = age_on_year(getattr(member, "date_of_birth", None), year)
+    if "age_min" in data and a is not None and a < int(data["age_min"]):
+        match = False; notes.append(f"leeftijd {a} < min {data['age_min']}")
+    if "age_max" in data and a is not None and a > int(data["age_max"]):
+        match = False; notes.append(f"leeftijd {a} > max {data['age_max']}")
+    if a is None and any(k in data for k in ("age_min","age_max")):
+        notes.append("leeftijd onbekend (kan invloed hebben)")
+
+    # membership_mode (flex/invest)
+    mode_req = data.get("mode")
+    if mode_req:
+        actual = getattr(member, "membership_mode", None)
+        if actual and actual != mode_req:
+            match = False; notes.append(f"mode={actual} <> vereist={mode_req}")
+        elif not actual:
+            notes.append("membership_mode onbekend")
+
+    # rol (algemeen)
+    role_req = data.get("role")
+    if role_req:
+        actual = getattr(member, "household_role", None)
+        if actual != role_req:
+            match = False; notes.append(f"role={actual} <> vereist={role_req}")
+
+    # course
+    course_req = data.get("course")
+    if course_req:
+        actual = getattr(member, "course", None)
+        if actual and actual != course_req:
+            match = False; notes.append(f"course={actual} <> vereist={course_req}")
+        elif actual is None:
+            notes.append("course onbekend (kan invloed hebben)")
+
+    # assets
+    req_asset = data.get("requires_asset")
+    if req_asset:
+        if asset_types is not None:
+            has = req_asset in asset_types
+        else:
+            has = active_assets(member).filter(asset_type=req_asset).exists()
+        if not has:
+            match = False; notes.append(f"benodigde asset ontbreekt: {req_asset}")
+
+    return match, notes
+
+
+def _unknown(field):
+    return Q(**{f"{field}__isnull": True}) | Q(**{field: ""})
+
+
+def compile_rule(data, year) -> Q:
+    """Q op Member die dezelfde leden selecteert als rule_match(member, data, year)[0]."""
+    q = Q()
+
+    # leeftijd a op 1/1/year: a >= n ⇔ geboren op of vóór 1/1/(year - n)
+    age = Q()
+    if "age_min" in data:
+        age &= Q(date_of_birth__lte=date(year - int(data["age_min"]), 1, 1))
+    if "age_max" in data:
+        age &= Q(date_of_birth__gt=date(year - int(data["age_max"]) - 1, 1, 1))
+    if age:
+        q &= Q(date_of_birth__isnull=True) | age
+
+    if data.get("mode"):
+        q &= Q(membership_mode=data["mode"]) | _unknown("membership_mode")
+    if data.get("role"):
+        q &= Q(household_role=data["role"])
+    if data.get("course"):
+        q &= Q(course=data["course"]) | _unknown("course")
+    if data.get("requires_asset"):
+        q &= Exists(active_assets().filter(member=OuterRef("pk"), asset_type=data["requires_asset"]))
+    return q
+
+
+def matching_members(data, year, members=None):
+    """Queryset met alle leden (uit `members`, standaard alle leden) die aan de regel voldoen."""
+    members = members if members is not None else Member.objects.all()
+    return members.filter(compile_rule(data, year))
+
+
+def rule_members(year, rules=None, members=None):
+    """
+    (regel, queryset van passende leden) voor elke regel, standaard de actieve YearRules
+    van het jaar in volgorde. Elke queryset is één query.
+    """
+    if rules is None:
+        rules = YearRule.objects.filter(year=year, active=True).order_by("order", "code")
+    for rule in rules:
+        yield rule, matching_members(rule.data or {}, year, members)
@@ -0,0 +1,338 @@
+"""
+Opgeslagen jaartotalen voor de totaalpagina.
+
+Wijzigingen aan leden, assets of prijzen markeren enkel de geraakte huishoudens
+(of bij prijzen het hele jaar) als 'stale'. Bij het openen van de pagina worden
+alleen die huishoudens herberekend; de rest komt rechtstreeks uit de tabel.
+"""
+import threading
+from decimal import Decimal
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+
+Member = apps.get_model("core", "Member")
+MemberAsset = apps.get_model("core", "MemberAsset")
+YearPricing = apps.get_model("core", "YearPricing")
+AnnualPricing = apps.get_model("core", "AnnualPricing")
+YearTotalsSnapshot = apps.get_model("core", "YearTotalsSnapshot")
+
+HOUSEHOLD = YearTotalsSnapshot.HOUSEHOLD_CODE
+
+
+def _q2(val):
+    return Decimal(str(val or "0")).quantize(Decimal("0.01"))
+
+
+def snapshot_years():
+    return list(YearTotalsSnapshot.objects.values_list("year", flat=True).distinct())
+
+
+# ---------- markeren ----------
+
+def mark_households_stale(owner_pks, years=None):
+    owner_pks = {pk for pk in owner_pks if pk}
+    if not owner_pks:
+        return
+    for year in (snapshot_years() if years is None else years):
+        existing = set(
+            YearTotalsSnapshot.objects.filter(year=year, household_id__in=owner_pks, code=HOUSEHOLD)
+            .values_list("household_id", flat=True)
+        )
+        YearTotalsSnapshot.objects.filter(year=year, household_id__in=existing, code=HOUSEHOLD).update(stale=True)
+        # nieuw huishouden: lege samenvattingsrij als marker
+        YearTotalsSnapshot.objects.bulk_create([
+            YearTotalsSnapshot(year=year, household_id=pk, code=HOUSEHOLD, stale=True)
+            for pk in owner_pks - existing
+        ])
+
+
+def mark_year_stale(year):
+    """Hele jaar opnieuw berekenen (prijswijziging, verwijderd lid, bulkimport)."""
+    YearTotalsSnapshot.objects.get_or_create(year=year, household=None, code=HOUSEHOLD, defaults={"stale": True})
+    YearTotalsSnapshot.objects.filter(year=year, household=None, code=HOUSEHOLD).update(stale=True)
+    _forget_batch()
+
+
+def _owner_pk(member):
+    if member is None:
+        return None
+    from .billing_engine import _billing_owner
+    return getattr(_billing_owner(member), "pk", None)
+
+
+# ---------- herberekenen ----------
+
+def _rows_for_preview(year, owner, preview):
+    from .admin_views import _add_preview_to_components
+
+    components = {}
+    _add_preview_to_components(components, preview)
+    line_counts = {}
+    for section in preview["sections"]:
+        for line in section["lines"]:
+            line_counts[line["code"]] = line_counts.get(line["code"], 0) + 1
+
+    rows = [YearTotalsSnapshot(
+        year=year,
+        household_id=owner.pk,
+        code=HOUSEHOLD,
+        total_excl=preview["total_excl"],
+        total_vat=preview["total_vat"],
+        total_incl=preview["total_incl"],
+        member_count=len(preview["sections"]),
+        line_count=sum(line_counts.values()),
+        notes=list(preview["notes"]),
+    )]
+    for code, item in components.items():
+        rows.append(YearTotalsSnapshot(
+            year=year,
+            household_id=owner.pk,
+            code=code,
+            description=(item["description"] or "")[:255],
+            total_excl=item["total_excl"],
+            total_vat=item["total_vat"],
+            total_incl=item["total_incl"],
+            member_count=len(item["members_map"]),
+            line_count=line_counts.get(code, 0),
+        ))
+    return rows
+
+
+@transaction.atomic
+def rebuild_households(year: int, owner_pks=None, snapshot=None):
+    """
+    Herbereken de opgegeven huishoudens (None = hele jaar). Retourneert het aantal herberekende huishoudens.
+    """
+    from .billing_engine import compile_year
+
+    year = int(year)
+    engine = compile_year(year, snapshot=snapshot)
+    owners = {o.pk: o for o in engine.owners()}
+
+    if owner_pks is None:
+        YearTotalsSnapshot.objects.filter(year=year).delete()
+        targets = list(owners)
+    else:
+        targets = [pk for pk in set(owner_pks) if pk]
+        YearTotalsSnapshot.objects.filter(year=year, household_id__in=targets).delete()
+
+    rows = []
+    for pk in targets:
+        owner = owners.get(pk)
+        if owner is None:
+            continue  # geen factuurhouder (meer)
+        rows.extend(_rows_for_preview(year, owner, engine.evaluate(owner)))
+    YearTotalsSnapshot.objects.bulk_create(rows, batch_size=500)
+    _forget_batch()
+    return len([pk for pk in targets if pk in owners])
+
+
+def refresh_stale_households(year: int):
+    """
+    Herbereken enkel de stale huishoudens (goedkoop genoeg voor een GET). Retourneert None
+    als het jaar nog niet bestaat of als geheel stale is: dan is rebuild_households(year) nodig.
+    """
+    year = int(year)
+    qs = YearTotalsSnapshot.objects.filter(year=year, code=HOUSEHOLD)
+    if not qs.exists() or qs.filter(household__isnull=True, stale=True).exists():
+        return None
+    stale = list(qs.filter(stale=True, household__isnull=False).values_list("household_id", flat=True))
+    if not stale:
+        return 0
+    return rebuild_households(year, stale)
+
+
+def read_year_totals(year: int):
+    """Componenttotalen, notities en tellers van het jaar uit de opgeslagen rijen."""
+    year = int(year)
+    components = {}
+    notes = []
+    total_excl = total_vat = total_incl = Decimal("0.00")
+    households = invoices = stale = 0
+    computed_at = None
+
+    rows = (
+        YearTotalsSnapshot.objects.filter(year=year)
+        .select_related("household")
+        .order_by("household__last_name", "household__first_name", "household_id", "code")
+    )
+    for row in rows:
+        if row.code == HOUSEHOLD:
+            if row.stale:
+                stale += 1
+            if row.household_id is None:
+                continue
+            households += 1
+            if row.line_count:
+                invoices += 1
+            total_excl += row.total_excl
+            total_vat += row.total_vat
+            total_incl += row.total_incl
+            notes.extend(row.notes or [])
+            if computed_at is None or row.computed_at < computed_at:
+                computed_at = row.computed_at
+            continue
+        item = components.setdefault(row.code, {
+            "code": row.code,
+            "description": row.description,
+            "total_excl": Decimal("0.00"),
+            "total_vat": Decimal("0.00"),
+            "total_incl": Decimal("0.00"),
+            "members": [],
+            "member_count": 0,
+        })
+        item["total_excl"] = _q2(item["total_excl"] + row.total_excl)
+        item["total_vat"] = _q2(item["total_vat"] + row.total_vat)
+        item["total_incl"] = _q2(item["total_incl"] + row.total_incl)
+        item["member_count"] += row.member_count
+
+    return {
+        "year": year,
+        "components": sorted(components.values(), key=lambda item: item["code"]),
+        "total_excl": _q2(total_excl),
+        "total_vat": _q2(total_vat),
+        "total_incl": _q2(total_incl),
+        "notes": notes,
+        "households": households,
+        "invoice_count": invoices,
+        "stale_count": stale,
+        "computed_at": computed_at,
+    }
+
+
+# ---------- signalen ----------
+#
+# Leden en assets worden per rij bewaard (admin, importen). Om die saves goedkoop te
+# houden verzamelen de signalen de geraakte huishoudens per transactie (_StaleBatch):
+# de snapshotjaren worden één keer gelezen en alles wordt één keer gemarkeerd na de
+# commit. De oude factuurhouder komt uit de geladen toestand (LoadedStateMixin); enkel
+# als een relatie echt wijzigde (of niet geladen is) volgt een SELECT.
+
+_local = threading.local()
+
+
+class _StaleBatch:
+    def __init__(self):
+        self.years = snapshot_years()
+        self.owners = set()
+
+    def flush(self):
+        if getattr(_local, "batch", None) is self:
+            _local.batch = None
+        if self.years:
+            mark_households_stale(self.owners, years=self.years)
+
+
+def _stale_batch():
+    """
+    Verzamelbak van de lopende transactie (None buiten een transactie). Een bak van een
+    teruggedraaide transactie staat niet meer bij de on_commit-callbacks en wordt vervangen.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        return None
+    batch = getattr(_local, "batch", None)
+    if batch is None or not any(entry[1] == batch.flush for entry in connection.run_on_commit):
+        batch = _local.batch = _StaleBatch()
+        transaction.on_commit(batch.flush)
+    return batch
+
+
+def _forget_batch():
+    """
+    Na het schrijven van snapshots kan er een jaar bij zijn: volgende saves starten een
+    nieuwe bak met verse jaren. De oude bak wordt nog steeds gemarkeerd na de commit.
+    """
+    _local.batch = None
+
+
+def _households_changed(owners):
+    """`owners`: callable die de geraakte factuurhouders geeft; enkel aangeroepen als er snapshots zijn."""
+    batch = _stale_batch()
+    years = batch.years if batch is not None else snapshot_years()
+    if not years:
+        return
+    owner_pks = {pk for pk in owners() if pk}
+    if batch is not None:
+        batch.owners |= owner_pks
+    else:
+        mark_households_stale(owner_pks, years=years)
+
+
+def _old_owner(sender, instance, load, update_fields=None):
+    """
+    Factuurhouder vóór deze save als die kan verschillen, anders None (dan is het dezelfde
+    als erna). `load(old)` geeft de factuurhouder van de versie uit de database.
+    """
+    if not instance.pk:
+        return None
+    if update_fields is not None and not {sender._meta.get_field(f).attname for f in update_fields} & set(sender.tracked_fields):
+        return None  # bv. import_member_courses_csv: save(update_fields=["course"])
+    if all(instance.has_loaded_state(f) and not instance.has_changed(f) for f in sender.tracked_fields):
+        return None
+    old = sender.objects.filter(pk=instance.pk).first()
+    return load(old) if old else None
+
+
+@receiver(pre_save, sender=Member)
+def _member_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._totals_old_owner = None if raw else _old_owner(sender, instance, _owner_pk, update_fields)
+
+
+@receiver(post_save, sender=Member)
+def _member_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _households_changed(lambda: {getattr(instance, "_totals_old_owner", None), _owner_pk(instance)})
+
+
+@receiver(post_delete, sender=Member)
+def _member_post_delete(sender, instance, **kwargs):
+    # gezinsleden vallen via SET_NULL los en worden eigen huishoudens
+    for year in snapshot_years():
+        mark_year_stale(year)
+
+
+@receiver(pre_save, sender=MemberAsset)
+def _asset_pre_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._totals_old_owner = None if raw else _old_owner(sender, instance, lambda old: _owner_pk(old.member), update_fields)
+
+
+@receiver(post_save, sender=MemberAsset)
+def _asset_post_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _households_changed(lambda: {getattr(instance, "_totals_old_owner", None), _owner_pk(instance.member)})
+
+
+@receiver(pre_delete, sender=MemberAsset)
+def _asset_pre_delete(sender, instance, **kwargs):
+    _households_changed(lambda: {_owner_pk(Member.objects.filter(pk=instance.member_id).first())})
+
+
+def _pricing_changed(year):
+    years = snapshot_years()
+    latest = YearPricing.objects.order_by("-year").values_list("year", flat=True).first()
+    for y in years:
+        # jaren zonder eigen prijzen vallen terug op het meest recente prijsjaar
+        if y == year or (latest is not None and year >= latest):
+            mark_year_stale(y)
+
+
+@receiver(post_save, sender=YearPricing)
+@receiver(post_delete, sender=YearPricing)
+def _yearpricing_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _pricing_changed(instance.year)
+
+
+@receiver(post_save, sender=AnnualPricing)
+@receiver(post_delete, sender=AnnualPricing)
+def _annualpricing_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    _pricing_changed(instance.year)